@@ -0,0 +1,171 @@
+import os
+import json
+import time
+import wave
+import hashlib
+import threading
+from collections import OrderedDict
+
+import metrics
+from speech import AudioBuffer
+from store import data_path
+
+CACHE_DIR = data_path('audio_cache')
+MAX_CACHE_BYTES = 1024 * 1024 * 1024  # 1 GB
+INDEX_FILE = 'index.json'
+INDEX_SAVE_INTERVAL = 30  # seconds between index writes
+
+CACHE_HITS = metrics.counter('audiobook_cache_hits_total', "Chunks read back from the audio cache")
+CACHE_MISSES = metrics.counter('audiobook_cache_misses_total', "Audio cache lookups that missed")
+
+
+def cache_key(engine, text):
+    """Content hash of a chunk and every engine setting that changes its audio."""
+    digest = hashlib.sha256()
+    for part in (engine.name, str(engine.voice), str(engine.rate), str(engine.volume), text):
+        digest.update(part.encode('utf-8', errors='ignore'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class AudioCache:
+    """On-disk cache of synthesized chunks with LRU eviction.
+
+    Entries are WAV files named by cache_key(). The LRU order and sizes
+    live in memory and are persisted to a small index file, so startup
+    does not have to stat every cached file.
+    """
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> size, least recently used first
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._dirty = False
+        self._last_save = time.monotonic()
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.wav')
+
+    def _load_index(self):
+        index_path = os.path.join(self.directory, INDEX_FILE)
+        try:
+            with open(index_path, 'r') as f:
+                for key, size in json.load(f):
+                    self.entries[key] = size
+        except FileNotFoundError:
+            self._rebuild_index()
+        except Exception as e:
+            print(f"Error loading audio cache index: {str(e)}")
+            self._rebuild_index()
+        self.total_bytes = sum(self.entries.values())
+
+    def _rebuild_index(self):
+        """Recover the index from the cached files, oldest access first."""
+        found = []
+        for sub in os.scandir(self.directory):
+            if not sub.is_dir():
+                continue
+            for entry in os.scandir(sub.path):
+                if entry.name.endswith('.wav'):
+                    stat = entry.stat()
+                    found.append((stat.st_atime, entry.name[:-4], stat.st_size))
+        self.entries.clear()
+        for _, key, size in sorted(found):
+            self.entries[key] = size
+        self._dirty = True
+
+    def get(self, key):
+        """Return the cached AudioBuffer for key, or None."""
+        with self._lock:
+            if key not in self.entries:
+                self.misses += 1
+                CACHE_MISSES.inc()
+                return None
+            self.entries.move_to_end(key)
+            self._dirty = True
+        try:
+            with wave.open(self._path(key), 'rb') as f:
+                buffer = AudioBuffer(f.readframes(f.getnframes()), f.getframerate(), None)
+        except (OSError, EOFError, wave.Error):
+            # File went missing or is damaged; forget it
+            with self._lock:
+                self.total_bytes -= self.entries.pop(key, 0)
+                self.misses += 1
+                # An index save since the lookup above would otherwise keep it
+                self._dirty = True
+            CACHE_MISSES.inc()
+            return None
+        with self._lock:
+            self.hits += 1
+        CACHE_HITS.inc()
+        return buffer
+
+    def put(self, key, buffer):
+        """Store a rendered AudioBuffer under key, evicting old entries."""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.part"
+        with wave.open(tmp_path, 'wb') as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(buffer.sample_rate)
+            f.writeframes(buffer.pcm)
+        os.replace(tmp_path, path)
+        size = os.path.getsize(path)
+
+        with self._lock:
+            self.total_bytes += size - self.entries.pop(key, 0)
+            self.entries[key] = size
+            evicted = []
+            while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+                old_key, old_size = self.entries.popitem(last=False)
+                self.total_bytes -= old_size
+                evicted.append(old_key)
+            self._dirty = True
+        for old_key in evicted:
+            try:
+                os.remove(self._path(old_key))
+            except OSError:
+                pass
+        if time.monotonic() - self._last_save > INDEX_SAVE_INTERVAL:
+            self.save_index()
+
+    def save_index(self):
+        """Persist the LRU index if it changed."""
+        with self._save_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                snapshot = list(self.entries.items())
+                self._dirty = False
+                self._last_save = time.monotonic()
+            index_path = os.path.join(self.directory, INDEX_FILE)
+            try:
+                with open(index_path + '.part', 'w') as f:
+                    json.dump(snapshot, f)
+                os.replace(index_path + '.part', index_path)
+            except Exception as e:
+                print(f"Error saving audio cache index: {str(e)}")
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        return {
+            'entries': len(self.entries),
+            'bytes': self.total_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hit_rate(),
+        }
+
+    def close(self):
+        self.save_index()
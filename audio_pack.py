@@ -0,0 +1,402 @@
+"""Seekable compressed container for a book's rendered audio.
+
+A pack holds every chunk of a book as short, independently decodable
+frames, followed by an index:
+
+    header | frame data ... | index | trailer
+
+The index maps (chunk, char offset) to a frame and each frame to its
+byte range, so seeking is a binary search plus decoding the frames from
+there to the end of the chunk. Packs are read through mmap; opening one
+reads the header, trailer and index only.
+
+Chunks are stored with their content ids (see chunker.chunk_hash), and a
+pack is matched to a book's text chunk by chunk, so after the book is
+edited it still plays every chunk that did not change. The header also
+records what the audio was rendered with (engine, voice, rate, volume);
+a player only uses a pack that matches its own engine.
+
+Frames are compressed with the best codec available: Opus (needs the
+soundfile package with libsndfile 1.0.29 or later, about 15x smaller
+than PCM), FLAC (lossless, about 2x), IMA ADPCM (needs audioop, which
+ships with Python up to 3.12; 4x) or zlib-compressed PCM.
+"""
+import io
+import os
+import sys
+import mmap
+import zlib
+import struct
+import hashlib
+import threading
+from array import array
+from bisect import bisect_right
+
+from normalize import normalize
+from speech import AudioBuffer
+from store import data_path
+
+RENDERED_DIR = data_path('rendered')
+PACK_FILE = 'book.audiopack'
+PACK_MAGIC = b'ABPK'
+PACK_VERSION = 3
+FRAME_SECONDS = 1.0  # audio per frame; a seek decodes from the frame it lands in
+OPUS_RATE = 24000  # nearest rate Opus supports to the engines' 22050 Hz
+
+# magic, version, codec, render settings id, sample rate, frame samples, chunks, chars
+HEADER = struct.Struct('<4sI8s8sIIIQ')
+TRAILER = struct.Struct('<QI4s')  # index offset, frames, magic
+SEGMENT_HEADER = struct.Struct('<4s8sI')  # per-chunk segment files: magic, codec, frames
+FRAME = struct.Struct('<III')  # encoded bytes, samples, char offset
+SEGMENT_MAGIC = b'ABFR'
+
+
+# Codecs: encode(pcm, sample_rate) -> bytes, decode(data, sample_rate) -> pcm
+
+def _soundfile():
+    try:
+        import numpy  # noqa: F401
+        import soundfile
+    except (ImportError, OSError):
+        return None
+    return soundfile
+
+
+def _resample(samples, from_rate, to_rate, count=None):
+    import numpy as np
+    if count is None:
+        count = int(round(len(samples) * to_rate / from_rate))
+    if from_rate == to_rate and count == len(samples):
+        return samples
+    positions = np.arange(count) * (from_rate / to_rate)
+    return np.interp(positions, np.arange(len(samples)), samples)
+
+
+def _encode_soundfile(pcm, sample_rate, format, subtype, rate=None):
+    import numpy as np
+    soundfile = _soundfile()
+    samples = np.frombuffer(pcm, dtype='<i2')
+    if rate:
+        samples = np.clip(np.round(_resample(samples, sample_rate, rate)), -32768, 32767).astype('<i2')
+    out = io.BytesIO()
+    soundfile.write(out, samples, rate or sample_rate, format=format, subtype=subtype)
+    return out.getvalue()
+
+
+def _decode_soundfile(data, sample_rate, samples, rate=None):
+    import numpy as np
+    decoded, _ = _soundfile().read(io.BytesIO(data), dtype='int16')
+    if rate:
+        decoded = np.clip(np.round(_resample(decoded, rate, sample_rate, samples)), -32768, 32767)
+    return decoded.astype('<i2')[:samples].tobytes()
+
+
+def _audioop():
+    try:
+        import audioop
+    except ImportError:
+        return None
+    return audioop
+
+
+def _encode_adpcm(pcm, sample_rate):
+    adpcm, _ = _audioop().lin2adpcm(pcm, 2, None)
+    return zlib.compress(adpcm)
+
+
+def _decode_adpcm(data, sample_rate, samples):
+    pcm, _ = _audioop().adpcm2lin(zlib.decompress(data), 2, None)
+    return pcm[:samples * 2]
+
+
+CODECS = {
+    'opus': (lambda pcm, rate: _encode_soundfile(pcm, rate, 'OGG', 'OPUS', OPUS_RATE),
+             lambda data, rate, samples: _decode_soundfile(data, rate, samples, OPUS_RATE)),
+    'flac': (lambda pcm, rate: _encode_soundfile(pcm, rate, 'FLAC', 'PCM_16'),
+             _decode_soundfile),
+    'adpcm': (_encode_adpcm, _decode_adpcm),
+    'pcm': (lambda pcm, rate: zlib.compress(pcm), lambda data, rate, samples: zlib.decompress(data)),
+}
+
+
+def available_codecs():
+    """Codecs usable here, smallest output first."""
+    codecs = []
+    soundfile = _soundfile()
+    if soundfile:
+        if 'OPUS' in soundfile.available_subtypes('OGG'):
+            codecs.append('opus')
+        codecs.append('flac')
+    if _audioop():
+        codecs.append('adpcm')
+    codecs.append('pcm')
+    return codecs
+
+
+def pack_path(book_id, directory=RENDERED_DIR):
+    return os.path.join(directory, book_id, PACK_FILE)
+
+
+def render_settings(engine):
+    """Everything besides the text that a speech engine's audio depends on."""
+    return {'engine': engine.name, 'voice': str(engine.voice), 'rate': engine.rate,
+            'volume': engine.volume}
+
+
+def settings_id(settings):
+    """8-byte id of render_settings(), as stored in a pack's header."""
+    parts = [str(settings[key]) for key in ('engine', 'voice', 'rate', 'volume')]
+    return hashlib.blake2b('\0'.join(parts).encode('utf-8'), digest_size=8).digest()
+
+
+def chunk_ids(text):
+    """Content ids of a text's chunks; chunk numbers for sources without them (PDF pages)."""
+    if text.index.hashes is not None:
+        return text.index.hashes
+    return array('q', range(text.chunk_count))
+
+
+# Writing
+
+def encode_chunk(pcm, sample_rate, text, codec):
+    """Split one chunk's PCM into encoded frames: a list of (data, samples, char offset).
+
+    Each frame's char offset is where in the chunk's original text its
+    speech starts, estimated from its time in the chunk.
+    """
+    encode = CODECS[codec][0]
+    frame_samples = int(FRAME_SECONDS * sample_rate)
+    total = len(pcm) // 2
+    spoken = normalize(text) if text else None
+    frames = []
+    for start in range(0, total, frame_samples):
+        samples = min(frame_samples, total - start)
+        offset = 0
+        if spoken and total:
+            offset = spoken.to_original(len(spoken.text) * start // total)
+        frames.append((encode(pcm[start * 2:(start + samples) * 2], sample_rate), samples, offset))
+    return frames
+
+
+def write_segment(path, frames, codec):
+    """Save one chunk's encoded frames (an export's unit of resumable work)."""
+    tmp_path = path + '.part'
+    with open(tmp_path, 'wb') as f:
+        f.write(SEGMENT_HEADER.pack(SEGMENT_MAGIC, codec.encode('ascii'), len(frames)))
+        for data, samples, offset in frames:
+            f.write(FRAME.pack(len(data), samples, offset))
+        for data, _, _ in frames:
+            f.write(data)
+    os.replace(tmp_path, path)
+
+
+def read_segment(path, codec):
+    """Frames saved by write_segment(); they must have been encoded with codec."""
+    with open(path, 'rb') as f:
+        magic, segment_codec, count = SEGMENT_HEADER.unpack(f.read(SEGMENT_HEADER.size))
+        if magic != SEGMENT_MAGIC:
+            raise ValueError(f"{path} is not a frame segment")
+        if segment_codec.rstrip(b'\0').decode('ascii') != codec:
+            raise ValueError(f"{path} was not encoded with {codec}")
+        table = [FRAME.unpack(f.read(FRAME.size)) for _ in range(count)]
+        return [(f.read(length), samples, offset) for length, samples, offset in table]
+
+
+class AudioPackWriter:
+    """Builds a pack from chunks added in order; close() writes the index.
+
+    chunk_ids are the content ids of the chunks to come (see chunk_ids()),
+    settings what they are rendered with (see render_settings()).
+    """
+
+    def __init__(self, path, codec, sample_rate, chunk_ids, total_chars, settings=None):
+        self.path = path
+        self._tmp_path = path + '.part'
+        self._file = open(self._tmp_path, 'wb')
+        settings = settings_id(settings) if settings else bytes(8)
+        self._file.write(HEADER.pack(PACK_MAGIC, PACK_VERSION, codec.encode('ascii'), settings,
+                                     sample_rate, int(FRAME_SECONDS * sample_rate), len(chunk_ids),
+                                     total_chars))
+        self.chunk_count = len(chunk_ids)
+        self.chunk_ids = array('q', chunk_ids)
+        self.frame_offsets = array('Q')
+        self.frame_chars = array('I')
+        self.frame_samples = array('I')
+        self.chunk_frames = array('I', [0])  # first frame of each chunk, plus the end
+
+    def add_chunk(self, frames):
+        for data, samples, offset in frames:
+            self.frame_offsets.append(self._file.tell())
+            self.frame_chars.append(offset)
+            self.frame_samples.append(samples)
+            self._file.write(data)
+        self.chunk_frames.append(len(self.frame_samples))
+
+    def close(self):
+        if len(self.chunk_frames) != self.chunk_count + 1:
+            self._file.close()
+            os.remove(self._tmp_path)
+            raise ValueError(f"pack has {len(self.chunk_frames) - 1} of {self.chunk_count} chunks")
+        index_offset = self._file.tell()
+        self.frame_offsets.append(index_offset)
+        arrays = [self.frame_offsets, self.frame_chars, self.frame_samples, self.chunk_frames,
+                  self.chunk_ids]
+        if sys.byteorder == 'big':
+            arrays = [array(a.typecode, a) for a in arrays]
+            for a in arrays:
+                a.byteswap()
+        for a in arrays:
+            a.tofile(self._file)
+        self._file.write(TRAILER.pack(index_offset, len(self.frame_samples), PACK_MAGIC))
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+
+
+# Reading
+
+class AudioPack:
+    """A book's rendered audio, read through mmap.
+
+    Only the header, trailer and index are read when opened; read()
+    decodes the frames it needs straight from the mapping. Chunks are
+    numbered as in the pack until bind() maps a text's chunks onto it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._load_index()
+        except Exception:
+            self._file.close()
+            raise
+        self._chunks = None  # pack chunk of each text chunk (-1: not in the pack)
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _load_index(self):
+        data = self._data
+        (magic, version, codec, self.settings, self.sample_rate, self.frame_samples,
+         self.chunk_count, self.total_chars) = HEADER.unpack_from(data, 0)
+        index_offset, frames, trailer_magic = TRAILER.unpack_from(data, len(data) - TRAILER.size)
+        if magic != PACK_MAGIC or trailer_magic != PACK_MAGIC or version != PACK_VERSION:
+            raise ValueError(f"{self.path} is not an audio pack")
+        self.codec = codec.rstrip(b'\0').decode('ascii')
+        if self.codec not in CODECS:
+            raise ValueError(f"Unknown codec {self.codec!r}")
+        self.frame_offsets, self.frame_chars = array('Q'), array('I')
+        self.frame_samples, self.chunk_frames = array('I'), array('I')
+        self.chunk_ids = array('q')
+        position = index_offset
+        for a, count in ((self.frame_offsets, frames + 1), (self.frame_chars, frames),
+                         (self.frame_samples, frames), (self.chunk_frames, self.chunk_count + 1),
+                         (self.chunk_ids, self.chunk_count)):
+            size = count * a.itemsize
+            a.frombytes(data[position:position + size])
+            position += size
+        if sys.byteorder == 'big':
+            for a in (self.frame_offsets, self.frame_chars, self.frame_samples, self.chunk_frames,
+                      self.chunk_ids):
+                a.byteswap()
+
+    def bind(self, text):
+        """Number chunks as in text, matched by content id; returns how many the pack has.
+
+        Sources without content ids (PDF pages) only match a pack made
+        from the same text, chunk for chunk.
+        """
+        if text.index.hashes is None:
+            same = (self.chunk_count == text.chunk_count
+                    and self.total_chars == text.index.total_chars)
+            self._chunks = array('l', range(text.chunk_count) if same else [-1] * text.chunk_count)
+        else:
+            known = {chunk_id: i for i, chunk_id in enumerate(self.chunk_ids)}
+            self._chunks = array('l', [known.get(chunk_id, -1) for chunk_id in text.index.hashes])
+        return len(self._chunks) - self._chunks.count(-1)
+
+    def rendered_with(self, settings):
+        """Whether the audio was rendered with settings (see render_settings())."""
+        return self.settings == settings_id(settings)
+
+    def has(self, chunk):
+        return self._chunks is None or self._chunks[chunk] >= 0
+
+    def matches(self, text):
+        """Whether the pack has audio for every chunk of text (binds it to text)."""
+        return self.bind(text) == text.chunk_count
+
+    def _frames(self, chunk):
+        """First frame and end frame of a chunk."""
+        if self._chunks is not None:
+            chunk = self._chunks[chunk]
+        return self.chunk_frames[chunk], self.chunk_frames[chunk + 1]
+
+    def seek(self, chunk, char_offset=0):
+        """Index of the frame holding char_offset of a chunk (binary search)."""
+        first, end = self._frames(chunk)
+        return max(first, bisect_right(self.frame_chars, char_offset, first, end) - 1)
+
+    def duration(self, chunk):
+        """Seconds of audio in a chunk."""
+        first, end = self._frames(chunk)
+        return sum(self.frame_samples[first:end]) / self.sample_rate
+
+    def frames(self, chunk):
+        """A chunk's encoded frames, as encode_chunk() returns them."""
+        first, end = self._frames(chunk)
+        with self._lock:
+            return [(self._data[self.frame_offsets[i]:self.frame_offsets[i + 1]],
+                     self.frame_samples[i], self.frame_chars[i]) for i in range(first, end)]
+
+    def read(self, chunk, char_offset=0, text=None):
+        """AudioBuffer for a chunk from char_offset on; decodes only the frames needed.
+
+        text is the chunk's text; the buffer gets the part from the frame
+        it starts at. Returns None if the pack does not have the chunk or
+        once it is closed.
+        """
+        if not self.has(chunk):
+            return None
+        decode = CODECS[self.codec][1]
+        first, end = self._frames(chunk)
+        if char_offset:
+            first = self.seek(chunk, char_offset)
+        pcm = []
+        with self._lock:
+            if self._closed:
+                return None
+            for i in range(first, end):
+                data = self._data[self.frame_offsets[i]:self.frame_offsets[i + 1]]
+                pcm.append(decode(data, self.sample_rate, self.frame_samples[i]))
+        if text and first < end:
+            text = text[self.frame_chars[first]:]
+        return AudioBuffer(b''.join(pcm), self.sample_rate, text, chunk)
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._data.close()
+            self._file.close()
+
+
+def open_pack(book_id, text, directory=RENDERED_DIR, settings=None):
+    """A book's rendered pack bound to text, or None if it has none of text's chunks.
+
+    With settings (see render_settings()), a pack rendered with others is
+    not used either.
+    """
+    path = pack_path(book_id, directory)
+    if not os.path.exists(path):
+        return None
+    try:
+        pack = AudioPack(path)
+    except (OSError, ValueError, struct.error) as e:
+        print(f"Error opening audio pack: {str(e)}")
+        return None
+    if (settings and not pack.rendered_with(settings)) or not pack.bind(text):
+        pack.close()
+        return None
+    return pack
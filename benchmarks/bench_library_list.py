@@ -0,0 +1,124 @@
+"""Library list benchmark: populate, add, remove and scroll 10k / 100k books.
+
+    python benchmarks/bench_library_list.py [--sizes 10000 100000] [--legacy]
+
+The windowing model is always measured. Widget timings need a display and
+are skipped without one; --legacy also times the old rebuild-everything
+list for comparison (slow for large sizes).
+"""
+import os
+import sys
+import time
+import argparse
+import tkinter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from library_view import ListWindow, VirtualBookList  # noqa: E402
+
+OPS = 1000
+
+
+def make_library(size):
+    return {str(i): {'id': str(i), 'title': f"Book {i:06d}"} for i in range(size)}
+
+
+def timed(label, fn):
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<32} {elapsed * 1000:10.2f} ms")
+    return elapsed
+
+
+def bench_window(library):
+    window = ListWindow(visible=5)
+    ids = list(library)
+    timed("populate", lambda: window.set_items(ids))
+    timed(f"{OPS} inserts", lambda: [window.insert(f"new{i}") for i in range(OPS)])
+    timed(f"{OPS} removes", lambda: [window.remove(f"new{i}") for i in range(OPS)])
+
+    def scroll():
+        for i in range(OPS):
+            window.scroll_to(i / OPS)
+            window.visible_items()
+    timed(f"{OPS} scroll steps", scroll)
+
+
+def bench_widgets(app, library):
+    import customtkinter as ctk
+
+    parent = ctk.CTkFrame(app)
+    parent.pack()
+    view = VirtualBookList(parent, lambda book_id: library[book_id]['title'], lambda book_id: None)
+    view.pack(fill="x")
+
+    def populate():
+        view.set_items(library.keys())
+        app.update()
+    timed("populate", populate)
+
+    def inserts():
+        for i in range(OPS):
+            book_id = f"new{i}"
+            library[book_id] = {'id': book_id, 'title': book_id}
+            view.insert(book_id)
+        app.update()
+    timed(f"{OPS} inserts", inserts)
+
+    def scroll():
+        for i in range(OPS):
+            view._on_scrollbar("moveto", i / OPS)
+        app.update()
+    timed(f"{OPS} scroll steps", scroll)
+    print(f"  {'row widgets':<32} {len(view.rows):10d}")
+    parent.destroy()
+
+
+def bench_legacy(app, library):
+    import customtkinter as ctk
+
+    book_list = ctk.CTkScrollableFrame(app, height=150)
+    book_list.pack()
+
+    def rebuild():
+        for book_id, book in library.items():
+            book_frame = ctk.CTkFrame(book_list)
+            book_frame.pack(fill="x", padx=5, pady=2)
+            title = ctk.CTkLabel(book_frame, text=book['title'])
+            title.pack(side="left", padx=10, pady=5)
+        app.update()
+    timed("full rebuild", rebuild)
+    book_list.destroy()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--legacy', action='store_true', help="also time the old full rebuild")
+    args = parser.parse_args()
+
+    app = None
+    try:
+        import customtkinter as ctk
+        app = ctk.CTk()
+    except (ImportError, tkinter.TclError) as e:
+        print(f"Widget benchmarks skipped: {str(e)}")
+
+    for size in args.sizes:
+        library = make_library(size)
+        print(f"{size} books, window model:")
+        bench_window(library)
+        if app:
+            print(f"{size} books, virtual list widgets:")
+            bench_widgets(app, library)
+            if args.legacy:
+                print(f"{size} books, legacy list widgets:")
+                bench_legacy(app, make_library(size))
+
+    if app:
+        app.destroy()
+
+
+if __name__ == "__main__":
+    main()
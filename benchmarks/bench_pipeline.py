@@ -0,0 +1,411 @@
+"""Text and playback pipeline benchmark suite, headless and reproducible.
+
+    python benchmarks/bench_pipeline.py [--text-sizes 1 100 1000] [--books 10000]
+                                        [-o results.json] [--compare baseline.json]
+
+Drives AudiobookPlayer's core logic with a silent stand-in speech engine
+and no-op widgets, so it needs neither a display nor SAPI. All data
+(library, indexes, caches) goes to a scratch directory. Concurrent
+sessions share one synthesis pool, as in the daemon. Every result is a
+time in seconds or a size in bytes, so lower is better; --compare exits
+with status 1 if any result is more than --threshold worse than the
+baseline file.
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from array import array
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SEED = 1234
+WORDS = ("the and of to a in that it was he for on are as with his they at be this from "
+         "have or by one had not but what all were when we there can an your which their "
+         "said if do will each about how up out them then she many some so these would "
+         "other into has more her two like him see time could no make than first been").split()
+SEEKS = 200
+REPEATS = 5  # cheap operations are timed this often and the median kept
+NOISE_FLOOR = 0.001  # seconds; smaller slowdowns never count as regressions
+BOOKMARKS = 50
+POSITION_RECORDS = 10000
+SESSION_WORKERS = 2
+NORMALIZE_CHUNKS = 1000  # about 1 MB of text
+PACK_CHUNKS = 20
+
+
+def peak_rss():
+    """Peak resident set size of this process in bytes, or None if unknown."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes elsewhere
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def make_text(path, megabytes):
+    """Write a deterministic text of the given size (reused between runs)."""
+    size = megabytes * 1024 * 1024
+    if os.path.exists(path) and os.path.getsize(path) == size:
+        return
+    rng = random.Random(SEED)
+    paragraphs = []
+    while sum(len(p) + 2 for p in paragraphs) < 1024 * 1024:
+        sentences = []
+        for _ in range(rng.randint(3, 8)):
+            words = [rng.choice(WORDS) for _ in range(rng.randint(6, 20))]
+            sentences.append(" ".join(words).capitalize() + rng.choice(".!?"))
+        paragraphs.append(" ".join(sentences))
+    block = "\n\n".join(paragraphs).encode('utf-8')[:1024 * 1024]
+    with open(path + '.part', 'wb') as f:
+        for _ in range(megabytes):
+            f.write(block)
+    os.replace(path + '.part', path)
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def median_time(fn, setup=None, repeats=REPEATS):
+    times = []
+    for _ in range(repeats):
+        if setup:
+            setup()
+        times.append(timed(fn)[0])
+    return sorted(times)[len(times) // 2]
+
+
+def bench_text(path):
+    """Chunking and load cost for one file; run in its own process for a clean RSS."""
+    from chunker import build_index
+    from normalize import normalize
+    from text_source import MappedText
+
+    index_file = path + '.idx'
+
+    def remove_index():
+        if os.path.exists(index_file):
+            os.remove(index_file)
+    results = {}
+    with MappedText(path) as text:
+        results['index_build'] = median_time(lambda: build_index(text._data, text.chunk_size), repeats=3)
+    results['load_cold'] = median_time(lambda: MappedText(path, index_path=index_file).close(),
+                                       setup=remove_index, repeats=3)
+    results['load_warm'] = median_time(lambda: MappedText(path, index_path=index_file).close())
+    with MappedText(path, index_path=index_file) as text:
+        results['first_chunk'] = median_time(lambda: text.chunk(0))
+        results['middle_chunk'] = median_time(lambda: text.chunk(text.chunk_count // 2))
+        chunks = [text.chunk(i) for i in range(min(text.chunk_count, NORMALIZE_CHUNKS))]
+    megabytes = sum(len(chunk.encode('utf-8')) for chunk in chunks) / (1024 * 1024)
+    # Uncached, as for chunks played for the first time
+    results['normalize_per_mb'] = median_time(
+        lambda: [normalize.__wrapped__(chunk) for chunk in chunks], repeats=3) / megabytes
+    results['peak_rss'] = peak_rss()
+    # After peak_rss, as it holds an edited copy of the text in memory
+    with MappedText(path) as text:
+        index = build_index(text._data, text.chunk_size)
+        middle = len(text._data) // 2
+        edited = text._data[:middle] + b"An inserted sentence. " + text._data[middle:]
+        results['index_rebuild_after_edit'] = median_time(
+            lambda: build_index(edited, text.chunk_size, old=index), repeats=3)
+    return results
+
+
+def run_text_benchmarks(sizes, work_dir):
+    results = {}
+    for megabytes in sizes:
+        path = os.path.join(work_dir, f"text_{megabytes}mb.txt")
+        print(f"Text {megabytes} MB")
+        make_text(path, megabytes)
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--child-text', path],
+            check=True, capture_output=True, text=True
+        ).stdout
+        for name, value in json.loads(output.splitlines()[-1]).items():
+            results[f"text_{megabytes}mb.{name}"] = value
+    return results
+
+
+def start_player():
+    """An AudiobookPlayer with no-op widgets and a silent engine, fully started."""
+    sys.modules['customtkinter'] = mock.MagicMock()
+    import main
+    from speech import LocalEngine
+
+    with mock.patch('speech.create_engine', lambda: LocalEngine(realtime=True)):
+        player = main.AudiobookPlayer()
+        player.library_thread.join()
+    player.ui._drain()
+    return player
+
+
+def run_player_benchmarks(work_dir, data_dir, books):
+    from store import Store
+    results = {}
+    player = start_player()
+
+    # Library rebuild: write, reload and redisplay the whole library
+    print(f"Library {books} books")
+    entries = [{'id': f"b{i:06d}", 'title': f"Book {i:06d}", 'path': f"book{i}.txt",
+                'added': '2024-01-01 00:00:00'} for i in range(books)]
+    results[f'library_{books}.save'] = median_time(lambda: player.store.save_books(entries))
+    results[f'library_{books}.load'] = median_time(player.load_library)
+    player.library = player.load_library()
+    results[f'library_{books}.rebuild_list'] = median_time(player.update_library_list)
+
+    # Seeks while playing: UI-side cost of the call and time until the
+    # controller has applied it
+    print("Seeks")
+    path = os.path.join(work_dir, "text_1mb.txt")
+    make_text(path, 1)
+    book = {'id': 'seek-book', 'title': 'Seek book', 'path': path}
+    player.library[book['id']] = book
+    # Books load on a background thread and reach the window through its UI channel
+    loaded = threading.Event()
+    player.load_book(book['id'], then=loaded.set)
+    while not loaded.is_set():
+        time.sleep(0.01)
+        player.ui._drain()
+    player.toggle_play()
+    rng = random.Random(SEED)
+    bookmarks = [{'position': rng.random()} for _ in range(BOOKMARKS)]
+    actions = {
+        'rewind_30': player.rewind_30,
+        'forward_30': player.forward_30,
+        'go_to_bookmark': lambda: player.go_to_bookmark(rng.choice(bookmarks)),
+    }
+    for name, action in actions.items():
+        player.playback.controller.latencies.clear()
+        calls = []
+        for _ in range(SEEKS):
+            elapsed, _ = timed(action)
+            calls.append(elapsed)
+            time.sleep(0.002)
+        time.sleep(0.1)
+        latencies = sorted(player.playback.controller.latencies)
+        results[f'seek.{name}.call_mean'] = sum(calls) / len(calls)
+        results[f'seek.{name}.applied_p50'] = latencies[len(latencies) // 2]
+        results[f'seek.{name}.applied_p95'] = latencies[int(len(latencies) * 0.95)]
+    player.toggle_play()
+
+    # Persistence: position updates go through the write-behind buffer
+    print("Persistence")
+    def record_all():
+        for i in range(POSITION_RECORDS):
+            player.playback.record_position('seek-book', i / POSITION_RECORDS, i)
+    results['persist.record_position_mean'] = median_time(record_all) / POSITION_RECORDS
+    results['persist.flush'] = median_time(player.positions.flush, setup=record_all)
+    store = Store(os.path.join(data_dir, 'direct.db'))
+    elapsed, _ = timed(lambda: [store.save_position('seek-book', i / 100, i, '') for i in range(100)])
+    results['persist.save_position_direct_mean'] = elapsed / 100
+    elapsed, _ = timed(lambda: [store.add_bookmark('seek-book', {'position': i / 100}) for i in range(100)])
+    results['persist.add_bookmark_mean'] = elapsed / 100
+    store.close()
+
+    player.playback.close()
+    player.positions.close()
+    player.search_index.close()
+    player.audio_cache.close()
+    player.store.close()
+    return results
+
+
+def speech_like_pcm(seconds):
+    """Bursts of harmonics at varying pitch, with pauses, like rendered speech."""
+    from speech import SAMPLE_RATE
+    rng = random.Random(SEED)
+    samples = array('h')
+    while len(samples) < seconds * SAMPLE_RATE:
+        pitch = rng.uniform(90, 250)
+        length = int(rng.uniform(0.1, 0.4) * SAMPLE_RATE)
+        samples.extend(int(6000 * math.sin(2 * math.pi * pitch * i / SAMPLE_RATE)
+                           + 2000 * math.sin(6 * math.pi * pitch * i / SAMPLE_RATE))
+                       for i in range(length))
+        samples.extend([0] * int(rng.uniform(0, 0.15) * SAMPLE_RATE))
+    return samples.tobytes()
+
+
+def run_stretch_benchmarks():
+    """Time-stretch cost per second of audio, on one minute of speech-like PCM."""
+    import timestretch
+    from speech import SAMPLE_RATE
+    if not timestretch.available():
+        print("Time-stretch skipped (numpy not installed)")
+        return {}
+    print("Time-stretch")
+    pcm = speech_like_pcm(60)
+    seconds = len(pcm) / 2 / SAMPLE_RATE
+    return {f'stretch.{speed}x_per_audio_second':
+            median_time(lambda: timestretch.stretch_pcm(pcm, SAMPLE_RATE, speed), repeats=3) / seconds
+            for speed in (0.5, 1.5, 2.0)}
+
+
+def run_pack_benchmarks(work_dir):
+    """Size and seek cost of a rendered-book pack, 20 one-minute chunks of speech-like PCM."""
+    import audio_pack
+    from speech import SAMPLE_RATE
+    codec = audio_pack.available_codecs()[0]
+    print(f"Audio pack ({codec})")
+    pcm = speech_like_pcm(60)
+    text = "Word " * 200
+    path = os.path.join(work_dir, 'bench.audiopack')
+    writer = audio_pack.AudioPackWriter(path, codec, SAMPLE_RATE, range(PACK_CHUNKS),
+                                        len(text) * PACK_CHUNKS)
+    frames = audio_pack.encode_chunk(pcm, SAMPLE_RATE, text, codec)
+    for _ in range(PACK_CHUNKS):
+        writer.add_chunk(frames)
+    writer.close()
+    rng = random.Random(SEED)
+    seeks = [(rng.randrange(PACK_CHUNKS), rng.randrange(len(text))) for _ in range(SEEKS)]
+    pack = audio_pack.AudioPack(path)
+    try:
+        # A seek decodes from the frame it lands in to the end of its chunk
+        seek_read = median_time(lambda: [pack.read(chunk, offset) for chunk, offset in seeks],
+                                repeats=3) / SEEKS
+        return {
+            f'pack.{codec}_bytes_per_audio_second': os.path.getsize(path) / (PACK_CHUNKS * 60),
+            f'pack.{codec}_seek_read_mean': seek_read,
+            'pack.open': median_time(lambda: audio_pack.AudioPack(path).close()),
+        }
+    finally:
+        pack.close()
+        os.remove(path)
+
+
+def run_session_benchmarks(work_dir, sessions):
+    """Many sessions starting at once on one shared synthesis pool."""
+    from speech import LocalEngine
+    from store import Store, PositionWriter
+    from scheduler import SynthesisScheduler
+    from playback import PlaybackEngine
+
+    print(f"Sessions {sessions}")
+    path = os.path.join(work_dir, "text_1mb.txt")
+    make_text(path, 1)
+    store = Store()
+    positions = PositionWriter(store)
+    scheduler = SynthesisScheduler(SESSION_WORKERS)
+    players, started = [], {}
+    for i in range(sessions):
+        # Different positions so no two sessions render the same chunks
+        book = {'id': f"session-{i}", 'title': f"Session {i}", 'path': path}
+        store.save_book(book)
+        store.save_position(book['id'], i / sessions, 0, '')
+        player = PlaybackEngine(store, positions, LocalEngine(realtime=True), None, scheduler)
+        player.on_chunk = lambda index, count, i=i: started.setdefault(i, time.perf_counter())
+        player.load(book)
+        players.append(player)
+    for player in players:
+        player.controller.sync()
+    begin = time.perf_counter()
+    for player in players:
+        player.play()
+    while len(started) < sessions and time.perf_counter() - begin < 10:
+        time.sleep(0.005)
+    waits = sorted(started.get(i, time.perf_counter()) - begin for i in range(sessions))
+    stats = scheduler.stats()
+    for player in players:
+        player.close()
+    scheduler.shutdown()
+    positions.close()
+    store.close()
+    return {
+        f'sessions_{sessions}.first_chunk_p50': waits[len(waits) // 2],
+        f'sessions_{sessions}.first_chunk_max': waits[-1],
+        f'sessions_{sessions}.cpu_per_audio_second':
+            stats['cpu_seconds'] / stats['audio_seconds'] if stats['audio_seconds'] else None,
+        f'sessions_{sessions}.underruns': sum(player.controller.underruns for player in players),
+    }
+
+
+def compare(results, baseline, threshold):
+    """Print changes against a baseline; returns the names that regressed."""
+    regressions = []
+    for name, value in sorted(results.items()):
+        old = baseline.get(name)
+        if value is None or not old:
+            continue
+        change = (value - old) / old
+        flag = ""
+        noise = not name.endswith('rss') and value - old < NOISE_FLOOR
+        if change > threshold and not noise:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(f"  {name:<44} {old:12.6g} -> {value:12.6g} ({change:+.0%}){flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--text-sizes', type=int, nargs='+', default=[1, 100],
+                        help="text sizes in MB (add 1000 for the 1 GB case)")
+    parser.add_argument('--books', type=int, default=10000, help="library size for the rebuild benchmark")
+    parser.add_argument('--sessions', type=int, default=8, help="concurrent playback sessions")
+    parser.add_argument('--work-dir', help="where generated texts are kept between runs")
+    parser.add_argument('-o', '--output', help="write results to this JSON file")
+    parser.add_argument('--compare', help="baseline JSON file from an earlier run")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="allowed slowdown against the baseline (default 0.2 = 20%%)")
+    parser.add_argument('--child-text', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child_text:
+        print(json.dumps(bench_text(args.child_text)))
+        return 0
+
+    work_dir = args.work_dir or os.path.join(tempfile.gettempdir(), 'audiobook-bench')
+    os.makedirs(work_dir, exist_ok=True)
+    # Keep the player's database, indexes and caches out of the real data dir
+    data_dir = tempfile.mkdtemp(prefix='audiobook-bench-data-')
+    os.environ['APPDATA'] = os.environ['XDG_DATA_HOME'] = data_dir
+    try:
+        results = run_text_benchmarks(args.text_sizes, work_dir)
+        results.update(run_player_benchmarks(work_dir, data_dir, args.books))
+        results.update(run_session_benchmarks(work_dir, args.sessions))
+        results.update(run_stretch_benchmarks())
+        results.update(run_pack_benchmarks(work_dir))
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        },
+        'results': results,
+    }
+    for name, value in sorted(results.items()):
+        print(f"  {name:<44} {value!s:>14}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        print(f"Compared with {args.compare}:")
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regressions beyond {args.threshold:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,217 @@
+import os
+import re
+import sys
+import zlib
+import struct
+import hashlib
+from array import array
+from bisect import bisect_right
+
+from speech import WORDS_PER_SECOND
+from store import data_path
+
+CHUNK_SIZE = 1000  # target bytes per spoken chunk
+
+INDEX_DIR = data_path('index')
+INDEX_MAGIC = b'ABIX'
+INDEX_VERSION = 2
+INDEX_HEADER = struct.Struct('<4sIQQdI')  # magic, version, chunks, size, mtime, target
+ANCHOR_BYTES = 16  # text before a sentence end that decides whether chunks may end there
+ANCHOR_ODDS = 8  # about one sentence end in this many is a chunk boundary
+
+PARAGRAPH_END = re.compile(rb'\n[ \t\r\f\v]*\n\s*')
+SENTENCE_END = re.compile(rb'(?:[.!?]|\xe2\x80\xa6)+["\')\]]*\s+')
+# Either of the above; the lookahead lets the regex engine skip to candidates
+BREAK = re.compile(rb'(?=[\n.!?\xe2])(?:' + PARAGRAPH_END.pattern + rb'|' + SENTENCE_END.pattern + rb')')
+WHITESPACE = re.compile(rb'\s+')
+CONTINUATION_BYTES = bytes(range(0x80, 0xC0))
+UTF8_BOM = b'\xef\xbb\xbf'
+
+
+def chunk_hash(data):
+    """64-bit content id of a chunk's bytes."""
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'little', signed=True)
+
+
+class ChunkIndex:
+    """Compact per-book table of chunk char offsets, byte offsets and durations.
+
+    char_offsets and byte_offsets hold one extra trailing entry (the end of
+    the text), so chunk i spans offsets[i]:offsets[i + 1]. hashes holds each
+    chunk's content id (chunk_hash), or is None for sources whose chunks
+    are not cut from text (PDF pages).
+    """
+
+    def __init__(self, char_offsets, byte_offsets, durations, target=CHUNK_SIZE, hashes=None):
+        self.char_offsets = char_offsets
+        self.byte_offsets = byte_offsets
+        self.durations = durations
+        self.target = target
+        self.hashes = hashes
+        self.source = None  # (size, mtime) of the file a loaded index was built from
+        self.version = 0  # bumped when durations are refined in place
+
+    def __len__(self):
+        return len(self.durations)
+
+    @property
+    def total_chars(self):
+        return self.char_offsets[-1] if self.char_offsets else 0
+
+    def chunk_at_char(self, char_offset):
+        """Index of the chunk containing char_offset (binary search)."""
+        if not len(self):
+            return 0
+        i = bisect_right(self.char_offsets, char_offset) - 1
+        return max(0, min(i, len(self) - 1))
+
+    def chunk_at(self, fraction):
+        """Index of the chunk at a position fraction (0-1)."""
+        # Rounded so a fraction taken from fraction() maps back to its chunk
+        return self.chunk_at_char(round(fraction * self.total_chars))
+
+    def fraction(self, chunk):
+        """Position fraction (0-1) at the start of a chunk."""
+        if not self.total_chars:
+            return 0.0
+        return self.char_offsets[min(chunk, len(self))] / self.total_chars
+
+    def save(self, path, source_size, source_mtime):
+        """Write the index, tagged with the source file it was built from."""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        arrays = [self.char_offsets, self.byte_offsets, self.durations, self.hashes]
+        if sys.byteorder == 'big':
+            arrays = [array(a.typecode, a) for a in arrays]
+            for a in arrays:
+                a.byteswap()
+        tmp_path = path + '.part'
+        with open(tmp_path, 'wb') as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, len(self),
+                                      source_size, source_mtime, self.target))
+            for a in arrays:
+                a.tofile(f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, source_size=None, source_mtime=None):
+        """Read a saved index, or return None if missing or stale.
+
+        Without source_size and source_mtime the index is returned even if
+        the file changed since; its source attribute tells.
+        """
+        try:
+            with open(path, 'rb') as f:
+                magic, version, count, size, mtime, target = INDEX_HEADER.unpack(
+                    f.read(INDEX_HEADER.size))
+                if magic != INDEX_MAGIC or version != INDEX_VERSION:
+                    return None
+                if source_size is not None and (size != source_size or mtime != source_mtime):
+                    return None
+                char_offsets, byte_offsets = array('Q'), array('Q')
+                durations, hashes = array('f'), array('q')
+                char_offsets.fromfile(f, count + 1)
+                byte_offsets.fromfile(f, count + 1)
+                durations.fromfile(f, count)
+                hashes.fromfile(f, count)
+        except (OSError, EOFError, struct.error):
+            return None
+        if sys.byteorder == 'big':
+            for a in (char_offsets, byte_offsets, durations, hashes):
+                a.byteswap()
+        index = cls(char_offsets, byte_offsets, durations, target, hashes)
+        index.source = (size, mtime)
+        return index
+
+
+def find_cut(data, start, size, target=CHUNK_SIZE, utf8=True):
+    """Byte offset where the chunk starting at start should end.
+
+    Boundaries are chosen by content: a chunk ends at the first paragraph
+    break or sentence end, at least half a target in, whose preceding
+    ANCHOR_BYTES hash to an anchor. The same text is then cut the same way
+    wherever it sits in the book, so an edit only moves the boundaries
+    next to it. Failing that, prefers a paragraph break, then a sentence
+    end, then any whitespace within half a target of the ideal length, and
+    only then a hard cut on a character boundary.
+    """
+    if size - start <= target * 3 // 2:
+        return size
+    lo = start + target // 2
+    ideal = start + target
+    window = data[lo:start + target * 3 // 2]
+
+    for match in BREAK.finditer(window):
+        cut = lo + match.end()
+        if zlib.crc32(data[cut - ANCHOR_BYTES:cut]) % ANCHOR_ODDS == 0:
+            return cut
+
+    for pattern in (PARAGRAPH_END, SENTENCE_END, WHITESPACE):
+        best = None
+        for match in pattern.finditer(window):
+            cut = lo + match.end()
+            if best is None or abs(cut - ideal) < abs(best - ideal):
+                best = cut
+            elif cut > ideal:
+                break
+        if best is not None:
+            return best
+
+    cut = ideal
+    while utf8 and cut > start and data[cut] & 0xC0 == 0x80:
+        cut -= 1
+    return cut if cut > start else ideal
+
+
+def build_index(data, target=CHUNK_SIZE, encoding='utf-8', old=None):
+    """Segment encoded text (e.g. an mmap) into sentence-aligned chunks.
+
+    Handles UTF-8 and single-byte encodings. Streams through the data
+    once, touching only a window around each cut.
+
+    old is the index of an earlier version of the text. Its chunks are
+    checked in order by hashing the bytes where they would now be, and
+    kept while they match; only text around an edit is cut again, until a
+    new chunk is found among the old ones by content and checking resumes
+    after it.
+    """
+    utf8 = encoding == 'utf-8'
+    size = len(data)
+    start = len(UTF8_BOM) if utf8 and data[:len(UTF8_BOM)] == UTF8_BOM else 0
+    char_offsets, byte_offsets, durations = array('Q', [0]), array('Q', [start]), array('f')
+    hashes = array('q')
+    known = {chunk_id: i for i, chunk_id in enumerate(old.hashes)} if old else {}
+    expected = 0 if old else None  # old chunk that may come next
+    chars = 0
+    while start < size:
+        i = expected if expected is not None and expected < len(old) else None
+        if i is not None:
+            end = start + old.byte_offsets[i + 1] - old.byte_offsets[i]
+            chunk = data[start:end]
+            chunk_id = chunk_hash(chunk)
+            if end > size or chunk_id != old.hashes[i]:
+                i = None
+        if i is None:
+            end = find_cut(data, start, size, target, utf8)
+            chunk = data[start:end]
+            chunk_id = chunk_hash(chunk)
+            i = known.get(chunk_id)
+        if i is not None:
+            # Unchanged text; its length and duration are known
+            chars += old.char_offsets[i + 1] - old.char_offsets[i]
+            durations.append(old.durations[i])
+            expected = i + 1
+        else:
+            chars += len(chunk.translate(None, CONTINUATION_BYTES)) if utf8 else len(chunk)
+            # Estimated seconds at speech rate 0
+            durations.append(len(chunk.split()) / WORDS_PER_SECOND)
+            expected = None
+        char_offsets.append(chars)
+        byte_offsets.append(end)
+        hashes.append(chunk_id)
+        start = end
+    return ChunkIndex(char_offsets, byte_offsets, durations, target, hashes)
+
+
+def index_path(book):
+    """Where a library entry's chunk index is persisted."""
+    return book.get('index') or os.path.join(INDEX_DIR, f"{book['id']}.idx")
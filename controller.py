@@ -0,0 +1,397 @@
+import queue
+import threading
+import time
+from collections import deque
+
+import metrics
+import timestretch
+from audio_pack import render_settings
+from normalize import normalize
+from prerender import PrerenderPipeline
+
+POLL_INTERVAL = 0.02  # seconds; bounds how long a command can wait
+LATENCY_SAMPLES = 200
+
+CHUNK_GAP = metrics.histogram(
+    'audiobook_chunk_gap_seconds', "Silence between one chunk ending and the next starting")
+QUEUE_DEPTH = metrics.histogram(
+    'audiobook_prerender_queue_depth', "Chunks rendered ahead when a chunk starts",
+    metrics.DEPTH_BUCKETS)
+COMMAND_LATENCY = metrics.histogram(
+    'audiobook_command_latency_seconds', "Time from posting a command to it taking effect")
+UNDERRUNS = metrics.counter(
+    'audiobook_underruns_total', "Times playback ran out of rendered audio between chunks")
+
+
+class PlaybackController:
+    """Owns playback on a worker thread, driven through a command queue.
+
+    The GUI only ever posts commands (load, play, pause, seek, set_speed,
+    set_rate, stop), so it never blocks on the speech engine. The worker plays
+    pre-rendered buffers asynchronously and polls the engine and the
+    queue every POLL_INTERVAL, so commands take effect within a few tens
+    of milliseconds even in the middle of a long chunk.
+
+    Callbacks run on the worker thread:
+        on_chunk(index, count)        a chunk started playing
+        on_progress(position, index)  a chunk finished; position is a fraction
+        on_state(state)               'playing', 'paused' or 'stopped'
+    """
+
+    def __init__(self, engine, cache=None, scheduler=None):
+        self.engine = engine
+        self.cache = cache
+        self.scheduler = scheduler  # shared SynthesisScheduler, if any
+        self.text = None
+        self.book_id = None
+        self.pack = None  # the book's rendered AudioPack, if any
+        self.pipeline = None
+        self.state = 'stopped'
+        self.position = 0.0
+        self.chunk = 0
+        self.buffer = None  # buffer currently playing (or paused)
+        self.speed = 1.0  # applied by time-stretching, if numpy is available
+        self._playing = None  # self.buffer as handed to the engine (stretched, trimmed)
+        self._play_offset = 0.0  # seconds of speech into self.buffer where it started
+        self._resume_offset = 0.0  # seconds of speech into self.buffer where it was paused
+        self._start_at = None  # (chunk, char offset) the next chunk started should play from
+        self._chunk_started = 0.0
+        self._chunk_ended = None  # when the last chunk finished, while playing on
+        self._starved = False  # the next chunk was late; counted once per gap
+        self.underruns = 0
+
+        self.on_chunk = None
+        self.on_progress = None
+        self.on_state = None
+
+        # Seconds from posting a command to it taking effect
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+
+        self._commands = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='playback', daemon=True)
+        self._thread.start()
+
+    # Commands, safe to call from any thread
+
+    def load(self, text, position=0.0, book_id=None, pack=None):
+        """Play text from position; pack is its rendered audio, if there is any.
+
+        The controller owns the pack from then on and closes it. The text
+        it was playing before is closed once its pipeline has stopped.
+        """
+        self._post('load', (text, position, book_id, pack))
+
+    def play(self):
+        self._post('play')
+
+    def pause(self):
+        self._post('pause')
+
+    def seek(self, position):
+        self._post('seek', position)
+
+    def set_speed(self, speed):
+        self._post('set_speed', speed)
+
+    def set_rate(self, rate):
+        self._post('set_rate', rate)
+
+    def stop(self):
+        self._post('stop')
+
+    def sync(self, timeout=1.0):
+        """Wait until every command posted so far has been applied."""
+        done = threading.Event()
+        self._post('sync', done)
+        return done.wait(timeout)
+
+    def shutdown(self):
+        self._post('quit')
+        self._thread.join(timeout=1)
+
+    def current_position(self):
+        """Position (0-1) of the words being spoken now, estimated from time played.
+
+        Falls back to self.position when nothing is playing: the start of
+        the chunk, or where playback was paused or sought to.
+        """
+        buffer, playing, text = self.buffer, self._playing, self.text
+        if self.state != 'playing' or buffer is None or playing is None or not text:
+            return self.position
+        seconds = buffer.speech_seconds
+        if seconds <= 0:
+            return self.position
+        played = self._play_offset + (time.perf_counter() - self._chunk_started) * playing.speed
+        fraction = min(1.0, played / seconds)
+        chunk = text.chunk(buffer.index)
+        skipped = len(chunk) - len(buffer.text or chunk)
+        if skipped > 0:
+            # Read from a pack mid-chunk; buffer.text is the rest of the chunk
+            offset = skipped + fraction * (len(chunk) - skipped)
+        else:
+            # Speech runs through the normalized text; map that back to the book's
+            spoken = normalize(chunk)
+            offset = spoken.to_original(int(fraction * len(spoken.text)))
+        start, end = text.position_of(buffer.index), text.position_of(buffer.index + 1)
+        return start + (end - start) * offset / max(1, len(chunk))
+
+    def control_latency(self):
+        """(mean, max) command latency in seconds over recent commands."""
+        samples = list(self.latencies)
+        if not samples:
+            return 0.0, 0.0
+        return sum(samples) / len(samples), max(samples)
+
+    def _post(self, name, arg=None):
+        self._commands.put((name, arg, time.perf_counter()))
+
+    # Worker thread
+
+    def _run(self):
+        while True:
+            timeout = POLL_INTERVAL if self.state == 'playing' else None
+            try:
+                name, arg, posted = self._commands.get(timeout=timeout)
+            except queue.Empty:
+                name = None
+            if name == 'quit':
+                self._hold_position()
+                self._stop_engine()
+                if self.pipeline:
+                    self.pipeline.close()
+                if self.pack:
+                    self.pack.close()
+                return
+            if name:
+                try:
+                    getattr(self, '_do_' + name)(arg)
+                except Exception as e:
+                    print(f"Error handling {name}: {str(e)}")
+                latency = time.perf_counter() - posted
+                self.latencies.append(latency)
+                COMMAND_LATENCY.observe(latency)
+                continue
+            try:
+                self._advance()
+            except Exception as e:
+                print(f"Error playing text: {str(e)}")
+                import traceback
+                traceback.print_exc()
+                self._stop_engine()
+                self._set_state('stopped')
+
+    def _advance(self):
+        """Start the next buffer or check on the one playing."""
+        if self.buffer is None:
+            try:
+                buffer = self.pipeline.next(timeout=POLL_INTERVAL)
+            except TimeoutError:
+                if self._chunk_ended is not None and not self._starved:
+                    # Mid-book and the next chunk is not rendered yet
+                    self._starved = True
+                    self.underruns += 1
+                    UNDERRUNS.inc()
+                    metrics.trace('underrun', book=self.book_id, chunk=self.chunk + 1)
+                return
+            if buffer is None:
+                print("Playback completed")
+                self.position = 1.0
+                self._set_state('stopped')
+                return
+            self.buffer = buffer
+            self.chunk = buffer.index
+            self.position = self.text.position_of(buffer.index)
+            depth = self.pipeline.depth()
+            offset = 0.0
+            if self._start_at and self._start_at[0] == buffer.index:
+                # First chunk after a seek or load lands mid-chunk
+                offset = self._seconds_into(buffer, self._start_at[1])
+            self._start_at = None
+            self._start(offset)
+            self._starved = False
+            started = self._chunk_started
+            gap = None
+            if self._chunk_ended is not None:
+                gap = started - self._chunk_ended
+                CHUNK_GAP.observe(gap)
+            QUEUE_DEPTH.observe(depth)
+            metrics.trace('chunk_start', book=self.book_id, chunk=buffer.index,
+                          count=self.text.chunk_count, gap=gap, depth=depth)
+            if self.on_chunk:
+                self.on_chunk(buffer.index, self.text.chunk_count)
+        elif self.engine.wait(0):
+            self._chunk_ended = time.perf_counter()
+            metrics.trace('chunk_end', book=self.book_id, chunk=self.chunk,
+                          seconds=self._chunk_ended - self._chunk_started)
+            self.buffer = None
+            self.position = self.text.position_of(self.chunk + 1)
+            if self.on_progress:
+                self.on_progress(self.position, self.chunk)
+
+    def _set_state(self, state):
+        if state != self.state:
+            self.state = state
+            # Only gaps during continuous playback count
+            self._chunk_ended = None
+            if self.pipeline and state != 'playing':
+                self.pipeline.set_playing(None)
+            elif self.pipeline and self.buffer is None:
+                # Nothing rendered yet: the first chunk is due now
+                self.pipeline.set_playing(time.monotonic())
+            metrics.trace('state', book=self.book_id, state=state)
+            if self.on_state:
+                self.on_state(state)
+
+    def _start(self, offset=0.0):
+        """Hand self.buffer to the engine from offset seconds of speech in, at self.speed."""
+        buffer = self.buffer
+        if offset or buffer.speed != self.speed:
+            buffer = timestretch.stretch(buffer, self.speed, offset)
+        self.engine.start(buffer)
+        self._playing = buffer
+        self._play_offset = offset
+        self._chunk_started = time.perf_counter()
+        self.pipeline.set_playing(time.monotonic() + buffer.duration)
+
+    def _played(self):
+        """Seconds of speech into self.buffer played so far."""
+        played = self._play_offset + (time.perf_counter() - self._chunk_started) * self._playing.speed
+        return min(played, self.buffer.speech_seconds)
+
+    def _seconds_into(self, buffer, char_offset):
+        """Seconds of speech into a chunk's buffer where char_offset of its text is spoken."""
+        chunk = self.text.chunk(buffer.index)
+        if char_offset <= 0 or len(buffer.text or chunk) < len(chunk):
+            # Nothing to skip, or read from a pack already starting there
+            return 0.0
+        spoken = normalize(chunk)
+        fraction = spoken.to_spoken(char_offset) / max(1, len(spoken.text))
+        return min(fraction, 1.0) * buffer.speech_seconds
+
+    def _hold_position(self):
+        """Keep the position of the words being spoken before the engine stops."""
+        if self.state == 'playing' and self.buffer is not None:
+            self.position = self.current_position()
+
+    def _stop_engine(self):
+        self._chunk_ended = None
+        if self.buffer is not None:
+            self.engine.stop()
+            self.engine.wait(0)
+            self.buffer = None
+
+    def _char_offset(self, position):
+        """Chars into the current chunk at position, where playing it starts."""
+        index = self.text.index
+        return max(0, round(position * index.total_chars) - index.char_offsets[self.chunk])
+
+    def _restart(self, chunk, char_offset=0):
+        """Throw away queued audio and render again from chunk."""
+        self._stop_engine()
+        self._start_at = (chunk, char_offset) if char_offset else None
+        if self.pipeline:
+            self.pipeline.start(chunk, char_offset)
+            if self.state == 'playing':
+                self.pipeline.set_playing(time.monotonic())
+
+    def _do_load(self, arg):
+        text, position, book_id, pack = arg
+        self._hold_position()
+        self._stop_engine()
+        self._set_state('stopped')
+        if self.pipeline:
+            self.pipeline.close()
+            self.pipeline = None
+        if self.pack:
+            self.pack.close()
+        if self.text and self.text is not text:
+            # Nothing reads the old book any more; PDFs also stop extracting
+            self.text.close()
+        self.text = text
+        self.book_id = book_id
+        self.pack = pack
+        self.position = position
+        if text:
+            self.pipeline = PrerenderPipeline(self.engine, text, cache=self.cache,
+                                              scheduler=self.scheduler, pack=pack)
+            self.pipeline.speed = self.speed
+            self.chunk = text.chunk_at(position)
+            char_offset = self._char_offset(position)
+            self._start_at = (self.chunk, char_offset) if char_offset else None
+            self.pipeline.start(self.chunk, char_offset)
+
+    def _do_play(self, arg):
+        if not self.pipeline or self.position >= 1.0:
+            # Nothing to play; report the unchanged state back
+            if self.on_state:
+                self.on_state(self.state)
+            return
+        if self.state == 'playing':
+            return
+        if self.buffer is not None:
+            # Resume the paused chunk where it stopped
+            self._start(self._resume_offset)
+        self._set_state('playing')
+
+    def _do_pause(self, arg):
+        if self.state != 'playing':
+            return
+        if self.buffer is not None:
+            self._resume_offset = self._played()
+            self._hold_position()
+            self.engine.stop()
+            self.engine.wait(0)
+        self._set_state('paused')
+
+    def _do_seek(self, position):
+        if not self.text:
+            return
+        self.position = position
+        self.chunk = self.text.chunk_at(position)
+        self._restart(self.chunk, self._char_offset(position))
+
+    def _do_set_rate(self, rate):
+        self.engine.rate = rate
+        if not self.pipeline:
+            return
+        if self.pack and not self.pack.rendered_with(render_settings(self.engine)):
+            # Rendered at another rate; synthesize from here on
+            self.pipeline.pack = None
+            self.pack.close()
+            self.pack = None
+        if self.state == 'playing' and self.buffer is not None:
+            # Let the current chunk finish; re-render what follows it
+            self.pipeline.start(self.chunk + 1)
+        else:
+            self._restart(self.chunk, self._char_offset(self.position))
+
+    def _do_set_speed(self, speed):
+        if not timestretch.available():
+            # Without numpy, speed is the engine's speaking rate
+            self._do_set_rate(timestretch.rate_for_speed(speed))
+            return
+        self.speed = speed
+        if not self.pipeline:
+            return
+        self.pipeline.speed = speed
+        if self.state == 'playing' and self.buffer is not None:
+            # Carry on from the same point in the chunk at the new speed;
+            # what follows is stretched again from the unchanged audio
+            played = self._played()
+            self.engine.stop()
+            self.engine.wait(0)
+            self._start(played)
+            self.pipeline.start(self.chunk + 1)
+        elif self.buffer is not None:
+            # Paused mid-chunk; it is stretched again when it resumes
+            self.pipeline.start(self.chunk + 1)
+        else:
+            self._restart(self.chunk, self._char_offset(self.position))
+
+    def _do_sync(self, done):
+        done.set()
+
+    def _do_stop(self, arg):
+        self._hold_position()
+        self._restart(self.chunk, self._char_offset(self.position))
+        self._set_state('stopped')
@@ -0,0 +1,347 @@
+"""Headless playback daemon with a local HTTP control API.
+
+    python main.py daemon [--port 8765] [--engine local]
+
+Every session is a PlaybackEngine with its own speech engine and playback
+thread; all sessions share the library database, the position writer, the
+audio cache and one pool of synthesis workers, which renders first for the
+session closest to running out of audio. Requests and responses are JSON:
+
+    GET    /library                         books in the library
+    GET    /stats                           synthesis throughput and underruns
+    GET    /sessions                        status of every session
+    POST   /sessions                        new session; {"book_id": ...} loads a book
+    GET    /sessions/<id>                   status
+    DELETE /sessions/<id>                   stop and close the session
+    POST   /sessions/<id>/load              {"book_id": ...}
+    POST   /sessions/<id>/play
+    POST   /sessions/<id>/pause
+    POST   /sessions/<id>/seek              {"position": 0..1} or {"seconds": +-n}
+    POST   /sessions/<id>/speed             {"speed": 0.5..2.0}
+    POST   /sessions/<id>/sleep             {"minutes": n} (0 or null turns it off)
+    GET    /sessions/<id>/bookmarks
+    POST   /sessions/<id>/bookmarks         {"position": ...} (default: current)
+"""
+import os
+import sys
+import json
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from speech import create_engine, ENGINES
+from store import Store, PositionWriter
+from audio_cache import AudioCache
+from playback import PlaybackEngine
+from scheduler import SynthesisScheduler
+import metrics
+
+DEFAULT_PORT = 8765
+MAX_SESSIONS = 16
+MAX_BODY = 64 * 1024
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class Session:
+    def __init__(self, session_id, playback):
+        self.id = session_id
+        self.playback = playback
+        # Commands for one session are applied one at a time
+        self.lock = threading.Lock()
+
+    def status(self):
+        status = self.playback.status()
+        status['id'] = self.id
+        return status
+
+
+class PlaybackDaemon:
+    """Sessions over a shared store, position writer, audio cache and worker pool."""
+
+    def __init__(self, store=None, engine=None, max_sessions=MAX_SESSIONS, workers=None):
+        self.store = store or Store()
+        self.store.migrate_json()
+        self.positions = PositionWriter(self.store)
+        self.audio_cache = AudioCache()
+        metrics.gauge('audiobook_cache_hit_ratio', "Share of audio cache lookups that hit",
+                      self.audio_cache.hit_rate)
+        self.scheduler = SynthesisScheduler(workers or os.cpu_count() or 2)
+        metrics.gauge('audiobook_sessions', "Open playback sessions", lambda: len(self.sessions))
+        metrics.gauge('audiobook_scheduler_queued', "Synthesis tasks waiting for a worker",
+                      self.scheduler.queued)
+        metrics.gauge('audiobook_sessions_per_core', "Seconds of audio rendered per CPU second",
+                      lambda: self.scheduler.stats()['sessions_per_core'])
+        self.engine = engine
+        self.max_sessions = max_sessions
+        self.sessions = {}
+        self.closed_underruns = 0  # from sessions already closed
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    def library(self):
+        return self.store.books()
+
+    def book(self, book_id):
+        book = self.store.book(book_id)
+        if book is None:
+            raise ApiError(404, f"No book {book_id!r}")
+        return book
+
+    def create_session(self):
+        with self._lock:
+            if len(self.sessions) >= self.max_sessions:
+                raise ApiError(503, "Too many sessions")
+            session_id = str(self._next_id)
+            self._next_id += 1
+        playback = PlaybackEngine(self.store, self.positions, create_engine(self.engine),
+                                  self.audio_cache, self.scheduler)
+        session = Session(session_id, playback)
+        with self._lock:
+            self.sessions[session_id] = session
+        return session
+
+    def session(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is None:
+            raise ApiError(404, f"No session {session_id!r}")
+        return session
+
+    def close_session(self, session_id):
+        with self._lock:
+            session = self.sessions.pop(session_id, None)
+        if session is None:
+            raise ApiError(404, f"No session {session_id!r}")
+        with session.lock:
+            session.playback.close()
+        self.closed_underruns += session.playback.controller.underruns
+
+    def stats(self):
+        stats = self.scheduler.stats()
+        stats['open_sessions'] = len(self.sessions)
+        stats['underruns'] = self.closed_underruns + sum(
+            session.playback.controller.underruns for session in list(self.sessions.values()))
+        return stats
+
+    def close(self):
+        for session_id in list(self.sessions):
+            self.close_session(session_id)
+        self.scheduler.shutdown()
+        self.positions.close()
+        self.audio_cache.close()
+        self.store.close()
+
+    # Requests
+
+    def handle(self, method, parts, body):
+        """Route a request; returns (status, JSON-able result)."""
+        if parts == ['library'] and method == 'GET':
+            return 200, list(self.library().values())
+        if parts == ['stats'] and method == 'GET':
+            return 200, self.stats()
+        if parts == ['sessions']:
+            if method == 'GET':
+                return 200, [session.status() for session in list(self.sessions.values())]
+            if method == 'POST':
+                session = self.create_session()
+                if body.get('book_id'):
+                    try:
+                        self.load(session, body)
+                    except ApiError:
+                        self.close_session(session.id)
+                        raise
+                    session.playback.controller.sync()
+                return 201, session.status()
+        if len(parts) in (2, 3) and parts[0] == 'sessions':
+            if len(parts) == 2 and method == 'DELETE':
+                self.close_session(parts[1])
+                return 200, {'id': parts[1], 'closed': True}
+            session = self.session(parts[1])
+            action = parts[2] if len(parts) == 3 else 'status'
+            command = COMMANDS.get((method, action))
+            if command:
+                with session.lock:
+                    result = command(self, session, body)
+                    # Report the state the command produced, not the one before it
+                    session.playback.controller.sync()
+                return 200, session.status() if result is None else result
+        raise ApiError(404, "Unknown endpoint")
+
+    def load(self, session, body):
+        book = self.book(required(body, 'book_id'))
+        if not session.playback.load(book):
+            raise ApiError(422, f"Could not open {book['path']}")
+
+    def play(self, session, body):
+        if not session.playback.play():
+            raise ApiError(409, "No book loaded")
+
+    def pause(self, session, body):
+        session.playback.pause()
+
+    def seek(self, session, body):
+        if not session.playback.text:
+            raise ApiError(409, "No book loaded")
+        if 'seconds' in body:
+            session.playback.skip(number(body, 'seconds'))
+        else:
+            session.playback.seek(number(body, 'position'))
+
+    def speed(self, session, body):
+        speed = number(body, 'speed')
+        if not 0.5 <= speed <= 2.0:
+            raise ApiError(400, "speed must be between 0.5 and 2.0")
+        session.playback.set_speed(speed)
+
+    def sleep(self, session, body):
+        minutes = body.get('minutes')
+        session.playback.set_sleep_timer(number(body, 'minutes') if minutes else None)
+
+    def bookmarks(self, session, body):
+        return session.playback.bookmarks()
+
+    def add_bookmark(self, session, body):
+        position = number(body, 'position') if 'position' in body else None
+        bookmark = session.playback.add_bookmark(position)
+        if bookmark is None:
+            raise ApiError(409, "No book loaded")
+        return bookmark
+
+
+COMMANDS = {
+    ('GET', 'status'): lambda daemon, session, body: None,
+    ('POST', 'load'): PlaybackDaemon.load,
+    ('POST', 'play'): PlaybackDaemon.play,
+    ('POST', 'pause'): PlaybackDaemon.pause,
+    ('POST', 'seek'): PlaybackDaemon.seek,
+    ('POST', 'speed'): PlaybackDaemon.speed,
+    ('POST', 'sleep'): PlaybackDaemon.sleep,
+    ('GET', 'bookmarks'): PlaybackDaemon.bookmarks,
+    ('POST', 'bookmarks'): PlaybackDaemon.add_bookmark,
+}
+
+
+def required(body, name):
+    if body.get(name) is None:
+        raise ApiError(400, f"Missing {name!r}")
+    return body[name]
+
+
+def number(body, name):
+    try:
+        return float(required(body, name))
+    except (TypeError, ValueError):
+        raise ApiError(400, f"{name!r} must be a number")
+
+
+class _ApiHandler(BaseHTTPRequestHandler):
+    api = None
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def do_DELETE(self):
+        self.dispatch('DELETE')
+
+    def dispatch(self, method):
+        parts = [part for part in self.path.split('?')[0].split('/') if part]
+        try:
+            status, result = self.api.handle(method, parts, self.read_body())
+        except ApiError as e:
+            status, result = e.status, {'error': str(e)}
+        except Exception as e:
+            print(f"Error handling {method} {self.path}: {str(e)}")
+            status, result = 500, {'error': str(e)}
+        body = json.dumps(result).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_BODY:
+            raise ApiError(413, "Request body too large")
+        if not length:
+            return {}
+        try:
+            body = json.loads(self.rfile.read(length))
+        except ValueError:
+            raise ApiError(400, "Body is not valid JSON")
+        if not isinstance(body, dict):
+            raise ApiError(400, "Body must be a JSON object")
+        return body
+
+    def log_message(self, format, *args):
+        pass
+
+
+class DaemonServer:
+    """Serves a PlaybackDaemon's API; localhost only unless told otherwise."""
+
+    def __init__(self, daemon, port=DEFAULT_PORT, host='127.0.0.1'):
+        handler = type('ApiHandler', (_ApiHandler,), {'api': daemon})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def start(self):
+        """Serve on a background thread."""
+        self._thread = threading.Thread(target=self.serve_forever, name='daemon-api', daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='main.py daemon',
+        description="Run playback sessions headless behind a local HTTP API."
+    )
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--host', default='127.0.0.1', help="interface to listen on")
+    parser.add_argument('-e', '--engine', choices=sorted(ENGINES), default=None,
+                        help="speech engine (default: sapi on Windows, else local)")
+    parser.add_argument('--max-sessions', type=int, default=MAX_SESSIONS)
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count(),
+                        help="synthesis workers shared by all sessions")
+    parser.add_argument('--db', default=None, help="library database (default: the app's)")
+    args = parser.parse_args(argv)
+
+    metrics_server = metrics.start_from_environment()
+    daemon = PlaybackDaemon(Store(args.db), args.engine, args.max_sessions, args.workers)
+    try:
+        server = DaemonServer(daemon, args.port, args.host)
+    except OSError as e:
+        print(f"Error starting daemon: {str(e)}")
+        daemon.close()
+        return 1
+    print(f"Playback daemon at http://{args.host}:{server.port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server.server_close()
+        daemon.close()
+        if metrics_server:
+            metrics_server.close()
+        metrics.TRACER.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
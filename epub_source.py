@@ -0,0 +1,290 @@
+import os
+import json
+import zipfile
+import threading
+import posixpath
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from html.parser import HTMLParser
+from urllib.parse import unquote
+import xml.etree.ElementTree as ET
+
+from chunker import CHUNK_SIZE, ChunkIndex, build_index
+
+CONTAINER = 'META-INF/container.xml'
+MEMORY_SECTIONS = 2  # decoded spine documents kept in memory
+TOC_SUFFIX = '.toc'
+
+BLOCK_TAGS = {
+    'p', 'div', 'section', 'article', 'blockquote', 'pre', 'li', 'tr', 'table',
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'dt', 'dd', 'figcaption',
+}
+SKIP_TAGS = {'head', 'script', 'style', 'svg', 'math'}
+
+
+class _TextExtractor(HTMLParser):
+    """Strips (X)HTML to plain text with a blank line between blocks."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.paragraphs = []
+        self._words = []
+        self._skip = 0
+
+    def _end_block(self):
+        if self._words:
+            self.paragraphs.append(' '.join(self._words))
+            self._words = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIP_TAGS:
+            self._skip += 1
+        elif tag in BLOCK_TAGS or tag == 'br':
+            self._end_block()
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS:
+            self._skip = max(0, self._skip - 1)
+        elif tag in BLOCK_TAGS:
+            self._end_block()
+
+    def handle_data(self, data):
+        if not self._skip:
+            self._words.extend(data.split())
+
+    def text(self):
+        self.close()
+        self._end_block()
+        return '\n\n'.join(self.paragraphs)
+
+
+class _NavExtractor(HTMLParser):
+    """Collects (href, title) links from an EPUB 3 navigation document's toc."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.links = []
+        self._nav_depth = 0
+        self._in_toc = False
+        self._href = None
+        self._label = []
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'nav':
+            self._nav_depth += 1
+            if 'toc' in (attrs.get('epub:type') or '').split():
+                self._in_toc = True
+        elif tag == 'a' and self._in_toc:
+            self._href = attrs.get('href')
+            self._label = []
+
+    def handle_endtag(self, tag):
+        if tag == 'nav':
+            self._nav_depth -= 1
+            if not self._nav_depth:
+                self._in_toc = False
+        elif tag == 'a' and self._href is not None:
+            self.links.append((self._href, ' '.join(' '.join(self._label).split())))
+            self._href = None
+
+    def handle_data(self, data):
+        if self._href is not None:
+            self._label.append(data)
+
+
+def html_to_text(data):
+    """Plain text of one (X)HTML document."""
+    parser = _TextExtractor()
+    parser.feed(data.decode('utf-8', errors='replace'))
+    return parser.text()
+
+
+def _resolve(base_dir, href):
+    return posixpath.normpath(posixpath.join(base_dir, unquote(href.split('#')[0])))
+
+
+def read_package(archive):
+    """Title, spine document paths and {path: toc title} from an open EPUB."""
+    container = ET.fromstring(archive.read(CONTAINER))
+    rootfile = container.find('.//{*}rootfile')
+    opf_path = rootfile.get('full-path')
+    opf_dir = posixpath.dirname(opf_path)
+    package = ET.fromstring(archive.read(opf_path))
+
+    title = package.findtext('.//{*}metadata/{*}title')
+    manifest = {}
+    nav_path = None
+    for item in package.iterfind('.//{*}manifest/{*}item'):
+        path = _resolve(opf_dir, item.get('href'))
+        manifest[item.get('id')] = path
+        if 'nav' in (item.get('properties') or '').split():
+            nav_path = path
+
+    spine_element = package.find('.//{*}spine')
+    spine = [manifest[ref.get('idref')] for ref in spine_element.iterfind('{*}itemref')
+             if ref.get('idref') in manifest]
+
+    toc = {}
+    if nav_path:
+        nav = _NavExtractor()
+        nav.feed(archive.read(nav_path).decode('utf-8', errors='replace'))
+        nav_dir = posixpath.dirname(nav_path)
+        for href, label in nav.links:
+            toc.setdefault(_resolve(nav_dir, href), label)
+    elif spine_element.get('toc') in manifest:
+        # EPUB 2 NCX table of contents
+        ncx_path = manifest[spine_element.get('toc')]
+        ncx = ET.fromstring(archive.read(ncx_path))
+        for point in ncx.iterfind('.//{*}navPoint'):
+            content = point.find('{*}content')
+            label = ' '.join((point.findtext('{*}navLabel/{*}text') or '').split())
+            if content is not None:
+                toc.setdefault(_resolve(posixpath.dirname(ncx_path), content.get('src')), label)
+    return title, spine, toc
+
+
+def build_epub_index(archive, target=CHUNK_SIZE):
+    """Chunk index plus section table for a whole book.
+
+    Decodes one spine document at a time. Byte offsets in the index refer
+    to the UTF-8 text of the documents laid end to end.
+    """
+    title, spine, toc = read_package(archive)
+    char_offsets, byte_offsets, durations = array('Q', [0]), array('Q', [0]), array('f')
+    hashes = array('q')
+    sections = []
+    for path in spine:
+        try:
+            data = html_to_text(archive.read(path)).encode('utf-8')
+        except KeyError:
+            print(f"Missing EPUB document: {path}")
+            continue
+        section = build_index(data, target)
+        if not len(section):
+            continue
+        sections.append({
+            'path': path,
+            'title': toc.get(path),
+            'first_chunk': len(durations),
+            'byte_start': byte_offsets[-1],
+        })
+        chars, start = char_offsets[-1], byte_offsets[-1]
+        char_offsets.extend(chars + offset for offset in section.char_offsets[1:])
+        byte_offsets.extend(start + offset for offset in section.byte_offsets[1:])
+        durations.extend(section.durations)
+        hashes.extend(section.hashes)
+    return title, ChunkIndex(char_offsets, byte_offsets, durations, target, hashes), sections
+
+
+class EpubText:
+    """EPUB book read one spine document (chapter) at a time.
+
+    The spine, table of contents and chunk boundaries are parsed once and
+    saved next to the chunk index. After that, opening a book only reads
+    those files; a document is decompressed and stripped of markup when
+    playback first needs one of its chunks, and only the last few are
+    kept in memory.
+    """
+
+    encoding = 'utf-8'
+
+    def __init__(self, path, chunk_size=CHUNK_SIZE, index_path=None):
+        self.path = path
+        self.chunk_size = chunk_size
+        self._archive = zipfile.ZipFile(path)
+        stat = os.stat(path)
+        self.size = stat.st_size
+
+        loaded = self._load(index_path, stat) if index_path else None
+        if loaded:
+            self.title, self.index, self._sections = loaded
+        else:
+            self.title, self.index, self._sections = build_epub_index(self._archive, chunk_size)
+            if index_path:
+                try:
+                    self.save(index_path, stat)
+                except OSError as e:
+                    print(f"Error saving chapter index: {str(e)}")
+        self.offsets = self.index.byte_offsets
+        self._first_chunks = [section['first_chunk'] for section in self._sections]
+        self._texts = OrderedDict()
+        self._lock = threading.Lock()  # chunks are read from the pre-render pool
+
+        titled = [section for section in self._sections if section['title']]
+        self.chapters = [{
+            'title': section['title'] or f"Section {number}",
+            'chunk': section['first_chunk'],
+            'position': self.index.fraction(section['first_chunk']),
+        } for number, section in enumerate(titled or self._sections, 1)]
+
+    @property
+    def chunk_count(self):
+        return len(self.index)
+
+    def _load(self, index_path, stat):
+        index = ChunkIndex.load(index_path, stat.st_size, stat.st_mtime)
+        if index is None:
+            return None
+        try:
+            with open(index_path + TOC_SUFFIX, 'r', encoding='utf-8') as f:
+                toc = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if toc.get('size') != stat.st_size or toc.get('mtime') != stat.st_mtime:
+            return None
+        return toc.get('title'), index, toc['sections']
+
+    def save(self, index_path, stat):
+        self.index.save(index_path, stat.st_size, stat.st_mtime)
+        tmp_path = index_path + TOC_SUFFIX + '.part'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'size': stat.st_size, 'mtime': stat.st_mtime,
+                       'title': self.title, 'sections': self._sections}, f)
+        os.replace(tmp_path, index_path + TOC_SUFFIX)
+
+    def _section_text(self, number):
+        with self._lock:
+            data = self._texts.get(number)
+            if data is None:
+                data = html_to_text(self._archive.read(self._sections[number]['path'])).encode('utf-8')
+                self._texts[number] = data
+                while len(self._texts) > MEMORY_SECTIONS:
+                    self._texts.popitem(last=False)
+            else:
+                self._texts.move_to_end(number)
+            return data
+
+    def chunk(self, index):
+        """Decode and return the text of a single chunk."""
+        number = bisect_right(self._first_chunks, index) - 1
+        data = self._section_text(number)
+        base = self._sections[number]['byte_start']
+        start, end = self.offsets[index] - base, self.offsets[index + 1] - base
+        return data[start:end].decode('utf-8', errors='ignore')
+
+    def chapter_at(self, fraction):
+        """Index into chapters of the chapter containing a position fraction."""
+        positions = [chapter['position'] for chapter in self.chapters]
+        return max(0, bisect_right(positions, fraction) - 1)
+
+    def chunk_at(self, fraction):
+        return self.index.chunk_at(fraction)
+
+    def position_of(self, chunk):
+        return self.index.fraction(chunk)
+
+    def close(self):
+        with self._lock:
+            self._texts.clear()
+            self._archive.close()
+
+    def __len__(self):
+        return self.size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,398 @@
+import os
+import sys
+import json
+import time
+import wave
+import shutil
+import argparse
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import audio_pack
+from text_source import open_source
+from normalize import normalize
+from speech import create_engine, SAMPLE_RATE
+from store import Store
+
+BATCH_SIZE = 16  # chunks per pool task
+FORMATS = ('wav', 'ogg', 'pack')
+
+# Per-process worker state, set up by _init_worker
+_engine = None
+_codec = None
+_texts = {}
+
+
+def segment_name(text, index, fmt, tag):
+    # Segments are named by chunk content and tag (the render settings id),
+    # so a chunk changed by an edit to the book, or an export at another
+    # rate or voice, is rendered again instead of resumed
+    ids = text.index.hashes
+    if fmt == 'pack':
+        # Packs are built from per-chunk frame files once every chunk is rendered
+        chunk_id = ids[index] if ids is not None else index
+        return f"chunk_{chunk_id & 0xFFFFFFFFFFFFFFFF:016x}_{tag}.frames"
+    if ids is None:
+        return f"chunk_{index:06d}_{tag}.{fmt}"
+    return f"chunk_{index:06d}_{ids[index] & 0xFFFFFFFFFFFFFFFF:016x}_{tag}.{fmt}"
+
+
+def remove_stale_segments(out_dir, text, fmt, tag):
+    """Delete segment files that no chunk of text uses (left from before an edit
+    or from other render settings)."""
+    used = {segment_name(text, i, fmt, tag) for i in range(text.chunk_count)}
+    extension = '.frames' if fmt == 'pack' else '.' + fmt
+    for name in os.listdir(out_dir):
+        if name.startswith('chunk_') and name.endswith(extension) and name not in used:
+            os.remove(os.path.join(out_dir, name))
+
+
+def move_segments(out_dir, text, fmt, tag, present):
+    """Give segments of chunks that an edit only renumbered their new names.
+
+    present is the set of file names in out_dir; returns it updated.
+    """
+    if fmt == 'pack' or text.index.hashes is None:
+        # Frame files carry no chunk number, and page numbers say nothing of content
+        return present
+    extension = '.' + fmt
+    # A segment's name after its chunk number: content id and tag
+    by_content = {name.split('_', 2)[2]: name for name in present
+                  if name.startswith('chunk_') and name.endswith(extension)}
+    used = {segment_name(text, i, fmt, tag) for i in range(text.chunk_count)}
+    for i in range(text.chunk_count):
+        name = segment_name(text, i, fmt, tag)
+        content = name.split('_', 2)[2]
+        old = by_content.get(content)
+        if name in present or old is None:
+            continue
+        if old in used:
+            # Repeated text; the old segment is still this name for another chunk
+            shutil.copyfile(os.path.join(out_dir, old), os.path.join(out_dir, name))
+        else:
+            os.replace(os.path.join(out_dir, old), os.path.join(out_dir, name))
+            present.discard(old)
+        present.add(name)
+        by_content[content] = name
+    return present
+
+
+def write_segment(path, buffer, fmt):
+    """Write a rendered AudioBuffer to path atomically."""
+    tmp_path = path + '.part'
+    if fmt == 'wav':
+        with wave.open(tmp_path, 'wb') as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(buffer.sample_rate)
+            f.writeframes(buffer.pcm)
+    else:
+        import numpy as np
+        import soundfile
+        samples = np.frombuffer(buffer.pcm, dtype='<i2')
+        soundfile.write(tmp_path, samples, buffer.sample_rate, format='OGG', subtype='VORBIS')
+    # A segment only appears under its final name once complete, which is
+    # what makes resuming at chunk granularity safe
+    os.replace(tmp_path, path)
+
+
+def segment_duration(path, fmt):
+    """Duration in seconds of a rendered segment."""
+    if fmt == 'wav':
+        with wave.open(path, 'rb') as f:
+            return f.getnframes() / f.getframerate()
+    import soundfile
+    return soundfile.info(path).duration
+
+
+def export_engine(engine_name, rate, volume):
+    """A speech engine set up for rendering to files."""
+    kwargs = {'realtime': False} if engine_name == 'local' else {}
+    engine = create_engine(engine_name, **kwargs)
+    engine.rate = rate
+    engine.volume = volume
+    return engine
+
+
+def _init_worker(engine_name, rate, volume, codec):
+    global _engine, _codec
+    _codec = codec
+    _engine = export_engine(engine_name, rate, volume)
+
+
+def _render_batch(book, out_dir, indices, fmt, tag):
+    """Render a batch of chunks of one book; runs in a pool process."""
+    text = _texts.get(book['id'])
+    if text is None:
+        # Workers only extract the PDF pages in their own batches
+        text = _texts[book['id']] = open_source(book, prefetch=False)
+    start = time.perf_counter()
+    for i in indices:
+        chunk = text.chunk(i)
+        buffer = _engine.synthesize(normalize(chunk).text)
+        path = os.path.join(out_dir, segment_name(text, i, fmt, tag))
+        if fmt == 'pack':
+            frames = audio_pack.encode_chunk(buffer.pcm, buffer.sample_rate, chunk, _codec)
+            audio_pack.write_segment(path, frames, _codec)
+        else:
+            write_segment(path, buffer, fmt)
+    return os.getpid(), len(indices), time.perf_counter() - start
+
+
+def load_library(path):
+    try:
+        store = Store(path)
+        try:
+            return store.books()
+        finally:
+            store.close()
+    except Exception as e:
+        print(f"Error loading library: {str(e)}")
+    return {}
+
+
+def resolve_books(targets, library):
+    """Map book ids or file paths to library entries."""
+    books = []
+    for target in targets:
+        if target in library:
+            books.append(library[target])
+        elif os.path.isfile(target):
+            title = os.path.splitext(os.path.basename(target))[0]
+            books.append({'id': title, 'title': title, 'path': target})
+        else:
+            print(f"Skipping unknown book: {target}")
+    return books
+
+
+def open_rendered(book_id, text, args):
+    """The book's pack already in the output directory, bound to text, if it was
+    rendered with args.settings and is in args.codec."""
+    pack = audio_pack.open_pack(book_id, text, args.output, args.settings)
+    if pack and pack.codec != args.codec:
+        pack.close()
+        return None
+    return pack
+
+
+def build_pack(book_id, out_dir, text, args):
+    """Join a book's rendered frame files into one pack, then remove them.
+
+    Chunks that were not rendered again (unchanged since the book's
+    previous pack) are copied over from that pack without decoding.
+    """
+    pack = open_rendered(book_id, text, args)
+    if pack and pack.chunk_count == text.chunk_count and pack.matches(text):
+        pack.close()
+        return
+    paths = [os.path.join(out_dir, segment_name(text, i, 'pack', args.tag))
+             for i in range(text.chunk_count)]
+    writer = audio_pack.AudioPackWriter(os.path.join(out_dir, audio_pack.PACK_FILE), args.codec,
+                                        SAMPLE_RATE, audio_pack.chunk_ids(text),
+                                        text.index.total_chars, args.settings)
+    for i, path in enumerate(paths):
+        if os.path.exists(path):
+            writer.add_chunk(audio_pack.read_segment(path, args.codec))
+        else:
+            writer.add_chunk(pack.frames(i))
+    if pack:
+        # Closed before the new pack replaces it
+        pack.close()
+    writer.close()
+    for path in set(paths):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def read_manifest(out_dir):
+    """The manifest of an earlier export into out_dir, or None."""
+    try:
+        with open(os.path.join(out_dir, 'manifest.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_manifest(out_dir, book_id, title, path, text, args):
+    chunks = []
+    ids = audio_pack.chunk_ids(text)
+    total = 0.0
+    pack = None
+    if args.format == 'pack':
+        pack = audio_pack.open_pack(book_id, text, args.output, args.settings)
+    for i in range(text.chunk_count):
+        if pack:
+            name = audio_pack.PACK_FILE
+            duration = pack.duration(i)
+        else:
+            name = segment_name(text, i, args.format, args.tag)
+            duration = segment_duration(os.path.join(out_dir, name), args.format)
+        chunks.append({
+            'index': i,
+            'chunk_id': f"{ids[i] & 0xFFFFFFFFFFFFFFFF:016x}",
+            'file': name,
+            'byte_start': text.offsets[i],
+            'byte_end': text.offsets[i + 1],
+            'start_seconds': round(total, 3),
+            'duration': round(duration, 3),
+        })
+        total += duration
+    stat = os.stat(path)
+    manifest = {
+        'id': book_id,
+        'title': title,
+        'source': os.path.abspath(path),
+        'source_size': stat.st_size,
+        'source_mtime': stat.st_mtime,
+        **args.settings,
+        'format': args.format,
+        'codec': args.codec if pack else None,
+        'chunk_size': text.chunk_size,
+        'total_seconds': round(total, 3),
+        'chunks': chunks,
+    }
+    tmp_path = os.path.join(out_dir, 'manifest.json.part')
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, os.path.join(out_dir, 'manifest.json'))
+    if pack:
+        pack.close()
+
+
+def export_books(books, args):
+    """Render every pending chunk of every book across a process pool."""
+    jobs = []
+    texts = {}
+    for book in books:
+        book_id, title = book['id'], book['title']
+        out_dir = os.path.join(args.output, book_id)
+        os.makedirs(out_dir, exist_ok=True)
+        text = texts[book_id] = open_source(book, prefetch=False)
+        done = set(os.listdir(out_dir))
+        packed = ()
+        previous = read_manifest(out_dir)
+        stat = os.stat(book['path'])
+        stale = False
+        if previous and (previous.get('source_size'), previous.get('source_mtime')) != (stat.st_size, stat.st_mtime):
+            print(f"{title}: source changed since the last export")
+            # Segments are named by chunk content, except for sources without
+            # content ids, whose chunk numbers no longer say what was rendered
+            stale = text.index.hashes is None
+            if stale:
+                done = set()
+            else:
+                # Chunks after an inserted or removed one keep their audio
+                done = move_segments(out_dir, text, args.format, args.tag, done)
+        if previous and any(previous.get(key) != value for key, value in args.settings.items()):
+            # Segments and packs of other settings are not reused
+            print(f"{title}: last exported with other engine, voice, rate or volume settings")
+        if args.format == 'pack' and not stale:
+            # Chunks unchanged since an earlier pack are not rendered again
+            pack = open_rendered(book_id, text, args)
+            if pack:
+                packed = {i for i in range(text.chunk_count) if pack.has(i)}
+                pack.close()
+        pending = []
+        for i in range(text.chunk_count):
+            name = segment_name(text, i, args.format, args.tag)
+            if i not in packed and name not in done:
+                # Frame files of repeated text are shared, and rendered once
+                done.add(name)
+                pending.append(i)
+        skipped = text.chunk_count - len(pending)
+        print(f"{title}: {text.chunk_count} chunks, {skipped} already rendered")
+        for i in range(0, len(pending), args.batch):
+            jobs.append((book, out_dir, pending[i:i + args.batch], args.format, args.tag))
+
+    per_worker = defaultdict(lambda: [0, 0.0])
+    start = time.perf_counter()
+    rendered = 0
+    total = sum(len(job[2]) for job in jobs)
+    if jobs:
+        with ProcessPoolExecutor(
+            max_workers=args.workers,
+            initializer=_init_worker,
+            initargs=(args.engine, args.rate, args.volume, args.codec)
+        ) as pool:
+            futures = [pool.submit(_render_batch, *job) for job in jobs]
+            for future in as_completed(futures):
+                pid, count, seconds = future.result()
+                per_worker[pid][0] += count
+                per_worker[pid][1] += seconds
+                rendered += count
+                print(f"Rendered {rendered}/{total} chunks")
+    elapsed = time.perf_counter() - start
+
+    for book in books:
+        book_id = book['id']
+        out_dir = os.path.join(args.output, book_id)
+        if args.format == 'pack':
+            build_pack(book_id, out_dir, texts[book_id], args)
+        write_manifest(out_dir, book_id, book['title'], book['path'], texts[book_id], args)
+        remove_stale_segments(out_dir, texts[book_id], args.format, args.tag)
+        texts[book_id].close()
+
+    for pid, (count, seconds) in sorted(per_worker.items()):
+        rate = count / seconds if seconds else 0.0
+        print(f"Worker {pid}: {count} chunks, {rate:.1f} chunks/s")
+    if elapsed and rendered:
+        print(f"Total: {rendered} chunks in {elapsed:.1f}s ({rendered / elapsed:.1f} chunks/s)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='main.py export',
+        description="Render books to chunked audio files ahead of time."
+    )
+    parser.add_argument('books', nargs='+', help="library book ids or text file paths")
+    parser.add_argument('-o', '--output', default=None,
+                        help="output directory (default: exports, or for packs the app's "
+                             "rendered books, which playback uses)")
+    parser.add_argument('-f', '--format', choices=FORMATS, default='wav')
+    parser.add_argument('--codec', choices=sorted(audio_pack.CODECS), default=None,
+                        help="pack codec (default: the smallest available)")
+    parser.add_argument('-e', '--engine', default=None, help="speech engine (sapi or local)")
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--batch', type=int, default=BATCH_SIZE, help="chunks per task")
+    parser.add_argument('--rate', type=int, default=1, help="speech rate (-10 to 10)")
+    parser.add_argument('--volume', type=int, default=100, help="volume (0 to 100)")
+    parser.add_argument('--db', default=None, help="library database (default: the app's)")
+    args = parser.parse_args(argv)
+
+    if args.engine is None:
+        args.engine = 'sapi' if sys.platform == 'win32' else 'local'
+    if args.output is None:
+        args.output = audio_pack.RENDERED_DIR if args.format == 'pack' else 'exports'
+    # What the audio depends on besides the text; earlier output is only
+    # reused if it matches
+    args.settings = audio_pack.render_settings(export_engine(args.engine, args.rate, args.volume))
+    args.tag = audio_pack.settings_id(args.settings).hex()
+    if args.format == 'pack':
+        codecs = audio_pack.available_codecs()
+        if args.codec is None:
+            args.codec = codecs[0]
+            if args.codec == 'pcm':
+                # No soundfile, and no audioop after Python 3.12
+                print("No compressing codec is available here (install soundfile); "
+                      "packs hold zlib-compressed PCM and are large")
+        elif args.codec not in codecs:
+            print(f"The {args.codec} codec is not available here (have: {', '.join(codecs)})")
+            return 1
+        print(f"Packing with the {args.codec} codec")
+    if args.format == 'ogg':
+        try:
+            import soundfile  # noqa: F401
+        except ImportError:
+            print("Ogg export requires the soundfile package")
+            return 1
+
+    books = resolve_books(args.books, load_library(args.db))
+    if not books:
+        print("No books to export")
+        return 1
+    export_books(books, args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
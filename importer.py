@@ -0,0 +1,234 @@
+import os
+import mmap
+import time
+import codecs
+import hashlib
+import threading
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from chunker import CHUNK_SIZE, build_index, index_path
+from speech import WORDS_PER_SECOND
+
+BOOK_EXTENSIONS = ('.txt', '.pdf', '.epub')
+BATCH_SIZE = 50  # books committed to the library per transaction
+DETECT_BLOCK = 1024 * 1024
+FALLBACK_ENCODING = 'cp1252'
+
+
+def iter_book_files(paths):
+    """Yield importable files from a mix of file and directory paths."""
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith(BOOK_EXTENSIONS):
+                        yield os.path.join(root, name)
+        elif os.path.isfile(path):
+            yield path
+
+
+def detect_encoding(data):
+    """UTF-8 if the whole text decodes as UTF-8, otherwise FALLBACK_ENCODING."""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    try:
+        for start in range(0, len(data), DETECT_BLOCK):
+            decoder.decode(data[start:start + DETECT_BLOCK])
+        decoder.decode(b'', final=True)
+    except UnicodeDecodeError:
+        return FALLBACK_ENCODING
+    return 'utf-8'
+
+
+def file_hash(path):
+    """SHA-256 of a file's content, or None if it cannot be read."""
+    try:
+        with open(path, 'rb') as f:
+            if not os.fstat(f.fileno()).st_size:
+                return None
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return hashlib.sha256(data).hexdigest()
+    except (OSError, ValueError):
+        return None
+
+
+def prescan_pdf(path):
+    """Hash a PDF and count its pages; text is extracted when it is played."""
+    from pdf_source import page_count
+    try:
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if not size:
+                return None
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                digest = hashlib.sha256(data).hexdigest()
+        pages = page_count(path)
+    except Exception as e:
+        print(f"Error scanning {path}: {str(e)}")
+        return None
+    return {
+        'id': digest[:16],
+        'title': os.path.splitext(os.path.basename(path))[0],
+        'path': os.path.abspath(path),
+        'hash': digest,
+        'size': size,
+        'pages': pages,
+    }
+
+
+def prescan_epub(path):
+    """Hash an EPUB and build its chapter index, one chapter at a time."""
+    from epub_source import EpubText
+    try:
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if not size:
+                return None
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                digest = hashlib.sha256(data).hexdigest()
+        book = {'id': digest[:16], 'path': os.path.abspath(path)}
+        book['index'] = index_path(book)
+        with EpubText(path, index_path=book['index']) as text:
+            title, index, chapters = text.title, text.index, len(text.chapters)
+    except Exception as e:
+        print(f"Error scanning {path}: {str(e)}")
+        return None
+    book.update({
+        'title': title or os.path.splitext(os.path.basename(path))[0],
+        'hash': digest,
+        'encoding': 'utf-8',
+        'size': size,
+        'chars': index.total_chars,
+        'words': round(sum(index.durations) * WORDS_PER_SECOND),
+        'chapters': chapters,
+    })
+    return book
+
+
+def prescan(path):
+    """Hash, sniff and index one book file; runs in a pool process.
+
+    Returns a library entry, or None if the file could not be read.
+    """
+    if path.lower().endswith('.pdf'):
+        return prescan_pdf(path)
+    if path.lower().endswith('.epub'):
+        return prescan_epub(path)
+    try:
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            if not stat.st_size:
+                return None
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                digest = hashlib.sha256(data).hexdigest()
+                encoding = detect_encoding(data)
+                index = build_index(data, CHUNK_SIZE, encoding)
+    except (OSError, ValueError) as e:
+        print(f"Error scanning {path}: {str(e)}")
+        return None
+
+    book = {
+        # Content-derived, so the same book always gets the same id
+        'id': digest[:16],
+        'title': os.path.splitext(os.path.basename(path))[0],
+        'path': os.path.abspath(path),
+        'hash': digest,
+        'encoding': encoding,
+        'size': stat.st_size,
+        'chars': index.total_chars,
+        'words': round(sum(index.durations) * WORDS_PER_SECOND),
+    }
+    book['index'] = index_path(book)
+    index.save(book['index'], stat.st_size, stat.st_mtime)
+    return book
+
+
+class LibraryImporter:
+    """Imports many books on a process pool without blocking the caller.
+
+    Files are pre-scanned in parallel (content hash for a stable id and
+    dedupe, encoding, character/word counts and the chunk index). New
+    books are written to the store in batches and handed to on_batch;
+    on_done receives the ids of every book that was added.
+
+    known_books are the library's entries; ones without a content hash
+    (migrated from the JSON library) are hashed and saved before the
+    import so they are not imported again.
+    """
+
+    def __init__(self, store, known_books, on_batch, on_done=None, workers=None,
+                 batch_size=BATCH_SIZE):
+        self.store = store
+        self.known_books = list(known_books)
+        self.known_hashes = set()
+        self.on_batch = on_batch
+        self.on_done = on_done
+        self.workers = workers
+        self.batch_size = batch_size
+        self.thread = None
+
+    def start(self, paths):
+        self.thread = threading.Thread(target=self.run, args=(list(paths),), name='importer', daemon=True)
+        self.thread.start()
+
+    def run(self, paths):
+        start = time.perf_counter()
+        self._hash_known_books()
+        files = list(iter_book_files(paths))
+        added, duplicates, failed = [], 0, 0
+        batch = []
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            futures = [pool.submit(prescan, path) for path in files]
+            for future in as_completed(futures):
+                try:
+                    book = future.result()
+                except Exception as e:
+                    print(f"Error importing book: {str(e)}")
+                    book = None
+                if book is None:
+                    failed += 1
+                    continue
+                if book['hash'] in self.known_hashes:
+                    duplicates += 1
+                    continue
+                self.known_hashes.add(book['hash'])
+                book['added'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                batch.append(book)
+                if len(batch) >= self.batch_size:
+                    self._commit(batch)
+                    added.extend(book['id'] for book in batch)
+                    batch = []
+        if batch:
+            self._commit(batch)
+            added.extend(book['id'] for book in batch)
+
+        elapsed = time.perf_counter() - start
+        print(f"Imported {len(added)} books ({duplicates} duplicates, {failed} failed) "
+              f"from {len(files)} files in {elapsed:.1f}s")
+        if self.on_done:
+            self.on_done(added)
+
+    def _hash_known_books(self):
+        hashed = []
+        for book in self.known_books:
+            if not book.get('hash'):
+                digest = file_hash(book['path'])
+                if digest is None:
+                    continue
+                book['hash'] = digest
+                hashed.append(book)
+            self.known_hashes.add(book['hash'])
+        if hashed:
+            try:
+                self.store.save_books(hashed)
+            except Exception as e:
+                print(f"Error saving book hashes: {str(e)}")
+
+    def _commit(self, batch):
+        try:
+            self.store.save_books(batch)
+        except Exception as e:
+            print(f"Error saving imported books: {str(e)}")
+            return
+        self.on_batch(list(batch))
@@ -0,0 +1,141 @@
+import customtkinter as ctk
+
+from ui_channel import LabelCache
+
+ROW_HEIGHT = 30  # pixels per book row
+
+
+class ListWindow:
+    """Which slice of a long list is on screen; no widgets involved."""
+
+    def __init__(self, visible):
+        self.items = []
+        self.top = 0
+        self.visible = visible
+
+    def __len__(self):
+        return len(self.items)
+
+    def set_items(self, items):
+        self.items = list(items)
+        self._clamp()
+
+    def insert(self, item, index=None):
+        if index is None:
+            self.items.append(item)
+        else:
+            self.items.insert(index, item)
+
+    def remove(self, item):
+        try:
+            self.items.remove(item)
+        except ValueError:
+            return False
+        self._clamp()
+        return True
+
+    def scroll_to(self, fraction):
+        self.top = int(fraction * len(self.items))
+        self._clamp()
+
+    def scroll_by(self, rows):
+        self.top += rows
+        self._clamp()
+
+    def _clamp(self):
+        self.top = max(0, min(self.top, len(self.items) - self.visible))
+
+    def visible_items(self):
+        return self.items[self.top:self.top + self.visible]
+
+    def fractions(self):
+        """(first, last) visible fractions, as a scrollbar expects them."""
+        if not self.items:
+            return 0.0, 1.0
+        count = len(self.items)
+        return self.top / count, min(1.0, (self.top + self.visible) / count)
+
+
+class VirtualBookList:
+    """Scrollable book list that only creates widgets for the visible rows.
+
+    A fixed pool of row widgets is reused while scrolling; rows are
+    re-labelled rather than rebuilt, so adding or removing a book costs
+    the same whether the library has ten entries or a hundred thousand.
+    """
+
+    def __init__(self, parent, title_for, on_select, height=150, row_height=ROW_HEIGHT):
+        self.title_for = title_for
+        self.on_select = on_select
+        self.window = ListWindow(max(1, height // row_height))
+        self.widgets = LabelCache()
+
+        self.frame = ctk.CTkFrame(parent, fg_color="#2F3F4F", height=height)
+        self.frame.pack_propagate(False)
+
+        self.scrollbar = ctk.CTkScrollbar(self.frame, command=self._on_scrollbar)
+        self.scrollbar.pack(side="right", fill="y")
+
+        self.rows = []
+        for slot in range(self.window.visible):
+            row = ctk.CTkFrame(self.frame, fg_color="#2F3F4F", height=row_height)
+            row.pack(fill="x", padx=5, pady=1)
+            label = ctk.CTkLabel(
+                row,
+                text="",
+                font=("Arial", 12),
+                text_color="#FFFFFF",
+                anchor="w"
+            )
+            label.pack(side="left", fill="x", expand=True, padx=10)
+            for widget in (row, label):
+                widget.bind("<Button-1>", lambda e, s=slot: self._on_click(s))
+                widget.bind("<MouseWheel>", self._on_wheel)
+                widget.bind("<Button-4>", lambda e: self._scroll(-1))
+                widget.bind("<Button-5>", lambda e: self._scroll(1))
+            self.rows.append(label)
+        self.frame.bind("<MouseWheel>", self._on_wheel)
+
+    def pack(self, **kwargs):
+        self.frame.pack(**kwargs)
+
+    def set_items(self, book_ids):
+        """Replace the whole list (startup)."""
+        self.window.set_items(book_ids)
+        self.refresh()
+
+    def insert(self, book_id, index=None):
+        self.window.insert(book_id, index)
+        self.refresh()
+
+    def remove(self, book_id):
+        if self.window.remove(book_id):
+            self.refresh()
+
+    def refresh(self):
+        """Re-label the pooled rows for the current scroll position."""
+        visible = self.window.visible_items()
+        for slot, label in enumerate(self.rows):
+            title = self.title_for(visible[slot]) if slot < len(visible) else ""
+            self.widgets.configure(label, text=title)
+        self.scrollbar.set(*self.window.fractions())
+
+    def _on_click(self, slot):
+        visible = self.window.visible_items()
+        if slot < len(visible):
+            self.on_select(visible[slot])
+
+    def _scroll(self, rows):
+        self.window.scroll_by(rows)
+        self.refresh()
+
+    def _on_wheel(self, event):
+        self._scroll(-1 if event.delta > 0 else 1)
+
+    def _on_scrollbar(self, action, value, unit=None):
+        if action == "moveto":
+            self.window.scroll_to(float(value))
+        elif action == "scroll":
+            step = self.window.visible if unit == "pages" else 1
+            self.window.scroll_by(int(value) * step)
+        self.refresh()
@@ -1,46 +1,151 @@
-import os
-import json
-import customtkinter as ctk
-from datetime import datetime
-import threading
-import win32com.client
 import time
+STARTED = time.perf_counter()
+
+import sys
+import threading
+import customtkinter as ctk
+from ui_channel import UiChannel, LabelCache
+from library_view import VirtualBookList
+import metrics
+# Everything else (speech, storage, playback and numpy behind it) is
+# imported by the startup threads, after the window is up
 
 class AudiobookPlayer:
     def __init__(self):
+        self.startup_times = [('imports', time.perf_counter() - STARTED)]
         self.app = ctk.CTk()
         self.app.title("Audiobook Player")
         self.app.geometry("1200x800")
         ctk.set_appearance_mode("dark")
         
-        # Initialize text-to-speech
-        self.speaker = win32com.client.Dispatch("SAPI.SpVoice")
-        self.speaker.Rate = 1  # -10 to 10
-        self.speaker.Volume = 100  # 0 to 100
+        # Worker threads hand UI updates to the main loop through this channel
+        self.ui = UiChannel(self.app)
+        self.widgets = LabelCache()
         
-        # Initialize state
-        self.current_book = None
+        # What the window shows; playback itself lives in self.playback
         self.is_playing = False
-        self.current_text = ""
         self.current_position = 0
-        self.total_length = 0
-        self.play_thread = None
-        self.playback_speed = 1.0
-        
-        # Sleep timer
-        self.sleep_timer = None
-        self.sleep_time_remaining = 0
         
-        # Load saved data
-        self.library = self.load_library()
-        self.bookmarks = self.load_bookmarks()
+        # Filled in by the startup threads
+        self.speaker = None
+        self.audio_cache = None
+        self.playback = None
+        self.store = None
+        self.positions = None
+        self.search_index = None
+        self.library = {}
+        self.bookmarks = {}
+        self.pending_book = None
+        
+        # Books are opened on a loader thread; only the latest pick is loaded
+        self.loading = None
+        self.load_lock = threading.Lock()
         
         self.setup_gui()
+        self.ui.subscribe('progress', self.apply_progress)
+        self.ui.subscribe('state', self.apply_state)
+        self.ui.start()
+        self.mark_startup('window')
+        
+        # Instrumentation; see metrics.start_from_environment
+        self.metrics_server = metrics.start_from_environment()
+        self.app.after(0, self.mark_startup, 'first paint')
+        
+        # Everything slow happens after the window is up
+        self.set_controls_enabled(False)
+        self.engine_thread = threading.Thread(target=self.start_engine, name='startup-engine', daemon=True)
+        self.library_thread = threading.Thread(target=self.start_library, name='startup-library', daemon=True)
+        self.engine_thread.start()
+        self.library_thread.start()
+
+    def mark_startup(self, stage):
+        """Record how long after launch a startup stage finished."""
+        self.startup_times.append((stage, time.perf_counter() - STARTED))
+        stages = dict(self.startup_times)
+        if stage in ('first paint', 'ready') and 'first paint' in stages and 'ready' in stages:
+            print("Startup: " + ", ".join(
+                f"{name} {seconds * 1000:.0f} ms" for name, seconds in self.startup_times))
+
+    def start_engine(self):
+        """Create the speech engine and audio cache (startup thread)."""
+        from speech import create_engine
+        from audio_cache import AudioCache
+        
+        # Initialize text-to-speech
+        self.speaker = create_engine()
+        self.mark_startup('engine')
         
-        # Check for last played book
-        last_book = self.get_last_played_book()
-        if last_book:
-            self.show_resume_dialog(last_book)
+        # Rendered chunks are reused on replay and seek
+        self.audio_cache = AudioCache()
+        metrics.gauge('audiobook_cache_hit_ratio', "Share of audio cache lookups that hit",
+                      self.audio_cache.hit_rate)
+
+    def start_library(self):
+        """Load saved data and the last book's text (startup thread)."""
+        from store import Store, PositionWriter
+        from search import SearchIndex
+        from playback import PlaybackEngine
+        
+        self.store = Store()
+        self.store.migrate_json()
+        self.positions = PositionWriter(self.store)
+        library = self.load_library()
+        bookmarks = self.load_bookmarks()
+        self.mark_startup('library')
+        
+        # Full-text search; only new or changed books are (re)indexed. It is
+        # created before show_library enables the buttons that use it
+        self.search_index = SearchIndex()
+        self.search_index.enqueue(library.values())
+        self.ui.call(self.show_library, library, bookmarks)
+        
+        # Check for last played book; its text is opened here, off the main thread
+        last_book = self.get_last_played_book(library)
+        text = self.open_text(last_book) if last_book else None
+        self.mark_startup('last book')
+        self.engine_thread.join()
+        
+        # The window is one client of the playback engine; it only posts commands
+        playback = PlaybackEngine(self.store, self.positions, self.speaker, self.audio_cache)
+        playback.on_progress = lambda position: self.ui.post('progress', position)
+        playback.on_state = lambda state: self.ui.post('state', state)
+        self.playback = playback
+        self.mark_startup('controller')
+        self.ui.call(self.startup_finished, last_book, text)
+
+    def show_library(self, library, bookmarks):
+        """Show the loaded library and enable importing and search (main thread)."""
+        self.library = library
+        self.bookmarks = bookmarks
+        self.update_library_list()
+        for button in (self.add_book_btn, self.add_folder_btn, self.search_btn):
+            button.configure(state="normal")
+
+    def startup_finished(self, last_book, text):
+        """Enable playback and restore the last book (main thread)."""
+        self.set_controls_enabled(True)
+        if self.pending_book:
+            # A book was picked while the engine was starting
+            if text:
+                text.close()
+            self.load_book(self.pending_book)
+        elif last_book:
+            self.show_resume_dialog(last_book, text)
+        self.mark_startup('ready')
+
+    def set_controls_enabled(self, enabled):
+        """Enable or disable controls that need the engine or the library."""
+        self.set_playback_enabled(enabled)
+        if not enabled:
+            for button in (self.add_book_btn, self.add_folder_btn, self.search_btn):
+                button.configure(state="disabled")
+
+    def set_playback_enabled(self, enabled):
+        """Enable or disable the controls that act on the current book."""
+        state = "normal" if enabled else "disabled"
+        for widget in (self.play_btn, self.rewind_btn, self.forward_btn, self.speed_menu,
+                       self.chapter_menu, self.bookmark_btn):
+            widget.configure(state=state)
 
     def setup_gui(self):
         """Set up the GUI elements."""
@@ -94,10 +199,33 @@ class AudiobookPlayer:
         )
         self.add_book_btn.pack(side="right", padx=10)
         
-        # Book list
-        self.book_list = ctk.CTkScrollableFrame(
+        # Add folder button
+        self.add_folder_btn = ctk.CTkButton(
+            header,
+            text="+ Add Folder",
+            font=("Arial", 12),
+            fg_color="#3F4F5F",
+            hover_color="#4F5F6F",
+            command=self.add_folder
+        )
+        self.add_folder_btn.pack(side="right", padx=5)
+        
+        # Search button
+        self.search_btn = ctk.CTkButton(
+            header,
+            text="🔍 Search",
+            font=("Arial", 12),
+            fg_color="#3F4F5F",
+            hover_color="#4F5F6F",
+            command=self.show_search
+        )
+        self.search_btn.pack(side="right", padx=5)
+        
+        # Book list; only the visible rows have widgets
+        self.book_list = VirtualBookList(
             library_frame,
-            fg_color="#2F3F4F",
+            title_for=lambda book_id: self.library[book_id]['title'],
+            on_select=self.load_book,
             height=150
         )
         self.book_list.pack(fill="x", padx=10, pady=5)
@@ -210,6 +338,18 @@ class AudiobookPlayer:
         self.speed_menu.pack(side="left", padx=5)
         self.speed_menu.set("1.0x")
         
+        # Chapter navigation (EPUB books)
+        self.chapter_menu = ctk.CTkOptionMenu(
+            bottom_row,
+            values=["No chapters"],
+            command=self.go_to_chapter,
+            width=200,
+            fg_color="#3F4F5F",
+            button_color="#3F4F5F",
+            button_hover_color="#4F5F6F"
+        )
+        self.chapter_menu.pack(side="left", padx=10)
+        
         # Sleep timer
         self.sleep_btn = ctk.CTkButton(
             bottom_row,
@@ -231,119 +371,68 @@ class AudiobookPlayer:
         )
         self.bookmark_btn.pack(side="right", padx=5)
 
-    def play_text(self):
-        """Play the text using text-to-speech."""
-        try:
-            if self.current_text:
-                print("Starting text playback")
-                # Split text into manageable chunks
-                chunk_size = 1000  # characters
-                chunks = [self.current_text[i:i+chunk_size] 
-                         for i in range(0, len(self.current_text), chunk_size)]
-                
-                print(f"Total chunks: {len(chunks)}")
-                self.total_length = len(chunks)
-                start_chunk = int(self.current_position * self.total_length)
-                print(f"Starting from chunk: {start_chunk}")
-                
-                for i in range(start_chunk, len(chunks)):
-                    if not self.is_playing:
-                        print("Playback stopped")
-                        break
-                    
-                    chunk = chunks[i]
-                    print(f"Playing chunk {i} of {len(chunks)}")
-                    self.speaker.Speak(chunk)
-                    
-                    # Update progress
-                    self.current_position = i / self.total_length
-                    self.update_progress()
-                    
-                    # Check sleep timer
-                    if self.sleep_timer and time.time() >= self.sleep_timer:
-                        print("Sleep timer triggered")
-                        self.is_playing = False
-                        self.sleep_timer = None
-                        break
-                
-                if self.is_playing:
-                    print("Playback completed")
-                    self.is_playing = False
-                    self.play_btn.configure(text="▶")
-                
-        except Exception as e:
-            print(f"Error playing text: {str(e)}")
-            import traceback
-            traceback.print_exc()
-            self.is_playing = False
-            self.play_btn.configure(text="▶")
+    def apply_progress(self, position):
+        """Show playback progress (main thread)."""
+        self.current_position = position
+        self.update_progress()
+
+    def apply_state(self, state):
+        """Show the playback state (main thread)."""
+        self.is_playing = state == 'playing'
+        self.widgets.configure(self.play_btn, text="⏸" if self.is_playing else "▶")
+        if state == 'stopped':
+            self.current_position = self.playback.position
+            self.update_progress()
 
     def toggle_play(self):
         """Toggle audio playback."""
-        if not self.current_book:
+        if not self.playback or not self.playback.book:
             print("No book selected")
             return
         
         try:
             if self.is_playing:
-                print("Stopping playback")
+                print("Pausing playback")
                 self.is_playing = False
-                self.speaker.Speak("", 2)  # Stop speaking
-                if self.play_thread:
-                    print("Waiting for thread to finish")
-                    self.play_thread.join()
-                self.play_btn.configure(text="▶")
+                self.playback.pause()
+                self.widgets.configure(self.play_btn, text="▶")
             else:
                 print("Starting playback")
-                if not self.current_text:
+                if not self.playback.text:
                     print("No text loaded")
                     return
-                print(f"Text length: {len(self.current_text)}")
+                print(f"Text size: {len(self.playback.text)} bytes")
                 print(f"Current position: {self.current_position}")
                 self.is_playing = True
-                self.play_thread = threading.Thread(target=self.play_text)
-                self.play_thread.daemon = True
-                self.play_thread.start()
-                self.play_btn.configure(text="⏸")
-            
-            # Update last played time
-            self.current_book['last_played'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            self.save_library()
+                self.playback.play()
+                self.widgets.configure(self.play_btn, text="⏸")
             
         except Exception as e:
             print(f"Error toggling playback: {str(e)}")
             import traceback
             traceback.print_exc()
 
+    def seek(self, position):
+        """Move playback to a position fraction without stopping it."""
+        self.current_position = self.playback.seek(position)
+        self.update_progress()
+
     def rewind_30(self):
         """Rewind 30 seconds."""
-        if self.current_text:
-            # Estimate 30 seconds worth of text
-            chunk_size = 1000  # characters
-            chunks_per_second = 3  # rough estimate
-            chunks_to_move = 30 * chunks_per_second
-            
-            new_pos = max(0, self.current_position - (chunks_to_move / self.total_length))
-            self.current_position = new_pos
-            self.update_progress()
+        self.skip_seconds(-30)
 
     def forward_30(self):
         """Forward 30 seconds."""
-        if self.current_text:
-            # Estimate 30 seconds worth of text
-            chunk_size = 1000  # characters
-            chunks_per_second = 3  # rough estimate
-            chunks_to_move = 30 * chunks_per_second
-            
-            new_pos = min(1, self.current_position + (chunks_to_move / self.total_length))
-            self.current_position = new_pos
-            self.update_progress()
+        self.skip_seconds(30)
+
+    def skip_seconds(self, seconds):
+        """Move the position by a number of seconds of speech."""
+        self.current_position = self.playback.skip(seconds)
+        self.update_progress()
 
     def change_speed(self, speed):
         """Change playback speed."""
-        speed_value = float(speed.replace('x', ''))
-        self.playback_speed = speed_value
-        self.speaker.Rate = int((speed_value - 1) * 10)  # Convert to SAPI5 rate (-10 to 10)
+        self.playback.set_speed(float(speed.replace('x', '')))
 
     def set_sleep_timer(self):
         """Set sleep timer dialog."""
@@ -374,15 +463,14 @@ class AudiobookPlayer:
     def start_sleep_timer(self, time_str):
         """Start the sleep timer."""
         if time_str == "Off":
-            self.sleep_timer = None
+            self.playback.set_sleep_timer(None)
             return
         
-        minutes = int(time_str.split()[0])
-        self.sleep_timer = time.time() + (minutes * 60)
+        self.playback.set_sleep_timer(int(time_str.split()[0]))
 
     def show_bookmarks(self):
         """Show bookmarks dialog."""
-        if not self.current_book:
+        if not self.playback.book:
             return
         
         dialog = ctk.CTkToplevel(self.app)
@@ -409,7 +497,7 @@ class AudiobookPlayer:
         add_btn.pack(pady=10)
         
         # Show existing bookmarks
-        book_id = self.current_book['id']
+        book_id = self.playback.book['id']
         if book_id in self.bookmarks:
             for bookmark in self.bookmarks[book_id]:
                 self.create_bookmark_widget(dialog, bookmark)
@@ -436,43 +524,125 @@ class AudiobookPlayer:
 
     def add_bookmark(self, dialog):
         """Add a bookmark at current position."""
-        if not self.current_book:
+        bookmark = self.playback.add_bookmark()
+        if not bookmark:
             return
         
-        book_id = self.current_book['id']
-        if book_id not in self.bookmarks:
-            self.bookmarks[book_id] = []
-        
-        bookmark = {
-            'position': self.current_position,
-            'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        }
-        
-        self.bookmarks[book_id].append(bookmark)
-        self.save_bookmarks()
+        self.bookmarks.setdefault(self.playback.book['id'], []).append(bookmark)
         
         # Update dialog
         self.create_bookmark_widget(dialog, bookmark)
 
     def go_to_bookmark(self, bookmark):
         """Go to bookmark position."""
-        self.current_position = bookmark['position']
-        self.update_progress()
-        if self.is_playing:
-            self.toggle_play()  # Stop current playback
-            self.toggle_play()  # Start from new position
+        self.seek(bookmark['position'])
+
+    def show_search(self):
+        """Show the library search dialog."""
+        dialog = ctk.CTkToplevel(self.app)
+        dialog.title("Search")
+        dialog.geometry("600x500")
+        dialog.configure(fg_color="#232F3E")
+        
+        entry = ctk.CTkEntry(dialog, placeholder_text="Search all books")
+        entry.pack(fill="x", padx=10, pady=10)
+        
+        results = ctk.CTkScrollableFrame(dialog, fg_color="#232F3E")
+        results.pack(fill="both", expand=True, padx=10, pady=5)
+        
+        entry.bind("<Return>", lambda event: self.run_search(entry.get(), results))
+        entry.focus()
+
+    def run_search(self, query, parent):
+        """Search the library and list the matching passages."""
+        for widget in parent.winfo_children():
+            widget.destroy()
+        try:
+            results = self.search_index.search(query)
+        except Exception as e:
+            print(f"Error searching: {str(e)}")
+            results = []
+        
+        if not results:
+            ctk.CTkLabel(parent, text="No matches", text_color="#B4B4B4").pack(pady=10)
+        for result in results:
+            if result['book_id'] in self.library:
+                self.create_search_result_widget(parent, result)
+
+    def create_search_result_widget(self, parent, result):
+        """Create a widget for a search hit."""
+        frame = ctk.CTkFrame(parent, fg_color="#2F3F4F")
+        frame.pack(fill="x", padx=5, pady=5)
+        
+        ctk.CTkLabel(
+            frame,
+            text=f"{self.library[result['book_id']]['title']} ({int(result['position'] * 100)}%)",
+            font=("Arial", 12, "bold"),
+            text_color="#FF9900"
+        ).pack(anchor="w", padx=5, pady=2)
+        
+        ctk.CTkLabel(
+            frame,
+            text=result['snippet'],
+            text_color="#FFFFFF",
+            wraplength=520,
+            justify="left"
+        ).pack(anchor="w", padx=5, pady=2)
+        
+        ctk.CTkButton(
+            frame,
+            text="Go to Passage",
+            fg_color="#3F4F5F",
+            hover_color="#4F5F6F",
+            command=lambda: self.go_to_search_result(result)
+        ).pack(pady=5)
+
+    def go_to_search_result(self, result):
+        """Open the hit's book if needed and seek to the passage."""
+        if not self.playback:
+            # Still starting up; the book opens at its saved position
+            self.load_book(result['book_id'])
+            return
+        if not self.playback.book or self.playback.book['id'] != result['book_id']:
+            self.load_book(result['book_id'], then=lambda: self.seek(result['position']))
+            return
+        self.seek(result['position'])
+
+    def update_chapters(self):
+        """Fill the chapter menu from the current book."""
+        text = self.playback.text
+        chapters = text.chapters if text else ()
+        titles = [chapter['title'] for chapter in chapters] or ["No chapters"]
+        self.chapter_menu.configure(values=titles)
+        self.widgets.set(self.chapter_menu, titles[0])
+
+    def go_to_chapter(self, title):
+        """Seek to the start of the chapter picked from the menu."""
+        if not self.playback.text:
+            return
+        for chapter in self.playback.text.chapters:
+            if chapter['title'] == title:
+                self.seek(chapter['position'])
+                return
 
     def update_progress(self):
         """Update progress display."""
-        if self.current_text:
-            self.progress_bar.set(self.current_position)
+        text, timeline = self.playback.text, self.playback.timeline
+        if text and timeline:
+            # Rounded so sub-pixel changes don't trigger a redraw
+            self.widgets.set(self.progress_bar, round(self.current_position, 3))
+            if text.chapters:
+                chapter = text.chapters[text.chapter_at(self.current_position)]
+                self.widgets.set(self.chapter_menu, chapter['title'])
             
-            # Update time display (rough estimate)
-            total_seconds = len(self.current_text) / (200 * self.playback_speed)  # ~200 chars per second
-            current_seconds = total_seconds * self.current_position
+            # Update time display from the calibrated timeline, as heard at this speed
+            voice, rate = self.speaker.voice, self.speaker.rate
+            scale = self.playback.time_scale()
+            total_seconds = timeline.total_seconds(voice, rate) * scale
+            current_seconds = timeline.seconds_at(self.current_position, voice, rate) * scale
             
-            self.current_time.configure(text=self.format_time(current_seconds))
-            self.total_time.configure(text=self.format_time(total_seconds))
+            self.widgets.configure(self.current_time, text=self.format_time(current_seconds))
+            self.widgets.configure(self.total_time, text=self.format_time(total_seconds))
 
     def format_time(self, seconds):
         """Format seconds to MM:SS."""
@@ -482,150 +652,174 @@ class AudiobookPlayer:
 
     def update_library_list(self):
         """Update the library list display."""
-        # Clear existing items
-        for widget in self.book_list.winfo_children():
-            widget.destroy()
-        
-        # Add books to list
-        for book_id, book in self.library.items():
-            # Create frame for book item
-            book_frame = ctk.CTkFrame(self.book_list, fg_color="#2F3F4F")
-            book_frame.pack(fill="x", padx=5, pady=2)
-            
-            # Book title
-            title = ctk.CTkLabel(
-                book_frame,
-                text=book['title'],
-                font=("Arial", 12),
-                text_color="#FFFFFF"
-            )
-            title.pack(side="left", padx=10, pady=5)
-            
-            # Make the whole frame clickable
-            book_frame.bind("<Button-1>", lambda e, id=book_id: self.load_book(id))
-            title.bind("<Button-1>", lambda e, id=book_id: self.load_book(id))
+        self.book_list.set_items(self.library.keys())
 
-    def load_book(self, book_id):
-        """Load a book from the library."""
+    def load_book(self, book_id, then=None):
+        """Load a book from the library; then() runs once it is loaded."""
+        if self.playback is None:
+            # Still starting up; loaded once the engine is ready
+            self.pending_book = book_id
+            return
         if book_id in self.library:
-            self.current_book = self.library[book_id]
-            self.book_title.configure(text=self.current_book['title'])
-            
-            try:
-                with open(self.current_book['path'], 'r', encoding='utf-8') as f:
-                    self.current_text = f.read()
-            except:
-                with open(self.current_book['path'], 'rb') as f:
-                    self.current_text = f.read().decode('utf-8', errors='ignore')
+            book = self.library[book_id]
+            self.book_title.configure(text=book['title'])
             
-            self.current_position = 0
-            self.update_progress()
+            self.open_book(book, then=then)
 
     def add_book(self):
-        """Add a new book to the library."""
+        """Add one or more books to the library."""
         try:
-            file_path = ctk.filedialog.askopenfilename(
-                title="Select PDF Book",
-                filetypes=[("PDF files", "*.pdf"), ("Text files", "*.txt")]
+            file_paths = ctk.filedialog.askopenfilenames(
+                title="Select Books",
+                filetypes=[("Text files", "*.txt"), ("PDF files", "*.pdf"), ("EPUB files", "*.epub")]
             )
             
-            if file_path:
-                # Generate unique book ID
-                book_id = str(int(datetime.now().timestamp()))
-                
-                # Create book entry
-                book = {
-                    'id': book_id,
-                    'title': os.path.splitext(os.path.basename(file_path))[0],
-                    'path': file_path,
-                    'last_played': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                }
-                
-                # Read the text
-                try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        self.current_text = f.read()
-                except:
-                    with open(file_path, 'rb') as f:
-                        self.current_text = f.read().decode('utf-8', errors='ignore')
-                
-                # Add to library
-                self.library[book_id] = book
-                self.save_library()
-                self.update_library_list()
-                
-                # Select the new book
-                self.current_book = book
-                self.book_title.configure(text=book['title'])
-                self.current_position = 0
-                self.update_progress()
+            if file_paths:
+                # Select the book afterwards when only one was picked
+                self.import_books(file_paths, select=len(file_paths) == 1)
                 
         except Exception as e:
             print(f"Error adding book: {str(e)}")
 
-    def load_library(self):
-        """Load the library data from file."""
+    def add_folder(self):
+        """Add every book found under a folder."""
         try:
-            if os.path.exists('library.json'):
-                with open('library.json', 'r') as f:
-                    return json.load(f)
+            folder = ctk.filedialog.askdirectory(title="Select Folder")
+            if folder:
+                self.import_books([folder])
         except Exception as e:
-            print(f"Error loading library: {str(e)}")
-        return {}
+            print(f"Error adding folder: {str(e)}")
+
+    def import_books(self, paths, select=False):
+        """Import books in the background; the library fills in as batches finish."""
+        from importer import LibraryImporter
+        importer = LibraryImporter(
+            self.store,
+            self.library.values(),
+            on_batch=lambda books: self.ui.call(self.add_imported_books, books),
+            on_done=lambda ids: self.ui.call(self.import_finished, ids, select)
+        )
+        importer.start(paths)
 
-    def save_library(self):
-        """Save the library data to file."""
+    def add_imported_books(self, books):
+        """Show a batch of imported books (main thread)."""
+        for book in books:
+            self.library[book['id']] = book
+            self.book_list.insert(book['id'])
+        self.search_index.enqueue(books)
+
+    def import_finished(self, book_ids, select):
+        """Called on the main thread once an import completes."""
+        if select and book_ids:
+            self.load_book(book_ids[0])
+
+    def open_text(self, book):
+        """Open a book's text (or PDF) for lazy chunked reading."""
+        from text_source import open_source
         try:
-            with open('library.json', 'w') as f:
-                json.dump(self.library, f)
+            # The chunk index is built once and reused on later loads
+            return open_source(book)
         except Exception as e:
-            print(f"Error saving library: {str(e)}")
+            print(f"Error opening text: {str(e)}")
+            return None
 
-    def load_bookmarks(self):
-        """Load bookmarks from file."""
+    def open_book(self, book, text=None, then=None):
+        """Make book current in the playback engine, at its saved position.
+
+        Opening the text can build its chunk index, so it happens on a
+        loader thread; the window catches up in book_opened().
+        """
+        self.set_playback_enabled(False)
+        loading = self.loading = object()
+        threading.Thread(target=self._load, args=(book, text, loading, then),
+                         name='book-loader', daemon=True).start()
+
+    def _load(self, book, text, loading, then):
+        """Load book into the playback engine (loader thread)."""
+        with self.load_lock:
+            if loading is not self.loading:
+                # Another book was picked meanwhile, or the window closed
+                if text:
+                    text.close()
+                return
+            self.playback.load(book, text)
+            # Loading moves bookmarks back to their text if the book was edited
+            bookmarks = self.playback.bookmarks()
+        self.ui.call(self.book_opened, book, bookmarks, loading, then)
+
+    def book_opened(self, book, bookmarks, loading, then):
+        """Show a book the loader thread made current (main thread)."""
+        self.bookmarks[book['id']] = bookmarks
+        if loading is not self.loading:
+            # A newer pick is still loading
+            return
+        self.current_position = self.playback.position
+        self.update_chapters()
+        self.update_progress()
+        self.set_playback_enabled(True)
+        if then:
+            then()
+
+    def load_library(self):
+        """Load the library data from the store."""
         try:
-            if os.path.exists('bookmarks.json'):
-                with open('bookmarks.json', 'r') as f:
-                    return json.load(f)
+            return self.store.books()
         except Exception as e:
-            print(f"Error loading bookmarks: {str(e)}")
+            print(f"Error loading library: {str(e)}")
         return {}
 
-    def save_bookmarks(self):
-        """Save bookmarks to file."""
+    def load_bookmarks(self):
+        """Load bookmarks from the store."""
         try:
-            with open('bookmarks.json', 'w') as f:
-                json.dump(self.bookmarks, f)
+            return self.store.bookmarks()
         except Exception as e:
-            print(f"Error saving bookmarks: {str(e)}")
+            print(f"Error loading bookmarks: {str(e)}")
+        return {}
 
-    def get_last_played_book(self):
+    def get_last_played_book(self, library=None):
         """Get the most recently played book."""
-        if not self.library:
-            return None
-        return max(self.library.values(), 
-                  key=lambda x: x.get('last_played', ''), 
-                  default=None)
+        try:
+            return (library or self.library).get(self.store.last_played_id())
+        except Exception as e:
+            print(f"Error finding last played book: {str(e)}")
+        return None
 
-    def show_resume_dialog(self, book):
+    def show_resume_dialog(self, book, text=None):
         """Show dialog to resume last played book."""
-        self.current_book = book
         self.book_title.configure(text=book['title'])
         
-        try:
-            with open(book['path'], 'r', encoding='utf-8') as f:
-                self.current_text = f.read()
-        except:
-            with open(book['path'], 'rb') as f:
-                self.current_text = f.read().decode('utf-8', errors='ignore')
-        
-        self.current_position = 0
-        self.update_progress()
+        self.open_book(book, text)
 
     def run(self):
         """Run the application."""
         self.app.mainloop()
+        self.ui.stop()
+        # Closed during startup: let the loaders finish so everything can be closed
+        self.library_thread.join()
+        # A book still loading finishes first; one not started yet never does
+        self.loading = None
+        with self.load_lock:
+            pass
+        if self.playback is not None:
+            self.playback.close()
+            mean, worst = self.playback.controller.control_latency()
+            print(f"Control latency: {mean * 1000:.1f} ms mean, {worst * 1000:.1f} ms max")
+        for resource in (self.positions, self.audio_cache, self.search_index, self.store):
+            if resource is not None:
+                resource.close()
+        if self.metrics_server:
+            self.metrics_server.close()
+        metrics.TRACER.close()
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "export":
+        # Headless batch rendering: python main.py export <book ids or paths>
+        from export import main as export_main
+        sys.exit(export_main(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == "daemon":
+        # Playback without the window: python main.py daemon [--port N]
+        from daemon import main as daemon_main
+        sys.exit(daemon_main(sys.argv[2:]))
+    
     player = AudiobookPlayer()
     player.run() 
\ No newline at end of file
@@ -0,0 +1,288 @@
+import os
+import json
+import time
+import threading
+from array import array
+from bisect import bisect_left
+from collections import deque
+
+WINDOW = 1024  # recent samples kept per histogram for percentiles
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DEPTH_BUCKETS = (0, 1, 2, 3, 4, 6, 8, 16)
+TRACE_FLUSH_INTERVAL = 1.0  # seconds between trace file writes
+
+METRICS_PORT_ENV = 'AUDIOBOOK_METRICS_PORT'
+TRACE_ENV = 'AUDIOBOOK_TRACE'
+
+
+class Histogram:
+    """Cumulative Prometheus buckets plus a ring buffer of recent samples.
+
+    observe() is a bisect and a few increments under a lock, so it is safe
+    to call on every chunk or UI frame.
+    """
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS, window=WINDOW):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._recent = array('d', bytes(8 * window))
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.counts[bisect_left(self.buckets, value)] += 1
+            self.sum += value
+            self._recent[self.count % len(self._recent)] = value
+            self.count += 1
+
+    def percentile(self, q):
+        """q-th percentile (0-100) of the recent samples."""
+        with self._lock:
+            samples = sorted(self._recent[:min(self.count, len(self._recent))])
+        if not samples:
+            return 0.0
+        return samples[min(len(samples) - 1, int(q / 100 * len(samples)))]
+
+    def collect(self):
+        with self._lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        cumulative = 0
+        for bound, n in zip(self.buckets, counts):
+            cumulative += n
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {count}')
+        lines.append(f"{self.name}_sum {total}")
+        lines.append(f"{self.name}_count {count}")
+        return lines
+
+    def snapshot(self):
+        return {'count': self.count, 'sum': self.sum, 'p50': self.percentile(50),
+                'p95': self.percentile(95), 'p99': self.percentile(99)}
+
+
+class Counter:
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def collect(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter",
+                f"{self.name} {self.value}"]
+
+    def snapshot(self):
+        return self.value
+
+
+class Gauge:
+    """Last set value, or the result of fn() at collection time."""
+
+    def __init__(self, name, help, fn=None):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.value = 0.0
+
+    def set(self, value):
+        self.value = value
+
+    def snapshot(self):
+        if self.fn:
+            try:
+                return self.fn()
+            except Exception:
+                return float('nan')
+        return self.value
+
+    def collect(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge",
+                f"{self.name} {self.snapshot()}"]
+
+
+class Registry:
+    """Named metrics; asking for an existing name returns the same metric."""
+
+    def __init__(self):
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, *args, **kwargs)
+            return metric
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        return self._get(Histogram, name, help, buckets)
+
+    def counter(self, name, help):
+        return self._get(Counter, name, help)
+
+    def gauge(self, name, help, fn=None):
+        gauge = self._get(Gauge, name, help)
+        if fn:
+            gauge.fn = fn
+        return gauge
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        with self._lock:
+            metrics = list(self.metrics.items())
+        return {name: metric.snapshot() for name, metric in metrics}
+
+
+class Tracer:
+    """Appends events to a JSONL file from a background thread.
+
+    event() only appends to a deque (and does nothing while no file is
+    open), so tracing adds no file I/O to the playback thread.
+    """
+
+    def __init__(self):
+        self.path = None
+        self._events = deque()
+        self._closed = threading.Event()
+        self._thread = None
+
+    @property
+    def enabled(self):
+        return self.path is not None
+
+    def open(self, path, interval=TRACE_FLUSH_INTERVAL):
+        self.path = path
+        self._closed.clear()
+        self._thread = threading.Thread(target=self._run, args=(interval,), name='trace-writer', daemon=True)
+        self._thread.start()
+
+    def event(self, name, **fields):
+        if self.path is not None:
+            fields['event'] = name
+            fields['t'] = time.time()
+            self._events.append(fields)
+
+    def flush(self):
+        if not self._events or self.path is None:
+            return
+        lines = []
+        while self._events:
+            lines.append(json.dumps(self._events.popleft()))
+        try:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write("\n".join(lines) + "\n")
+        except OSError as e:
+            print(f"Error writing trace: {str(e)}")
+
+    def close(self):
+        if self._thread:
+            self._closed.set()
+            self._thread.join(timeout=1)
+            self._thread = None
+        self.flush()
+        self.path = None
+
+    def _run(self, interval):
+        while not self._closed.wait(interval):
+            self.flush()
+
+
+class _MetricsHandler:
+    """Request handling for MetricsServer, mixed into http.server's handler."""
+
+    registry = None
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            body = self.registry.render().encode('utf-8')
+            content_type = 'text/plain; version=0.0.4; charset=utf-8'
+        elif self.path == '/metrics.json':
+            body = json.dumps(self.registry.snapshot()).encode('utf-8')
+            content_type = 'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer:
+    """Serves /metrics (Prometheus text) and /metrics.json on localhost."""
+
+    def __init__(self, registry, port, host='127.0.0.1'):
+        # Imported here; the app imports metrics before its window is up
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        handler = type('MetricsHandler', (_MetricsHandler, BaseHTTPRequestHandler),
+                       {'registry': registry})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self._thread = threading.Thread(target=self.server.serve_forever, name='metrics', daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+REGISTRY = Registry()
+TRACER = Tracer()
+
+
+def histogram(name, help, buckets=LATENCY_BUCKETS):
+    return REGISTRY.histogram(name, help, buckets)
+
+
+def counter(name, help):
+    return REGISTRY.counter(name, help)
+
+
+def gauge(name, help, fn=None):
+    return REGISTRY.gauge(name, help, fn)
+
+
+def trace(name, **fields):
+    TRACER.event(name, **fields)
+
+
+def start_from_environment():
+    """Start the endpoint and trace file if their environment variables are set.
+
+    Returns the MetricsServer, or None.
+    """
+    trace_path = os.environ.get(TRACE_ENV)
+    if trace_path:
+        TRACER.open(trace_path)
+    port = os.environ.get(METRICS_PORT_ENV)
+    if not port:
+        return None
+    try:
+        server = MetricsServer(REGISTRY, int(port))
+    except (OSError, ValueError) as e:
+        print(f"Error starting metrics endpoint: {str(e)}")
+        return None
+    print(f"Metrics at http://127.0.0.1:{server.port}/metrics")
+    return server
@@ -0,0 +1,213 @@
+"""Text normalization between a book's text and the speech engine.
+
+Removes what should not be read aloud (page numbers, hard line breaks,
+hyphenation at line ends, separator lines) and spells out what engines
+read badly (URLs, abbreviations, thousands separators, ranges).
+
+Rules are precompiled regular expressions that each start with a fixed
+set of characters, so the regex engine skips plain text at C speed and
+Python code only runs per match. Layout rules are one expression; word
+rules (abbreviations, URLs) run as a second pass, compiled for just the
+words a chunk contains, which a substring check finds first.
+
+Every chunk keeps an offset map back to the original text; chunk
+boundaries are unchanged, so positions, bookmarks and search results
+stay in original-text terms.
+"""
+import re
+from array import array
+from bisect import bisect_right
+from functools import lru_cache
+
+CACHE_CHUNKS = 1024  # normalized chunks kept in memory
+
+ABBREVIATIONS = {
+    'e.g.': 'for example',
+    'E.g.': 'For example',
+    'i.e.': 'that is',
+    'I.e.': 'That is',
+    'etc.': 'et cetera',
+    'vs.': 'versus',
+    'approx.': 'approximately',
+    'Mr.': 'Mister',
+    'Mrs.': 'Missus',
+    'Ms.': 'Miz',
+    'Dr.': 'Doctor',
+    'Prof.': 'Professor',
+    'Fig.': 'Figure',
+}
+
+# Every layout rule starts by consuming one of these characters
+TRIGGERS = r'\r\n\-\d%=_*~#'
+
+# Each rule is the rest of a match after its trigger character, ending in
+# an empty group named after the rule; alternatives are tried in order
+LAYOUT_RULES = [
+    # A line holding only a page number: "12", "- 12 -", "Page 12", "12 of 300"
+    r'(?<=\n)[ \t]*(?:[Pp]age[ \t]+)?[-–—]?[ \t]*\d{1,4}[ \t]*[-–—]?'
+    r'(?:[ \t]+of[ \t]+\d{1,4})?[ \t]*(?=\r?\n|$)(?P<page>)',
+    # A word split across lines: "exam-\nple"
+    r'(?<=[a-z]-)[ \t]*\r?\n[ \t]*(?=[a-z])(?P<hyphen>)',
+    # A single line break inside a paragraph
+    r'(?:(?<=[^\r\n]\n)|(?<=[^\r\n]\r)\n)[ \t]*(?![\r\n])(?P<wrap>)',
+    # 12,345,678
+    r'(?<![\d,]\d)(?<=\d)\d{0,2}(?:,\d{3})+(?!\d)(?P<thousands>)',
+    # 10-20, 1990–1995 (but not dates such as 2024-01-05); _replace_range
+    # keeps phone numbers, scores and such
+    r'(?<![\d-]\d)(?<=\d)\d{0,3}[ \t]?[-–][ \t]?\d{1,4}(?![\d-])(?P<range>)',
+    r'(?<=\d%)(?P<percent>)',
+    # Separator lines: "-----", "* * *", "____"
+    r'(?<=[-=_*~#])(?:[ \t]*[-=_*~#]){2,}(?P<rule>)',
+]
+RULES = re.compile('[' + TRIGGERS + '](?:' + '|'.join(LAYOUT_RULES) + ')')
+
+# Word rules by the text they start with; each only matches at the start
+# of a word and is replaced by _replace_word
+_URL_REST = r'[^\s<>"]*[^\s<>".,;:!?)\]]'
+WORD_RULES = dict.fromkeys(ABBREVIATIONS, '')
+WORD_RULES.update({
+    'http': r's?://' + _URL_REST,
+    'www.': _URL_REST,
+    # "No. 5" (but not "no." ending a sentence)
+    'No.': r'(?=[ \t]*\d)',
+})
+_URL_HOST = re.compile(r'^(?:https?://)?(?:www\.)?([^/?#:]+)', re.IGNORECASE)
+_RANGE_SPLIT = re.compile(r'[ \t]?[-–][ \t]?')
+# Words after which any "N-M" is a range
+_RANGE_CONTEXT = re.compile(r'\b(?:pages?|pp\.?|years?|chapters?|verses?|from)[ \t]+$',
+                            re.IGNORECASE)
+RANGE_CONTEXT_CHARS = 12  # how far back _RANGE_CONTEXT looks
+
+
+@lru_cache(maxsize=256)
+def _word_rules(words):
+    """Expression matching the given WORD_RULES keys at the start of a word."""
+    # The word-start check comes after the first character so every
+    # alternative begins with a literal, which the regex engine searches for
+    return re.compile('|'.join(
+        re.escape(word[0]) + r'(?<![\w.]' + re.escape(word[0]) + ')' + re.escape(word[1:]) + WORD_RULES[word]
+        for word in sorted(words, key=len, reverse=True)))
+
+
+def _replace_word(match):
+    text = match.group()
+    if text in ABBREVIATIONS:
+        return ABBREVIATIONS[text]
+    if text == 'No.':
+        return 'number'
+    host = _URL_HOST.match(text)
+    return host.group(1) if host else ''
+
+
+def _replace_range(match):
+    """Read "10-20" as "10 to 20" if it is a range; "555-1234" or "3-2" are kept.
+
+    A range either follows a word such as "pages" or "from", or goes up
+    between numbers of the same length ("1990-1995") or to a shortened
+    end ("1990-95").
+    """
+    text = match.group()
+    first, last = _RANGE_SPLIT.split(text, 1)
+    before = match.string[max(0, match.start() - RANGE_CONTEXT_CHARS):match.start()]
+    if _RANGE_CONTEXT.search(before):
+        return f"{first} to {last}"
+    if len(last) == len(first) and int(last) > int(first):
+        return f"{first} to {last}"
+    if len(last) < len(first) and int(last) > int(first[-len(last):]):
+        return f"{first} to {last}"
+    return text
+
+
+# Replacement for each rule's match, by rule name
+REPLACEMENTS = {
+    None: _replace_word,  # word rules have no group
+    'page': lambda match: ' ',
+    'hyphen': lambda match: '',
+    'wrap': lambda match: ' ',
+    'thousands': lambda match: match.group().replace(',', ''),
+    'range': _replace_range,
+    'percent': lambda match: ' percent',
+    'rule': lambda match: ' ',
+}
+
+
+class SpokenText:
+    """A chunk as it is spoken, with a map back to the original chunk.
+
+    Normalization runs in passes; each pass records its replacements as
+    (start, end, replacement length) in the text it read. Offsets are
+    mapped back through the passes in reverse: text between replacements
+    maps one to one and any offset inside a replacement maps to the
+    start of what it replaced. The lookup tables are only built the
+    first time an offset is mapped.
+    """
+
+    __slots__ = ('text', 'source_length', '_passes', '_maps')
+
+    def __init__(self, text, source_length, passes):
+        self.text = text
+        self.source_length = source_length
+        self._passes = passes
+        self._maps = None
+
+    def to_original(self, offset):
+        """Offset in the original chunk of a character of the spoken text."""
+        if self._maps is None:
+            self._maps = [_offset_map(edits) for edits in self._passes]
+        offset += 1  # the leading newline normalize() adds
+        for starts, ends, source_starts, source_ends in reversed(self._maps):
+            i = bisect_right(starts, offset) - 1
+            if i >= 0:
+                offset = source_starts[i] if offset < ends[i] else source_ends[i] + offset - ends[i]
+        return max(0, min(self.source_length, offset - 1))
+
+    def to_spoken(self, offset):
+        """First character of the spoken text that maps to offset in the original or later."""
+        lo, hi = 0, len(self.text)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.to_original(mid) < offset:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+
+def _offset_map(edits):
+    """Where each replacement of one pass starts and ends in its output and its input."""
+    starts, ends = array('l'), array('l')
+    source_starts, source_ends = array('l'), array('l')
+    shift = 0
+    for start, end, length in edits:
+        starts.append(start + shift)
+        ends.append(start + shift + length)
+        source_starts.append(start)
+        source_ends.append(end)
+        shift += length - (end - start)
+    return starts, ends, source_starts, source_ends
+
+
+def _apply(rules, text):
+    """Replace every match of rules in text; returns the result and its edits."""
+    edits = []
+
+    def replace(match):
+        replacement = REPLACEMENTS[match.lastgroup](match)
+        if replacement != match.group():
+            edits.append((match.start(), match.end(), len(replacement)))
+        return replacement
+    return rules.sub(replace, text), edits
+
+
+@lru_cache(maxsize=CACHE_CHUNKS)
+def normalize(text):
+    """SpokenText for one chunk; results are cached by chunk text."""
+    # A leading newline lets line and word rules match at the chunk start;
+    # the first spoken character always comes from it and is dropped
+    spoken, edits = _apply(RULES, '\n' + text)
+    passes = [edits]
+    words = frozenset(word for word in WORD_RULES if word in spoken)
+    if words:
+        spoken, edits = _apply(_word_rules(words), spoken)
+        passes.append(edits)
+    return SpokenText(spoken[1:], len(text), passes)
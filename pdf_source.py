@@ -0,0 +1,223 @@
+import os
+import json
+import heapq
+import threading
+from array import array
+from collections import OrderedDict
+
+from chunker import ChunkIndex
+from speech import WORD_RE, WORDS_PER_SECOND
+
+PAGE_UNITS = 1000  # position units per page; positions in a PDF are page based
+ESTIMATED_PAGE_WORDS = 300  # duration guess for pages not yet extracted
+MEMORY_PAGES = 4  # page texts kept in memory
+META_FILE = 'source.json'
+
+
+def _pdf_reader(path):
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        try:
+            from PyPDF2 import PdfReader
+        except ImportError:
+            raise ImportError("PDF support requires the pypdf package")
+    return PdfReader(path)
+
+
+def page_count(path):
+    """Number of pages, without extracting any text."""
+    return len(_pdf_reader(path).pages)
+
+
+class PdfText:
+    """PDF book whose text is extracted page by page in the background.
+
+    Each page is one chunk. A single extractor thread works forward from
+    wherever playback is and writes each page's text to cache_dir, so a
+    page is only ever extracted once; chunk() for a page that is not ready
+    yet moves it to the front of the queue and waits for it. Only the last
+    few pages are held in memory.
+
+    Until a page is extracted its duration is estimated; the index is
+    updated in place as pages come in (see ChunkIndex.version). With
+    prefetch=False only pages that are asked for get extracted.
+    """
+
+    encoding = 'utf-8'
+    chapters = ()
+
+    def __init__(self, path, cache_dir, prefetch=True):
+        self.path = path
+        self.cache_dir = cache_dir
+        self.prefetch = prefetch
+        self.chunk_size = PAGE_UNITS
+        self._reader = _pdf_reader(path)
+        pages = len(self._reader.pages)
+        self.size = os.path.getsize(path)
+        self._prepare_cache()
+
+        estimate = ESTIMATED_PAGE_WORDS / WORDS_PER_SECOND
+        offsets = array('Q', (i * PAGE_UNITS for i in range(pages + 1)))
+        self.index = ChunkIndex(offsets, offsets, array('f', [estimate] * pages), PAGE_UNITS)
+        self.offsets = self.index.byte_offsets
+
+        self._texts = OrderedDict()
+        self._unsaved = {}  # pages whose cache file could not be written
+        self._done = set()
+        self._cond = threading.Condition()
+        self._wanted = []  # pages waited on by chunk(), served first
+        self._cursor = 0  # next page to extract ahead of playback
+        self._closed = False
+
+        for page in range(pages):
+            if os.path.exists(self._page_path(page)):
+                self._done.add(page)
+                self._update_duration(page, self._read_page(page))
+        # Min-heap of pages not extracted yet; extracted ones are dropped lazily
+        self._missing = [page for page in range(pages) if page not in self._done]
+
+        self._thread = threading.Thread(target=self._extract_loop, name='pdf-extract', daemon=True)
+        self._thread.start()
+
+    @property
+    def chunk_count(self):
+        return len(self.index)
+
+    @property
+    def pages_ready(self):
+        return len(self._done)
+
+    def _prepare_cache(self):
+        """Drop cached pages left over from a different version of the file."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        stat = os.stat(self.path)
+        meta = {'size': stat.st_size, 'mtime': stat.st_mtime}
+        meta_path = os.path.join(self.cache_dir, META_FILE)
+        try:
+            with open(meta_path, 'r') as f:
+                if json.load(f) == meta:
+                    return
+        except (OSError, ValueError):
+            pass
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.txt'):
+                os.remove(os.path.join(self.cache_dir, name))
+        with open(meta_path, 'w') as f:
+            json.dump(meta, f)
+
+    def _page_path(self, page):
+        return os.path.join(self.cache_dir, f"{page:05d}.txt")
+
+    def _read_page(self, page):
+        with open(self._page_path(page), 'r', encoding='utf-8') as f:
+            return f.read()
+
+    def _update_duration(self, page, text):
+        self.index.durations[page] = len(WORD_RE.findall(text)) / WORDS_PER_SECOND
+        self.index.version += 1
+
+    def _extract_loop(self):
+        while True:
+            with self._cond:
+                page = None
+                while page is None:
+                    if self._closed:
+                        return
+                    while self._wanted and self._wanted[0] in self._done:
+                        self._wanted.pop(0)
+                    while self._cursor < self.chunk_count and self._cursor in self._done:
+                        self._cursor += 1
+                    if self._cursor >= self.chunk_count and len(self._done) < self.chunk_count:
+                        # Reached the end; go back for pages skipped by a seek
+                        while self._missing[0] in self._done:
+                            heapq.heappop(self._missing)
+                        self._cursor = self._missing[0]
+                    if self._wanted:
+                        page = self._wanted[0]
+                    elif self.prefetch and self._cursor < self.chunk_count:
+                        page = self._cursor
+                    else:
+                        self._cond.wait()
+            try:
+                text = self._reader.pages[page].extract_text() or ""
+            except Exception as e:
+                print(f"Error extracting page {page + 1}: {str(e)}")
+                text = ""
+            # Several export processes, and sources in this one (playback and
+            # the search indexer), may extract the same page at once
+            tmp_path = f"{self._page_path(page)}.{os.getpid()}.{threading.get_ident()}.part"
+            saved = True
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    f.write(text)
+                os.replace(tmp_path, self._page_path(page))
+            except OSError as e:
+                print(f"Error caching page {page + 1}: {str(e)}")
+                saved = False
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            with self._cond:
+                if not saved:
+                    self._unsaved[page] = text
+                self._done.add(page)
+                self._remember(page, text)
+                self._update_duration(page, text)
+                self._cond.notify_all()
+
+    def _remember(self, page, text):
+        self._texts[page] = text
+        self._texts.move_to_end(page)
+        while len(self._texts) > MEMORY_PAGES:
+            self._texts.popitem(last=False)
+
+    def chunk(self, index):
+        """Text of one page, waiting for it to be extracted if necessary.
+
+        A page that is not extracted yet reads as '' once the source is
+        closed (the book was switched while it was being rendered).
+        """
+        with self._cond:
+            if index in self._texts:
+                self._texts.move_to_end(index)
+                return self._texts[index]
+            if index not in self._done:
+                self._wanted.append(index)
+                # Read ahead from here once this page is done
+                self._cursor = index
+                self._cond.notify_all()
+                while index not in self._done and not self._closed:
+                    self._cond.wait()
+                if index in self._texts:
+                    return self._texts[index]
+                if index not in self._done:
+                    return ""
+            if index in self._unsaved:
+                return self._unsaved[index]
+        text = self._read_page(index)
+        with self._cond:
+            self._remember(index, text)
+        return text
+
+    def chunk_at(self, fraction):
+        return self.index.chunk_at(fraction)
+
+    def position_of(self, chunk):
+        return self.index.fraction(chunk)
+
+    def close(self):
+        """Stop extracting; waits for a page being extracted so the reader is no longer used."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def __len__(self):
+        return self.size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
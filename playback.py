@@ -0,0 +1,320 @@
+import time
+from datetime import datetime
+
+from audio_pack import open_pack, render_settings
+from controller import PlaybackController
+from speech import create_engine
+from text_source import open_source
+from timing import DurationModel, Timeline
+
+ANCHOR_CHARS = 40  # text stored with a bookmark to find it again after an edit
+
+
+def now():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+class PlaybackEngine:
+    """Everything about listening to one book, with no UI attached.
+
+    Holds the current book and text, position, speed, sleep timer and the
+    duration model, and drives a PlaybackController with its own speech
+    engine. The window and the HTTP daemon are both clients of this class;
+    a daemon runs one per session, all rendering on one shared
+    SynthesisScheduler.
+
+    Listeners run on the playback thread:
+        on_progress(position)         a chunk finished
+        on_state(state)               'playing', 'paused' or 'stopped'
+        on_chunk(index, count)        a chunk started playing
+    """
+
+    def __init__(self, store, positions, speaker=None, cache=None, scheduler=None):
+        self.store = store
+        self.positions = positions
+        self.speaker = speaker or create_engine()
+        self.speaker.rate = 1  # -10 to 10
+        self.speaker.volume = 100  # 0 to 100
+        self.speaker.on_chunk = self.on_chunk_spoken
+
+        # Speaking speed is calibrated from every chunk actually played
+        self.duration_model = DurationModel()
+
+        # Playback runs on the controller's thread; this class only posts commands
+        self.controller = PlaybackController(self.speaker, cache=cache, scheduler=scheduler)
+        self.controller.on_chunk = self.on_playback_chunk
+        self.controller.on_progress = self.on_playback_progress
+        self.controller.on_state = self.on_playback_state
+
+        self.book = None
+        self.text = None
+        self.timeline = None
+        self.position = 0.0
+        self.chunk_count = 0
+        self.speed = 1.0
+        self.sleep_timer = None  # time.time() at which to pause
+
+        self.on_progress = None
+        self.on_state = None
+        self.on_chunk = None
+
+    @property
+    def state(self):
+        return self.controller.state
+
+    @property
+    def is_playing(self):
+        return self.controller.state == 'playing'
+
+    # Controller callbacks (playback thread)
+
+    def on_playback_chunk(self, index, count):
+        self.chunk_count = count
+        if self.on_chunk:
+            self.on_chunk(index, count)
+
+    def on_playback_progress(self, position, index):
+        self.position = position
+        self.record_position(self.controller.book_id, position, index + 1)
+        if self.on_progress:
+            self.on_progress(position)
+
+        # Check sleep timer
+        if self.sleep_timer and time.time() >= self.sleep_timer:
+            print("Sleep timer triggered")
+            self.controller.pause()
+            self.sleep_timer = None
+
+    def on_playback_state(self, state):
+        if state != 'playing' and self.controller.book_id:
+            # Pause, sleep timer, end of book or switching books
+            book = None
+            if self.book and self.book['id'] == self.controller.book_id:
+                self.position = self.controller.position
+                book = self._played()
+            self.record_position(self.controller.book_id, self.controller.position,
+                                 self.controller.chunk)
+            # The position and the book's last played time in one write
+            self.positions.flush(book)
+        if self.on_state:
+            self.on_state(state)
+
+    def on_chunk_spoken(self, text, seconds):
+        """Calibrate the duration model from a chunk's measured length."""
+        self.duration_model.observe(text, seconds, self.speaker.voice, self.speaker.rate)
+
+    def record_position(self, book_id, position, chunk):
+        """Remember a book's position; written to disk in the background."""
+        if book_id:
+            self.positions.record(book_id, position, chunk, now())
+
+    # Commands
+
+    def load(self, book, text=None):
+        """Make book current, resuming at its saved position.
+
+        text may be an already opened source for the book. Returns False
+        if the book's text could not be opened.
+        """
+        if text is None:
+            try:
+                # The chunk index is built once and reused on later loads
+                text = open_source(book)
+            except Exception as e:
+                print(f"Error opening text: {str(e)}")
+                text = None
+        self.book = book
+        self.text = text
+        self.position = 0.0
+        self.timeline = None
+        if text:
+            self.duration_model = DurationModel(book.get('timing', self.duration_model.estimates))
+            self.timeline = Timeline(text.index, self.duration_model)
+            self.chunk_count = text.chunk_count
+
+            # Resume where this book was left
+            saved = self.store.position(book['id'])
+            if saved:
+                self.position = saved[0]
+            self.reanchor_bookmarks()
+        # Audio rendered with another engine, voice, rate or volume is not used
+        pack = open_pack(book['id'], text, settings=render_settings(self.speaker)) if text else None
+        self.controller.load(text, self.position, book['id'], pack)
+        return text is not None
+
+    def play(self):
+        if not self.text:
+            return False
+        self.controller.play()
+        self.mark_played()
+        return True
+
+    def pause(self):
+        # Saved with the position once the controller has paused
+        self.controller.pause()
+
+    def toggle(self):
+        if self.is_playing:
+            self.pause()
+        else:
+            self.play()
+
+    def mark_played(self):
+        """Update last played time and the calibrated timing on the book, and save it."""
+        try:
+            self.store.save_book(self._played())
+        except Exception as e:
+            print(f"Error saving library: {str(e)}")
+
+    def _played(self):
+        """The current book with its last played time and calibrated timing updated."""
+        self.book['last_played'] = now()
+        self.book['timing'] = self.duration_model.to_dict()
+        return self.book
+
+    def seek(self, position):
+        """Move playback to a position fraction without stopping it."""
+        position = max(0.0, min(1.0, position))
+        self.position = position
+        self.controller.seek(position)
+        if self.book and self.text:
+            self.record_position(self.book['id'], position, self.text.chunk_at(position))
+        return position
+
+    def skip(self, seconds):
+        """Move the position by a number of seconds of speech."""
+        if self.text and self.timeline:
+            # From the words being spoken, not the start of their chunk
+            position = self.controller.current_position() if self.is_playing else self.position
+            return self.seek(self.timeline.skip(
+                position, seconds, self.speaker.voice, self.speaker.rate))
+        return self.position
+
+    def set_speed(self, speed):
+        """Change playback speed (0.5 to 2.0)."""
+        self.speed = speed
+        # Time-stretched on the playback thread; see timestretch.py
+        self.controller.set_speed(speed)
+
+    def time_scale(self):
+        """Listening seconds per second of the timeline (which is at normal speed
+        unless speed had to be applied as the engine's rate)."""
+        return 1.0 / self.controller.speed
+
+    def set_sleep_timer(self, minutes):
+        """Pause after the given number of minutes; None turns the timer off."""
+        self.sleep_timer = time.time() + minutes * 60 if minutes else None
+
+    # Bookmarks
+
+    def bookmarks(self):
+        if not self.book:
+            return []
+        return self.store.book_bookmarks(self.book['id'])
+
+    def anchor(self, position):
+        """What ties a bookmark at position to the text there (see store.BOOKMARK_ANCHOR)."""
+        index = self.text.index if self.text else None
+        if index is None or index.hashes is None or not len(index):
+            return {}
+        chunk = index.chunk_at(position)
+        offset = max(0, round(position * index.total_chars) - index.char_offsets[chunk])
+        return {
+            'chunk_id': index.hashes[chunk],
+            'chunk_offset': offset,
+            'anchor': self.text.chunk(chunk)[offset:offset + ANCHOR_CHARS],
+        }
+
+    def reanchor_bookmarks(self):
+        """Move the current book's bookmarks back to their text after the book was edited.
+
+        A bookmark in an unchanged chunk follows the chunk by content id;
+        one in edited text is looked for by its anchor text around where
+        it was. Returns the bookmarks that moved.
+        """
+        index = self.text.index
+        if index.hashes is None or not len(index):
+            return []
+        chunks = None  # content id -> chunk, built if a chunk moved
+        moved = []
+        for bookmark in self.store.book_bookmarks(self.book['id']):
+            if bookmark['chunk_id'] is None:
+                continue
+            near = index.chunk_at(bookmark['position'])
+            if index.hashes[near] == bookmark['chunk_id']:
+                chunk = near
+            else:
+                if chunks is None:
+                    chunks = {chunk_id: i for i, chunk_id in enumerate(index.hashes)}
+                chunk = chunks.get(bookmark['chunk_id'])
+            offset = bookmark['chunk_offset']
+            if chunk is None:
+                chunk, offset = self._find_anchor(bookmark['anchor'], near)
+                if chunk is None:
+                    continue
+            char = index.char_offsets[chunk] + offset
+            if char == round(bookmark['position'] * index.total_chars):
+                continue
+            bookmark.update(position=char / index.total_chars, chunk_id=index.hashes[chunk],
+                            chunk_offset=offset)
+            moved.append(bookmark)
+        if moved:
+            try:
+                self.store.move_bookmarks(moved)
+            except Exception as e:
+                print(f"Error saving bookmarks: {str(e)}")
+        return moved
+
+    def _find_anchor(self, anchor, near):
+        """(chunk, offset) of anchor text in chunk near or either neighbour, or (None, None)."""
+        if anchor:
+            for chunk in (near, near - 1, near + 1):
+                if 0 <= chunk < self.text.chunk_count:
+                    offset = self.text.chunk(chunk).find(anchor)
+                    if offset >= 0:
+                        return chunk, offset
+        return None, None
+
+    def add_bookmark(self, position=None):
+        """Bookmark the current (or given) position of the current book."""
+        if not self.book:
+            return None
+        if position is None:
+            position = self.controller.current_position()
+        bookmark = {'position': position, 'timestamp': now()}
+        bookmark.update(self.anchor(position))
+        try:
+            self.store.add_bookmark(self.book['id'], bookmark)
+        except Exception as e:
+            print(f"Error saving bookmarks: {str(e)}")
+        return bookmark
+
+    # Status
+
+    def status(self):
+        """Snapshot of the session as plain data."""
+        status = {
+            'book_id': self.book['id'] if self.book else None,
+            'title': self.book['title'] if self.book else None,
+            'state': self.state,
+            'position': self.position,
+            'chunk': self.controller.chunk,
+            'chunks': self.chunk_count,
+            'speed': self.speed,
+            'underruns': self.controller.underruns,
+            'sleep_timer': max(0.0, self.sleep_timer - time.time()) if self.sleep_timer else None,
+        }
+        if self.timeline:
+            voice, rate = self.speaker.voice, self.speaker.rate
+            status['seconds'] = self.timeline.seconds_at(self.position, voice, rate)
+            status['total_seconds'] = self.timeline.total_seconds(voice, rate)
+        return status
+
+    def close(self):
+        """Save the position and stop the playback thread."""
+        if self.controller.book_id:
+            self.record_position(self.controller.book_id, self.controller.current_position(),
+                                 self.controller.chunk)
+        self.controller.shutdown()
+        if self.text:
+            self.text.close()
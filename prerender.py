@@ -0,0 +1,231 @@
+import queue
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import metrics
+import timestretch
+from audio_cache import cache_key
+from normalize import normalize
+from scheduler import SynthesisScheduler
+
+LOOKAHEAD = 4  # chunks rendered ahead of the one playing
+WORKERS = 2
+IDLE_SLACK = 5.0  # seconds; sessions that are not playing yield to those that are
+
+SYNTHESIS = metrics.histogram('audiobook_synthesis_seconds', "Time to synthesize one chunk")
+
+
+class PrerenderPipeline:
+    """Synthesizes upcoming chunks on a worker pool while the current one plays.
+
+    A feeder thread submits chunks in order and parks their futures in a
+    bounded queue, so at most `lookahead` chunks are rendered ahead of
+    playback. start() (seek or speed change) bumps the generation, which
+    discards everything queued or in flight for the old position. With an
+    AudioCache, chunks rendered before are read back instead of
+    synthesized again; with an AudioPack (a book rendered ahead of time)
+    chunks are decoded from it instead.
+
+    Chunks are synthesized (and cached) at normal speed and time-stretched
+    to `speed` before being queued; set `speed` and start() again to
+    change it.
+
+    Rendering runs on a SynthesisScheduler. Sessions that pass a shared
+    one compete for its workers by deadline(); otherwise the pipeline
+    gets a private pool of `workers` threads.
+    """
+
+    def __init__(self, engine, text, lookahead=LOOKAHEAD, workers=WORKERS, cache=None,
+                 scheduler=None, pack=None):
+        self.engine = engine
+        self.text = text
+        self.cache = cache
+        self.pack = pack
+        self._own_scheduler = scheduler is None
+        self._scheduler = scheduler or SynthesisScheduler(workers, name='prerender')
+        self._queue = queue.Queue(maxsize=lookahead)
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._pending = None  # queue item taken by next() but not yet ready
+        self._playing_until = None  # when the chunk playing ends, while playing
+        self.speed = 1.0
+
+        # Synthesis rate counters
+        self.chunks_rendered = 0
+        self.audio_seconds = 0.0
+        self.synth_seconds = 0.0
+
+    def start(self, chunk, char_offset=0):
+        """(Re)start rendering from the given chunk index.
+
+        With a pack, the first chunk starts near char_offset into its text.
+        """
+        generation = self._cancel()
+        feeder = threading.Thread(target=self._feed, args=(generation, chunk, char_offset),
+                                  daemon=True)
+        feeder.start()
+
+    def cancel(self):
+        """Drop all queued audio; next() returns None until start() is called again."""
+        generation = self._cancel()
+        while True:
+            try:
+                self._queue.put_nowait((generation, None))
+                return
+            except queue.Full:
+                # A stale feeder slipped an item in after the drain
+                self._drain()
+
+    def next(self, timeout=None):
+        """Return the next rendered AudioBuffer, or None at the end of the book.
+
+        With a timeout, raises TimeoutError if the next chunk is not ready
+        in time; the following call picks up where this one left off.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(0, deadline - time.monotonic())
+            if self._pending is None:
+                try:
+                    self._pending = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    raise TimeoutError("next chunk not rendered yet")
+            generation, future = self._pending
+            if generation != self._generation:
+                self._pending = None
+                if future:
+                    future.cancel()
+                continue
+            if future is None:
+                self._pending = None
+                return None
+            try:
+                buffer = future.result(timeout=remaining)
+            except FutureTimeoutError:
+                raise TimeoutError("next chunk not rendered yet")
+            self._pending = None
+            if buffer is not None:
+                return buffer
+
+    def close(self):
+        self.cancel()
+        if self._own_scheduler:
+            self._scheduler.shutdown()
+        else:
+            self._scheduler.forget(self)
+
+    def set_playing(self, until):
+        """Tell the scheduler when the chunk now playing ends (time.monotonic()),
+        or None while playback is paused or stopped."""
+        self._playing_until = until
+
+    def deadline(self):
+        """time.monotonic() at which playback runs out of rendered audio."""
+        now = time.monotonic()
+        until = self._playing_until
+        deadline = max(now, until) if until is not None else now + IDLE_SLACK
+        with self._queue.mutex:
+            items = list(self._queue.queue)
+        pending = self._pending
+        if pending is not None:
+            items.insert(0, pending)
+        # Only audio that can play without a gap counts
+        for generation, future in items:
+            if future is None or generation != self._generation:
+                break
+            if not future.done() or future.cancelled() or future.exception() is not None:
+                break
+            buffer = future.result()
+            if buffer is None:
+                break
+            deadline += buffer.duration
+        return deadline
+
+    def depth(self):
+        """Chunks queued ahead of playback."""
+        return self._queue.qsize()
+
+    def realtime_factor(self):
+        """Seconds of audio synthesized per second of worker time."""
+        if not self.synth_seconds:
+            return 0.0
+        return self.audio_seconds / self.synth_seconds
+
+    def _cancel(self):
+        with self._lock:
+            self._generation += 1
+            generation = self._generation
+        self._drain()
+        return generation
+
+    def _drain(self):
+        while True:
+            try:
+                _, future = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if future:
+                future.cancel()
+
+    def _put(self, generation, item):
+        """Queue an item, blocking for space; returns False once the generation is stale."""
+        while generation == self._generation:
+            try:
+                self._queue.put((generation, item), timeout=0.05)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _feed(self, generation, chunk, char_offset):
+        for i in range(chunk, self.text.chunk_count):
+            try:
+                future = self._scheduler.submit(self, self._render, generation, i,
+                                                char_offset if i == chunk else 0)
+            except RuntimeError:
+                # Scheduler shut down by close()
+                return
+            if not self._put(generation, future):
+                future.cancel()
+                return
+        self._put(generation, None)
+
+    def _render(self, generation, index, char_offset=0):
+        if generation != self._generation:
+            return None
+        chunk = self.text.chunk(index)
+        if self.pack:
+            buffer = self.pack.read(index, char_offset, chunk)
+            if buffer is not None:
+                return self._stretch(buffer)
+        spoken = normalize(chunk).text
+        if self.cache:
+            key = cache_key(self.engine, spoken)
+            buffer = self.cache.get(key)
+            if buffer is not None:
+                buffer.text = chunk
+                buffer.index = index
+                return self._stretch(buffer)
+
+        start = time.perf_counter()
+        buffer = self.engine.synthesize(spoken)
+        elapsed = time.perf_counter() - start
+        # Timing and word progress are tracked against the book's own text
+        buffer.text = chunk
+        buffer.index = index
+        if self.cache:
+            self.cache.put(key, buffer)
+        with self._lock:
+            self.chunks_rendered += 1
+            self.audio_seconds += buffer.duration
+            self.synth_seconds += elapsed
+        SYNTHESIS.observe(elapsed)
+        metrics.trace('synthesize', chunk=index, seconds=elapsed, audio_seconds=buffer.duration)
+        return self._stretch(buffer)
+
+    def _stretch(self, buffer):
+        speed = self.speed
+        if speed == 1.0:
+            return buffer
+        return timestretch.stretch(buffer, speed)
@@ -0,0 +1,142 @@
+import time
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+import metrics
+
+TASK_SECONDS = metrics.histogram('audiobook_scheduler_task_seconds', "Worker time per scheduled synthesis task")
+SLACK = metrics.histogram('audiobook_scheduler_slack_seconds',
+                          "Time left before a session's audio ran out when its chunk was picked",
+                          (0, 0.5, 1, 2.5, 5, 10, 30, 60))
+
+
+class SynthesisScheduler:
+    """Renders chunks for many playback sessions on one bounded worker pool.
+
+    A session is any object with a deadline() method returning the
+    time.monotonic() at which its rendered audio runs out (see
+    PrerenderPipeline). Each session's tasks run in the order submitted;
+    whenever a worker is free it takes the next task of the session with
+    the earliest deadline, so the listener closest to an underrun is
+    served first. Sessions with equal deadlines take turns.
+    """
+
+    def __init__(self, workers=2, name='synthesis'):
+        self.workers = workers
+        self._tasks = {}  # session -> deque of (future, fn, args)
+        self._served = {}  # session -> time.monotonic() it last got a worker
+        self._cond = threading.Condition()
+        self._closed = False
+
+        # Throughput counters
+        self.started = time.monotonic()
+        self.tasks_run = 0
+        self.audio_seconds = 0.0
+        self.busy_seconds = 0.0
+        self.cpu_seconds = 0.0
+
+        self._threads = [threading.Thread(target=self._work, name=f'{name}-{i}', daemon=True)
+                         for i in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, session, fn, *args):
+        """Queue fn(*args) for a session; returns a concurrent.futures.Future."""
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("scheduler is shut down")
+            self._tasks.setdefault(session, deque()).append((future, fn, args))
+            self._cond.notify()
+        return future
+
+    def forget(self, session):
+        """Cancel a session's queued tasks (it is closing)."""
+        with self._cond:
+            tasks = self._tasks.pop(session, ())
+            self._served.pop(session, None)
+        for future, _, _ in tasks:
+            future.cancel()
+
+    def shutdown(self):
+        with self._cond:
+            self._closed = True
+            tasks = [task for queued in self._tasks.values() for task in queued]
+            self._tasks.clear()
+            self._cond.notify_all()
+        for future, _, _ in tasks:
+            future.cancel()
+
+    def queued(self):
+        with self._cond:
+            return sum(len(tasks) for tasks in self._tasks.values())
+
+    def sessions(self):
+        """Sessions with tasks waiting."""
+        with self._cond:
+            return len(self._tasks)
+
+    def stats(self):
+        """Throughput so far; sessions_per_core is audio seconds rendered per CPU second."""
+        elapsed = time.monotonic() - self.started
+        return {
+            'workers': self.workers,
+            'waiting_sessions': self.sessions(),
+            'queued': self.queued(),
+            'tasks': self.tasks_run,
+            'audio_seconds': self.audio_seconds,
+            'cpu_seconds': self.cpu_seconds,
+            'utilization': self.busy_seconds / (elapsed * self.workers) if elapsed else 0.0,
+            'sessions_per_core': self.audio_seconds / self.cpu_seconds if self.cpu_seconds else 0.0,
+        }
+
+    def _pick(self):
+        """Pop the most urgent task; called with the lock held."""
+        best = None
+        for session in list(self._tasks):
+            tasks = self._tasks[session]
+            while tasks and tasks[0][0].cancelled():
+                tasks.popleft()
+            if not tasks:
+                del self._tasks[session]
+                continue
+            key = (session.deadline(), self._served.get(session, 0.0))
+            if best is None or key < best[0]:
+                best = (key, session)
+        if best is None:
+            return None
+        (deadline, _), session = best
+        self._served[session] = time.monotonic()
+        return deadline, self._tasks[session].popleft()
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        return
+                    picked = self._pick()
+                    if picked:
+                        break
+                    self._cond.wait()
+            deadline, (future, fn, args) = picked
+            if not future.set_running_or_notify_cancel():
+                continue
+            SLACK.observe(max(0.0, deadline - time.monotonic()))
+
+            start, cpu = time.perf_counter(), time.thread_time()
+            try:
+                result = fn(*args)
+            except BaseException as e:
+                future.set_exception(e)
+                result = None
+            else:
+                future.set_result(result)
+            elapsed, cpu = time.perf_counter() - start, time.thread_time() - cpu
+            TASK_SECONDS.observe(elapsed)
+            with self._cond:
+                self.tasks_run += 1
+                self.busy_seconds += elapsed
+                self.cpu_seconds += cpu
+                self.audio_seconds += getattr(result, 'duration', 0.0)
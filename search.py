@@ -0,0 +1,244 @@
+import os
+import re
+import queue
+import sqlite3
+import threading
+
+from store import data_path
+from text_source import open_source
+
+SEARCH_DB_FILE = 'search.db'
+MAX_RESULTS = 50
+RANK_CANDIDATES = 2000  # matches scored per query; bounds the cost of common words
+SNIPPET_WORDS = 12
+
+QUERY_TOKEN = re.compile(r'\w+')
+
+SCHEMA_VERSION = 2  # PRAGMA user_version; indexes in an older layout are rebuilt
+
+SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS passages USING fts5(text);
+
+-- Where each passage is; rewritten in place when an edit moves a chunk
+CREATE TABLE IF NOT EXISTS passage_chunks (
+    passage INTEGER PRIMARY KEY,
+    book_id TEXT NOT NULL,
+    chunk INTEGER NOT NULL,
+    char_start INTEGER NOT NULL,
+    char_end INTEGER NOT NULL,
+    chunk_id INTEGER
+);
+CREATE INDEX IF NOT EXISTS passage_chunks_book ON passage_chunks(book_id);
+
+CREATE TABLE IF NOT EXISTS indexed_books (
+    book_id TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    chars INTEGER NOT NULL
+);
+"""
+
+
+def fts_query(text):
+    """Turn free text into an FTS5 query: every word must match, the last as a prefix."""
+    tokens = QUERY_TOKEN.findall(text)
+    if not tokens:
+        return None
+    terms = [f'"{token}"' for token in tokens]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def make_snippet(passage, at, words=SNIPPET_WORDS):
+    """A few words of passage around the character index at."""
+    before = passage[:at].split()[-(words // 2):]
+    after = passage[at:].split()[:words - len(before)]
+    snippet = ' '.join(before + after)
+    if len(before) < len(passage[:at].split()):
+        snippet = '…' + snippet
+    if len(after) < len(passage[at:].split()):
+        snippet += '…'
+    return snippet
+
+
+class SearchIndex:
+    """Full-text index of every book in the library (SQLite FTS5).
+
+    Each chunk is one indexed passage, stored with the character offset
+    where it starts. The index lives in its own database next to the
+    library so it can be deleted and rebuilt at any time. A book is only
+    re-indexed when its file's size or modification time changes, and
+    then only chunks whose content id is new are; passages of unchanged
+    chunks just get their new offsets.
+
+    Indexing runs on a background thread with its own connection; in WAL
+    mode searches from the UI never wait for it.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or data_path(SEARCH_DB_FILE)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        with self.db:
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            if self.db.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+                self.db.executescript("DROP TABLE IF EXISTS passages; DROP TABLE IF EXISTS indexed_books;")
+            self.db.executescript(SCHEMA)
+            self.db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def close(self):
+        if self._thread:
+            self._queue.put(None)
+            self._thread.join(timeout=1)
+        self.db.close()
+
+    # Indexing
+
+    def enqueue(self, books):
+        """Index books in the background; unchanged books are skipped."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='search-indexer', daemon=True)
+            self._thread.start()
+        for book in books:
+            self._queue.put(dict(book))
+
+    def _run(self):
+        db = sqlite3.connect(self.path)
+        changed = 0
+        try:
+            while True:
+                book = self._queue.get()
+                if book is None:
+                    return
+                try:
+                    changed += self.index_book(book, db)
+                except Exception as e:
+                    print(f"Error indexing {book.get('title')}: {str(e)}")
+                if changed and self._queue.empty():
+                    # Merge the segments left by a batch of inserts so
+                    # queries stay fast
+                    with db:
+                        db.execute("INSERT INTO passages (passages) VALUES ('optimize')")
+                    changed = 0
+        finally:
+            db.close()
+
+    def index_book(self, book, db=None):
+        """(Re)index one book if its file changed; returns True if it did."""
+        db = db or self.db
+        try:
+            stat = os.stat(book['path'])
+        except OSError:
+            return False
+        row = db.execute(
+            "SELECT size, mtime FROM indexed_books WHERE book_id = ?", (book['id'],)
+        ).fetchone()
+        if row and row[0] == stat.st_size and row[1] == stat.st_mtime:
+            return False
+
+        old = {}  # chunk id -> [(passage, chunk, char_start)]
+        for passage, chunk, start, chunk_id in db.execute(
+            "SELECT passage, chunk, char_start, chunk_id FROM passage_chunks WHERE book_id = ?",
+            (book['id'],)
+        ):
+            old.setdefault(chunk_id, []).append((passage, chunk, start))
+
+        text = open_source(book, prefetch=False)
+        try:
+            offsets, ids = text.index.char_offsets, text.index.hashes
+            moved, added = [], []
+            for i in range(text.chunk_count):
+                chunk_id = ids[i] if ids is not None else None
+                kept = old.get(chunk_id) if chunk_id is not None else None
+                if kept:
+                    passage, chunk, start = kept.pop()
+                    if (chunk, start) != (i, offsets[i]):
+                        moved.append((i, offsets[i], offsets[i + 1], passage))
+                else:
+                    added.append((text.chunk(i), i, offsets[i], offsets[i + 1], chunk_id))
+            chars = text.index.total_chars
+        finally:
+            text.close()
+        removed = [(passage,) for rows in old.values() for passage, _, _ in rows]
+        with db:
+            db.executemany("DELETE FROM passages WHERE rowid = ?", removed)
+            db.executemany("DELETE FROM passage_chunks WHERE passage = ?", removed)
+            db.executemany(
+                "UPDATE passage_chunks SET chunk = ?, char_start = ?, char_end = ? WHERE passage = ?",
+                moved
+            )
+            first = (db.execute("SELECT max(rowid) FROM passages").fetchone()[0] or 0) + 1
+            db.executemany(
+                "INSERT INTO passages (rowid, text) VALUES (?, ?)",
+                [(first + n, row[0]) for n, row in enumerate(added)]
+            )
+            db.executemany(
+                "INSERT INTO passage_chunks (passage, book_id, chunk, char_start, char_end, chunk_id)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                [(first + n, book['id'], *row[1:]) for n, row in enumerate(added)]
+            )
+            db.execute(
+                "INSERT OR REPLACE INTO indexed_books (book_id, size, mtime, chars) VALUES (?, ?, ?, ?)",
+                (book['id'], stat.st_size, stat.st_mtime, chars)
+            )
+        return True
+
+    def remove(self, book_id):
+        with self.db:
+            self.db.execute(
+                "DELETE FROM passages WHERE rowid IN (SELECT passage FROM passage_chunks WHERE book_id = ?)",
+                (book_id,)
+            )
+            self.db.execute("DELETE FROM passage_chunks WHERE book_id = ?", (book_id,))
+            self.db.execute("DELETE FROM indexed_books WHERE book_id = ?", (book_id,))
+
+    # Queries
+
+    def search(self, text, limit=MAX_RESULTS):
+        """Best matching passages across the library.
+
+        Returns dicts with book_id, chunk, char_offset (of the first matched
+        word), position (0-1 fraction for seeking) and a snippet.
+        """
+        query = fts_query(text)
+        if not query:
+            return []
+        # ORDER BY rank scores every match, which takes hundreds of ms for a
+        # word found in every chunk; score a bounded set of candidates instead
+        candidates = self.db.execute(
+            "SELECT rowid, bm25(passages) FROM passages WHERE passages MATCH ? LIMIT ?",
+            (query, RANK_CANDIDATES)
+        ).fetchall()
+        candidates.sort(key=lambda row: row[1])
+        best = [rowid for rowid, score in candidates[:limit]]
+        if not best:
+            return []
+        order = {rowid: i for i, rowid in enumerate(best)}
+        # Plain rowid lookups; snippet() would re-run the match for every row
+        rows = self.db.execute(
+            "SELECT p.rowid, c.book_id, c.chunk, c.char_start, c.char_end, p.text, b.chars"
+            " FROM passages p JOIN passage_chunks c ON c.passage = p.rowid"
+            " JOIN indexed_books b ON b.book_id = c.book_id"
+            f" WHERE p.rowid IN ({','.join('?' * len(best))})",
+            best
+        ).fetchall()
+        rows.sort(key=lambda row: order[row[0]])
+
+        first_word = re.compile(r'\b' + re.escape(QUERY_TOKEN.findall(text)[0]), re.IGNORECASE)
+        results = []
+        for rowid, book_id, chunk, start, end, passage, chars in rows:
+            match = first_word.search(passage)
+            at = match.start() if match else 0
+            # Offsets are in the source's own units (PDF pages are fixed width)
+            char_offset = round(start + at / max(len(passage), 1) * (end - start))
+            results.append({
+                'book_id': book_id,
+                'chunk': chunk,
+                'char_offset': char_offset,
+                'position': char_offset / chars if chars else 0.0,
+                'snippet': make_snippet(passage, at),
+            })
+        return results
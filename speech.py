@@ -0,0 +1,325 @@
+import os
+import re
+import sys
+import time
+import wave
+import threading
+
+SAMPLE_RATE = 22050  # Hz, 16-bit mono
+WORDS_PER_SECOND = 2.75  # ~165 wpm at rate 0
+
+# SAPI SpeakFlags
+SVSFlagsAsync = 1
+SVSFPurgeBeforeSpeak = 2
+SAFT22kHz16BitMono = 22
+
+WORD_RE = re.compile(r'\S+')
+
+
+def rate_factor(rate):
+    """Speed multiplier for a SAPI-style rate (-10 to 10)."""
+    # SAPI maps +10 to roughly 3x and -10 to roughly 1/3x normal speed
+    return 3 ** (rate / 10)
+
+
+class AudioBuffer:
+    """Rendered 16-bit mono PCM for one chunk of text.
+
+    Buffers time-stretched for playback (timestretch.py) record their
+    speed and the unstretched buffer they were made from.
+    """
+
+    __slots__ = ('pcm', 'sample_rate', 'text', 'index', 'speed', 'source')
+
+    def __init__(self, pcm, sample_rate, text, index=None):
+        self.pcm = pcm
+        self.sample_rate = sample_rate
+        self.text = text
+        self.index = index
+        self.speed = 1.0
+        self.source = None
+
+    @property
+    def duration(self):
+        return len(self.pcm) / 2 / self.sample_rate
+
+    @property
+    def speech_seconds(self):
+        """How long the text takes to speak at normal speed."""
+        return self.duration * self.speed
+
+
+class SpeechEngine:
+    """Interface shared by all text-to-speech backends."""
+
+    name = 'base'
+
+    def __init__(self):
+        self._rate = 0  # -10 to 10
+        self._volume = 100  # 0 to 100
+        self.voice = 'default'
+        # Progress callbacks, invoked from the speaking thread
+        self.on_word = None  # on_word(char_offset, length)
+        self.on_chunk = None  # on_chunk(text, seconds)
+
+    @property
+    def rate(self):
+        return self._rate
+
+    @rate.setter
+    def rate(self, value):
+        self._rate = max(-10, min(10, int(value)))
+
+    @property
+    def volume(self):
+        return self._volume
+
+    @volume.setter
+    def volume(self, value):
+        self._volume = max(0, min(100, int(value)))
+
+    def synthesize(self, text):
+        """Render text to an AudioBuffer without playing it.
+
+        May be called from several worker threads at once.
+        """
+        raise NotImplementedError
+
+    def start(self, buffer):
+        """Begin playing a rendered buffer and return immediately."""
+        raise NotImplementedError
+
+    def wait(self, timeout):
+        """Wait up to timeout seconds; True once the buffer is no longer playing.
+
+        on_chunk fires from here when a buffer plays to its end (not when it
+        was cut short by stop()).
+        """
+        raise NotImplementedError
+
+    def play(self, buffer):
+        """Play a rendered buffer, blocking until it finishes or stop() is called."""
+        self.start(buffer)
+        while not self.wait(0.05):
+            pass
+
+    def speak(self, text):
+        """Speak text, blocking until it finishes or stop() is called."""
+        self.play(self.synthesize(text))
+
+    def stop(self):
+        """Interrupt the current speak() or play() call."""
+        raise NotImplementedError
+
+    def _chunk_done(self, text, seconds):
+        if self.on_chunk:
+            self.on_chunk(text, seconds)
+
+
+class SapiEngine(SpeechEngine):
+    """Windows SAPI 5 voice."""
+
+    name = 'sapi'
+
+    def __init__(self):
+        import pythoncom
+        import win32com.client
+        super().__init__()
+        # Created on a startup thread, which needs COM initialized
+        pythoncom.CoInitialize()
+        self._client = win32com.client
+        self.speaker = win32com.client.Dispatch("SAPI.SpVoice")
+        self.voice = self.speaker.Voice.GetDescription()
+        self._local = threading.local()
+        self._buffer = None
+        self._stopped = False
+
+    @property
+    def rate(self):
+        return self._rate
+
+    @rate.setter
+    def rate(self, value):
+        self._rate = max(-10, min(10, int(value)))
+        self.speaker.Rate = self._rate
+
+    @property
+    def volume(self):
+        return self._volume
+
+    @volume.setter
+    def volume(self, value):
+        self._volume = max(0, min(100, int(value)))
+        self.speaker.Volume = self._volume
+
+    def _memory_stream(self):
+        stream = self._client.Dispatch("SAPI.SpMemoryStream")
+        audio_format = self._client.Dispatch("SAPI.SpAudioFormat")
+        audio_format.Type = SAFT22kHz16BitMono
+        stream.Format = audio_format
+        return stream
+
+    def _render_voice(self):
+        """Per-thread SpVoice used for off-screen rendering."""
+        voice = getattr(self._local, 'voice', None)
+        if voice is None:
+            import pythoncom
+            pythoncom.CoInitialize()
+            voice = self._client.Dispatch("SAPI.SpVoice")
+            self._local.voice = voice
+        return voice
+
+    def synthesize(self, text):
+        voice = self._render_voice()
+        voice.Rate = self._rate
+        stream = self._memory_stream()
+        voice.AudioOutputStream = stream
+        voice.Speak(text)
+        return AudioBuffer(bytes(stream.GetData()), SAMPLE_RATE, text)
+
+    def start(self, buffer):
+        stream = self._memory_stream()
+        stream.SetData(buffer.pcm)
+        self._stopped = False
+        self._buffer = buffer
+        self.speaker.SpeakStream(stream, SVSFlagsAsync)
+
+    def wait(self, timeout):
+        if self._buffer is None:
+            return True
+        if not self.speaker.WaitUntilDone(int(timeout * 1000)):
+            return False
+        buffer, self._buffer = self._buffer, None
+        if not self._stopped:
+            self._chunk_done(buffer.text, buffer.speech_seconds)
+        return True
+
+    def speak(self, text):
+        start = time.perf_counter()
+        self.speaker.Speak(text, SVSFlagsAsync)
+        last_word = -1
+        # Poll so word progress can be reported while the voice is talking
+        while not self.speaker.WaitUntilDone(50):
+            if self.on_word:
+                status = self.speaker.Status
+                if status.InputWordPosition != last_word:
+                    last_word = status.InputWordPosition
+                    self.on_word(last_word, status.InputWordLength)
+        self._chunk_done(text, time.perf_counter() - start)
+
+    def stop(self):
+        self._stopped = True
+        self.speaker.Speak("", SVSFPurgeBeforeSpeak)
+
+
+class LocalEngine(SpeechEngine):
+    """Deterministic engine that renders silent PCM of a modelled duration.
+
+    Needs no OS speech services, so the playback pipeline can run and be
+    measured headless. With realtime=True play() takes as long as the
+    audio would; otherwise it returns as soon as the audio is rendered.
+    If output_dir is set every chunk is also written out as a WAV file.
+    """
+
+    name = 'local'
+
+    def __init__(self, realtime=True, output_dir=None, sample_rate=SAMPLE_RATE):
+        super().__init__()
+        self.realtime = realtime
+        self.output_dir = output_dir
+        self.sample_rate = sample_rate
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._buffer = None
+
+        # Throughput counters
+        self.chunks_rendered = 0
+        self.audio_seconds = 0.0
+        self.render_seconds = 0.0
+
+    def duration(self, text):
+        """Modelled speaking time of text at the current rate."""
+        words = len(WORD_RE.findall(text))
+        return words / (WORDS_PER_SECOND * rate_factor(self.rate))
+
+    def render(self, text):
+        """Render text to 16-bit mono PCM bytes."""
+        samples = int(self.duration(text) * self.sample_rate)
+        return bytes(samples * 2)
+
+    def write_wav(self, path, pcm):
+        """Write PCM bytes produced by render() to a WAV file."""
+        with wave.open(path, 'wb') as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(self.sample_rate)
+            f.writeframes(pcm)
+
+    def synthesize(self, text):
+        start = time.perf_counter()
+        pcm = self.render(text)
+        with self._lock:
+            index = self.chunks_rendered
+            self.chunks_rendered += 1
+        if self.output_dir:
+            self.write_wav(os.path.join(self.output_dir, f"chunk_{index:06d}.wav"), pcm)
+        buffer = AudioBuffer(pcm, self.sample_rate, text)
+        with self._lock:
+            self.audio_seconds += buffer.duration
+            self.render_seconds += time.perf_counter() - start
+        return buffer
+
+    def start(self, buffer):
+        self._stop.clear()
+        self._buffer = buffer
+        self._started = time.perf_counter()
+        self._words = list(WORD_RE.finditer(buffer.text))
+        self._next_word = 0
+
+    def wait(self, timeout):
+        buffer = self._buffer
+        if buffer is None:
+            return True
+        deadline = time.perf_counter() + timeout
+        seconds = buffer.duration
+        per_word = seconds / len(self._words) if self._words else 0
+        while True:
+            elapsed = time.perf_counter() - self._started if self.realtime else seconds
+            # Emit word events that are due at their modelled times
+            while self._next_word < len(self._words) and self._next_word * per_word <= elapsed:
+                match = self._words[self._next_word]
+                self._next_word += 1
+                if self.on_word:
+                    self.on_word(match.start(), match.end() - match.start())
+            if elapsed >= seconds:
+                self._buffer = None
+                self._chunk_done(buffer.text, buffer.speech_seconds)
+                return True
+            due = self._started + min(seconds, self._next_word * per_word)
+            if self._stop.wait(max(0, min(due, deadline) - time.perf_counter())):
+                self._buffer = None
+                return True
+            if time.perf_counter() >= deadline:
+                return False
+
+    def stop(self):
+        self._stop.set()
+
+    def throughput(self):
+        """Seconds of audio rendered per second of render time."""
+        if not self.render_seconds:
+            return 0.0
+        return self.audio_seconds / self.render_seconds
+
+
+ENGINES = {
+    'sapi': SapiEngine,
+    'local': LocalEngine,
+}
+
+
+def create_engine(name=None, **kwargs):
+    """Create a speech engine, defaulting to SAPI on Windows."""
+    if name is None:
+        name = 'sapi' if sys.platform == 'win32' else 'local'
+    return ENGINES[name](**kwargs)
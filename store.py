@@ -0,0 +1,304 @@
+import os
+import sys
+import json
+import sqlite3
+import threading
+
+DB_FILE = 'audiobooks.db'
+APP_DIR = 'AudiobookPlayer'
+POSITION_FLUSH_INTERVAL = 5  # seconds between position writes
+
+# Columns stored directly; any other entry fields go in the JSON data column
+BOOK_COLUMNS = ('id', 'title', 'path', 'last_played')
+
+# What ties a bookmark to its text when the book is edited: the content id
+# of its chunk, the offset into that chunk and the text found there
+BOOKMARK_ANCHOR = ('chunk_id', 'chunk_offset', 'anchor')
+BOOKMARK_COLUMNS = ('id', 'position', 'timestamp') + BOOKMARK_ANCHOR
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS books (
+    id TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    path TEXT NOT NULL,
+    last_played TEXT,
+    data TEXT NOT NULL DEFAULT '{}'
+);
+CREATE INDEX IF NOT EXISTS books_last_played ON books(last_played);
+
+CREATE TABLE IF NOT EXISTS bookmarks (
+    id INTEGER PRIMARY KEY,
+    book_id TEXT NOT NULL,
+    position REAL NOT NULL,
+    timestamp TEXT,
+    chunk_id INTEGER,
+    chunk_offset INTEGER,
+    anchor TEXT
+);
+CREATE INDEX IF NOT EXISTS bookmarks_book ON bookmarks(book_id);
+
+CREATE TABLE IF NOT EXISTS positions (
+    book_id TEXT PRIMARY KEY,
+    position REAL NOT NULL,
+    chunk INTEGER NOT NULL DEFAULT 0,
+    updated TEXT
+);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def data_dir():
+    """Per-user directory for the database, indexes and caches."""
+    if sys.platform == 'win32':
+        base = os.environ.get('APPDATA') or os.path.expanduser('~')
+    else:
+        base = os.environ.get('XDG_DATA_HOME') or os.path.join(os.path.expanduser('~'), '.local', 'share')
+    return os.path.join(base, APP_DIR)
+
+
+def data_path(*parts):
+    return os.path.join(data_dir(), *parts)
+
+
+class Store:
+    """Library, bookmarks and playback positions in an embedded SQLite database.
+
+    Every change is a small incremental write to one row. The database runs
+    in WAL mode, so writes are atomic and readers never block the writer.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or data_path(DB_FILE)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self.db:
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.executescript(SCHEMA)
+            columns = {row['name'] for row in self.db.execute("PRAGMA table_info(bookmarks)")}
+            for column in BOOKMARK_ANCHOR:
+                if column not in columns:
+                    # Databases from before bookmarks had anchors
+                    kind = 'TEXT' if column == 'anchor' else 'INTEGER'
+                    self.db.execute(f"ALTER TABLE bookmarks ADD COLUMN {column} {kind}")
+
+    def close(self):
+        with self._lock:
+            self.db.close()
+
+    # Library
+
+    @staticmethod
+    def _book_row(book):
+        extra = {k: v for k, v in book.items() if k not in BOOK_COLUMNS}
+        return (book['id'], book['title'], book['path'], book.get('last_played'), json.dumps(extra))
+
+    @staticmethod
+    def _book_entry(row):
+        book = json.loads(row['data'])
+        book.update({column: row[column] for column in BOOK_COLUMNS})
+        return book
+
+    def books(self):
+        """All library entries as {book id: entry}, in insertion order."""
+        with self._lock:
+            rows = self.db.execute("SELECT * FROM books ORDER BY rowid").fetchall()
+        return {row['id']: self._book_entry(row) for row in rows}
+
+    def book(self, book_id):
+        """One library entry, or None."""
+        with self._lock:
+            row = self.db.execute("SELECT * FROM books WHERE id = ?", (book_id,)).fetchone()
+        return self._book_entry(row) if row else None
+
+    def save_book(self, book):
+        """Insert or update a single library entry."""
+        with self._lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO books (id, title, path, last_played, data) VALUES (?, ?, ?, ?, ?)",
+                self._book_row(book)
+            )
+
+    def save_books(self, books):
+        """Insert or update many entries in one transaction."""
+        with self._lock, self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO books (id, title, path, last_played, data) VALUES (?, ?, ?, ?, ?)",
+                [self._book_row(book) for book in books]
+            )
+
+    def delete_book(self, book_id):
+        with self._lock, self.db:
+            self.db.execute("DELETE FROM books WHERE id = ?", (book_id,))
+            self.db.execute("DELETE FROM bookmarks WHERE book_id = ?", (book_id,))
+            self.db.execute("DELETE FROM positions WHERE book_id = ?", (book_id,))
+
+    def last_played_id(self):
+        """Id of the most recently played book (uses the last_played index)."""
+        with self._lock:
+            row = self.db.execute(
+                "SELECT id FROM books WHERE last_played IS NOT NULL ORDER BY last_played DESC LIMIT 1"
+            ).fetchone()
+        return row['id'] if row else None
+
+    # Bookmarks
+
+    def bookmarks(self):
+        """All bookmarks as {book id: [bookmark, ...]}."""
+        with self._lock:
+            rows = self.db.execute(
+                f"SELECT book_id, {', '.join(BOOKMARK_COLUMNS)} FROM bookmarks ORDER BY id"
+            ).fetchall()
+        result = {}
+        for row in rows:
+            result.setdefault(row['book_id'], []).append(
+                {column: row[column] for column in BOOKMARK_COLUMNS})
+        return result
+
+    def book_bookmarks(self, book_id):
+        """One book's bookmarks, oldest first."""
+        with self._lock:
+            rows = self.db.execute(
+                f"SELECT {', '.join(BOOKMARK_COLUMNS)} FROM bookmarks WHERE book_id = ? ORDER BY id",
+                (book_id,)
+            ).fetchall()
+        return [{column: row[column] for column in BOOKMARK_COLUMNS} for row in rows]
+
+    def add_bookmark(self, book_id, bookmark):
+        """Store a bookmark and record its row id on it."""
+        with self._lock, self.db:
+            cursor = self.db.execute(
+                "INSERT INTO bookmarks (book_id, position, timestamp, chunk_id, chunk_offset, anchor)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (book_id, bookmark['position'], bookmark.get('timestamp'),
+                 *(bookmark.get(column) for column in BOOKMARK_ANCHOR))
+            )
+        bookmark['id'] = cursor.lastrowid
+        return bookmark
+
+    def move_bookmarks(self, bookmarks):
+        """Save new positions and anchors of bookmarks (after their book was edited)."""
+        with self._lock, self.db:
+            self.db.executemany(
+                "UPDATE bookmarks SET position = ?, chunk_id = ?, chunk_offset = ?, anchor = ? WHERE id = ?",
+                [(b['position'], *(b.get(column) for column in BOOKMARK_ANCHOR), b['id'])
+                 for b in bookmarks]
+            )
+
+    # Playback positions
+
+    def save_position(self, book_id, position, chunk, updated):
+        with self._lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO positions (book_id, position, chunk, updated) VALUES (?, ?, ?, ?)",
+                (book_id, position, chunk, updated)
+            )
+
+    def save_positions(self, rows, book=None):
+        """Write many (book_id, position, chunk, updated) rows in one transaction.
+
+        book, if given, is a library entry saved in the same transaction.
+        """
+        with self._lock, self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO positions (book_id, position, chunk, updated) VALUES (?, ?, ?, ?)",
+                rows
+            )
+            if book is not None:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO books (id, title, path, last_played, data) VALUES (?, ?, ?, ?, ?)",
+                    self._book_row(book)
+                )
+
+    def position(self, book_id):
+        """(position, chunk) last saved for a book, or None."""
+        with self._lock:
+            row = self.db.execute(
+                "SELECT position, chunk FROM positions WHERE book_id = ?", (book_id,)
+            ).fetchone()
+        return (row['position'], row['chunk']) if row else None
+
+    # Migration
+
+    def migrate_json(self, library_path='library.json', bookmarks_path='bookmarks.json'):
+        """Import the old JSON files once; later calls are no-ops."""
+        with self._lock:
+            done = self.db.execute("SELECT value FROM meta WHERE key = 'json_migrated'").fetchone()
+        if done:
+            return False
+
+        library, bookmarks = {}, {}
+        try:
+            if os.path.exists(library_path):
+                with open(library_path, 'r') as f:
+                    library = json.load(f)
+            if os.path.exists(bookmarks_path):
+                with open(bookmarks_path, 'r') as f:
+                    bookmarks = json.load(f)
+        except Exception as e:
+            print(f"Error reading JSON data for migration: {str(e)}")
+            return False
+
+        with self._lock, self.db:
+            self.db.executemany(
+                "INSERT OR IGNORE INTO books (id, title, path, last_played, data) VALUES (?, ?, ?, ?, ?)",
+                [self._book_row(book) for book in library.values()]
+            )
+            self.db.executemany(
+                "INSERT INTO bookmarks (book_id, position, timestamp) VALUES (?, ?, ?)",
+                [(book_id, b['position'], b.get('timestamp'))
+                 for book_id, marks in bookmarks.items() for b in marks]
+            )
+            self.db.execute("INSERT INTO meta (key, value) VALUES ('json_migrated', '1')")
+        if library or bookmarks:
+            print(f"Migrated {len(library)} books and bookmarks for {len(bookmarks)} books from JSON")
+        return True
+
+
+class PositionWriter:
+    """Write-behind buffer for playback positions.
+
+    record() only updates memory, so it is cheap enough to call on every
+    chunk. A background thread writes whatever changed at most every
+    `interval` seconds; flush() forces a write (pause, sleep timer, exit),
+    together with a library entry that changed at the same time.
+    """
+
+    def __init__(self, store, interval=POSITION_FLUSH_INTERVAL):
+        self.store = store
+        self.interval = interval
+        self._pending = {}  # book id -> (position, chunk, updated)
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='position-writer', daemon=True)
+        self._thread.start()
+
+    def record(self, book_id, position, chunk, updated):
+        with self._lock:
+            self._pending[book_id] = (position, chunk, updated)
+
+    def flush(self, book=None):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending and book is None:
+            return
+        try:
+            self.store.save_positions(
+                [(book_id, *values) for book_id, values in pending.items()], book)
+        except Exception as e:
+            print(f"Error saving positions: {str(e)}")
+
+    def close(self):
+        self._closed.set()
+        self._thread.join(timeout=1)
+        self.flush()
+
+    def _run(self):
+        while not self._closed.wait(self.interval):
+            self.flush()
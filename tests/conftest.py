@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Modules resolve the data directory when imported; tests never touch the real one
+os.environ['XDG_DATA_HOME'] = os.environ['APPDATA'] = tempfile.mkdtemp(prefix='audiobook-tests-')
@@ -0,0 +1,33 @@
+import os
+import json
+import wave
+
+from audio_cache import INDEX_FILE, AudioCache
+from speech import AudioBuffer
+
+
+def test_put_and_get_round_trip(tmp_path):
+    cache = AudioCache(str(tmp_path))
+    cache.put('ab' * 32, AudioBuffer(b'\x01\x00' * 100, 22050, None))
+    buffer = cache.get('ab' * 32)
+    assert buffer.pcm == b'\x01\x00' * 100
+    assert buffer.sample_rate == 22050
+    assert cache.get('cd' * 32) is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_unreadable_entry_is_dropped_from_the_saved_index(tmp_path, monkeypatch):
+    cache = AudioCache(str(tmp_path))
+    key = 'ab' * 32
+    cache.put(key, AudioBuffer(b'\0\0' * 100, 22050, None))
+
+    def damaged(path, mode):
+        # The index is saved between the lookup and the failed read
+        cache.save_index()
+        raise wave.Error("file does not start with RIFF id")
+    monkeypatch.setattr(wave, 'open', damaged)
+    assert cache.get(key) is None
+    cache.save_index()
+    with open(os.path.join(str(tmp_path), INDEX_FILE)) as f:
+        assert json.load(f) == []
+    assert cache.total_bytes == 0
@@ -0,0 +1,125 @@
+import os
+import random
+
+import pytest
+
+from audio_pack import (AudioPack, AudioPackWriter, available_codecs, chunk_ids, encode_chunk,
+                        open_pack, pack_path, read_segment, write_segment)
+from text_source import MappedText
+
+SAMPLE_RATE = 8000
+SETTINGS = {'engine': 'local', 'voice': 'None', 'rate': 1, 'volume': 100}
+
+
+def make_pcm(seconds, seed):
+    return random.Random(seed).randbytes(int(seconds * SAMPLE_RATE) * 2)
+
+
+@pytest.fixture
+def text(tmp_path):
+    path = tmp_path / 'book.txt'
+    path.write_text(''.join(f"Sentence number {i} of the book. " for i in range(60)))
+    text = MappedText(str(path), chunk_size=200)
+    yield text
+    text.close()
+
+
+def write_pack(path, text, codec='pcm', settings=SETTINGS):
+    """Pack of 2.5 seconds of noise per chunk; returns each chunk's PCM."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    writer = AudioPackWriter(path, codec, SAMPLE_RATE, chunk_ids(text), text.index.total_chars,
+                             settings)
+    pcm = []
+    for i in range(text.chunk_count):
+        pcm.append(make_pcm(2.5, i))
+        writer.add_chunk(encode_chunk(pcm[i], SAMPLE_RATE, text.chunk(i), codec))
+    writer.close()
+    return pcm
+
+
+def test_round_trip(tmp_path, text):
+    path = str(tmp_path / 'book.audiopack')
+    pcm = write_pack(path, text)
+    pack = AudioPack(path)
+    try:
+        assert pack.codec == 'pcm' and pack.sample_rate == SAMPLE_RATE
+        assert pack.matches(text)
+        assert pack.rendered_with(SETTINGS)
+        assert not pack.rendered_with(dict(SETTINGS, rate=3))
+        for i in range(text.chunk_count):
+            buffer = pack.read(i, 0, text.chunk(i))
+            assert buffer.pcm == pcm[i]
+            assert buffer.index == i and buffer.text == text.chunk(i)
+            assert pack.duration(i) == pytest.approx(2.5)
+    finally:
+        pack.close()
+    assert pack.read(0) is None
+
+
+def test_read_from_inside_a_chunk_starts_at_its_frame(tmp_path, text):
+    path = str(tmp_path / 'book.audiopack')
+    pcm = write_pack(path, text)
+    pack = AudioPack(path)
+    try:
+        chunk = text.chunk(1)
+        middle = len(chunk) // 2
+        frame = pack.seek(1, middle)
+        first = pack.chunk_frames[1]
+        assert frame > first
+        buffer = pack.read(1, middle, chunk)
+        skipped = (frame - first) * pack.frame_samples[first] * 2
+        assert buffer.pcm == pcm[1][skipped:]
+        assert chunk.endswith(buffer.text) and len(buffer.text) < len(chunk)
+    finally:
+        pack.close()
+
+
+@pytest.mark.parametrize('codec', available_codecs())
+def test_every_available_codec_decodes_to_the_same_length(tmp_path, text, codec):
+    path = str(tmp_path / 'book.audiopack')
+    pcm = write_pack(path, text, codec)
+    pack = AudioPack(path)
+    try:
+        assert pack.codec == codec
+        assert len(pack.read(0).pcm) == len(pcm[0])
+    finally:
+        pack.close()
+
+
+def test_edited_text_keeps_the_chunks_it_did_not_change(tmp_path, text):
+    directory = str(tmp_path / 'rendered')
+    write_pack(pack_path('b1', directory), text)
+    edited_path = tmp_path / 'edited.txt'
+    original = open(text.path, encoding='utf-8').read()
+    edited_path.write_text(original.replace('Sentence number 30 ', 'Sentence 30, changed, '))
+    edited = MappedText(str(edited_path), chunk_size=200)
+    pack = open_pack('b1', edited, directory, SETTINGS)
+    try:
+        missing = [i for i in range(edited.chunk_count) if not pack.has(i)]
+        assert len(missing) == 1
+        assert 'changed' in edited.chunk(missing[0])
+        assert pack.read(missing[0]) is None
+        kept = 0 if missing[0] else 1
+        assert pack.read(kept, 0, edited.chunk(kept)).text == text.chunk(kept)
+    finally:
+        pack.close()
+        edited.close()
+
+
+def test_open_pack_skips_other_settings_and_missing_packs(tmp_path, text):
+    directory = str(tmp_path / 'rendered')
+    assert open_pack('b1', text, directory) is None
+    write_pack(pack_path('b1', directory), text)
+    assert open_pack('b1', text, directory, dict(SETTINGS, voice='other')) is None
+    pack = open_pack('b1', text, directory, SETTINGS)
+    assert pack is not None
+    pack.close()
+
+
+def test_segment_round_trip(tmp_path):
+    frames = encode_chunk(make_pcm(2.5, 0), SAMPLE_RATE, "Some words to speak.", 'pcm')
+    path = str(tmp_path / 'chunk.seg')
+    write_segment(path, frames, 'pcm')
+    assert read_segment(path, 'pcm') == frames
+    with pytest.raises(ValueError):
+        read_segment(path, 'adpcm')
@@ -0,0 +1,105 @@
+import random
+
+from chunker import CHUNK_SIZE, ChunkIndex, build_index, chunk_hash
+
+WORDS = "the quick brown fox jumps over a lazy dog while reading long books aloud to everyone".split()
+
+
+def make_text(seed=0, sentences=400):
+    rng = random.Random(seed)
+    parts = []
+    for _ in range(sentences):
+        sentence = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(5, 20)))
+        parts.append(sentence.capitalize() + rng.choice('.!?') + ('\n\n' if rng.random() < 0.1 else ' '))
+    return ''.join(parts).encode('utf-8')
+
+
+def check_covers(index, data):
+    """Chunks are contiguous, cover the whole text and carry their content ids."""
+    offsets = index.byte_offsets
+    assert offsets[0] == 0 and offsets[-1] == len(data)
+    assert len(index.hashes) == len(index.durations) == len(index)
+    for i in range(len(index)):
+        chunk = data[offsets[i]:offsets[i + 1]]
+        assert chunk
+        assert index.hashes[i] == chunk_hash(chunk)
+        chars = len(chunk.decode('utf-8'))
+        assert index.char_offsets[i + 1] - index.char_offsets[i] == chars
+
+
+def test_chunks_cover_text_at_sentence_ends():
+    data = make_text()
+    index = build_index(data)
+    check_covers(index, data)
+    assert index.total_chars == len(data)
+    for i in range(len(index) - 1):
+        end = index.byte_offsets[i + 1]
+        assert end - index.byte_offsets[i] <= CHUNK_SIZE * 3 // 2
+        assert data[end - 1:end].isspace()
+
+
+def test_char_offsets_count_characters_not_bytes():
+    data = ("Café naïve … résumé. " * 500).encode('utf-8')
+    index = build_index(data)
+    check_covers(index, data)
+    assert index.total_chars == len(data.decode('utf-8'))
+
+
+def test_save_and_load_round_trip(tmp_path):
+    index = build_index(make_text())
+    path = str(tmp_path / 'book.idx')
+    index.save(path, 1234, 5678.5)
+
+    loaded = ChunkIndex.load(path)
+    assert loaded.source == (1234, 5678.5)
+    assert loaded.target == index.target
+    assert list(loaded.char_offsets) == list(index.char_offsets)
+    assert list(loaded.byte_offsets) == list(index.byte_offsets)
+    assert list(loaded.durations) == list(index.durations)
+    assert list(loaded.hashes) == list(index.hashes)
+
+    assert ChunkIndex.load(path, 1234, 5678.5) is not None
+    assert ChunkIndex.load(path, 1235, 5678.5) is None
+    assert ChunkIndex.load(str(tmp_path / 'missing.idx')) is None
+
+
+def test_load_rejects_other_formats(tmp_path):
+    path = tmp_path / 'book.idx'
+    path.write_bytes(b'not an index at all, just some bytes')
+    assert ChunkIndex.load(str(path)) is None
+
+
+def test_incremental_build_matches_fresh_build():
+    data = make_text()
+    old = build_index(data)
+    for at in (100, len(data) // 3, len(data) // 2):
+        edited = data[:at] + b'Some inserted words here. ' + data[at:]
+        incremental = build_index(edited, old=old)
+        fresh = build_index(edited)
+        check_covers(incremental, edited)
+        assert list(incremental.byte_offsets) == list(fresh.byte_offsets)
+        assert list(incremental.char_offsets) == list(fresh.char_offsets)
+        assert list(incremental.hashes) == list(fresh.hashes)
+
+
+def test_incremental_build_only_recuts_around_the_edit():
+    data = make_text()
+    old = build_index(data)
+    # Marks every duration that comes from the old index
+    old.durations = type(old.durations)(old.durations.typecode, [99.0] * len(old))
+    at = len(data) // 2
+    edited = data[:at] + b'Some inserted words here. ' + data[at:]
+    index = build_index(edited, old=old)
+
+    reused = [i for i in range(len(index)) if index.durations[i] == 99.0]
+    assert len(index) - len(reused) <= 3
+    assert set(index.hashes[i] for i in reused) <= set(old.hashes)
+    assert index.byte_offsets[reused[-1] + 1] == len(edited)
+
+
+def test_unchanged_text_reuses_every_chunk():
+    data = make_text()
+    old = build_index(data)
+    index = build_index(data, old=old)
+    assert list(index.hashes) == list(old.hashes)
+    assert list(index.byte_offsets) == list(old.byte_offsets)
@@ -0,0 +1,109 @@
+import queue
+import time
+
+import pytest
+
+from controller import PlaybackController
+from speech import LocalEngine
+from text_source import MappedText
+
+
+@pytest.fixture
+def text(tmp_path):
+    path = tmp_path / 'book.txt'
+    path.write_text(''.join(f"Sentence number {i} of the book. " for i in range(400)))
+    text = MappedText(str(path), chunk_size=200)
+    yield text
+    text.close()
+
+
+@pytest.fixture
+def controller(text):
+    # Shut down before the text it reads is closed
+    controller = PlaybackController(LocalEngine(realtime=True))
+    controller.events = queue.Queue()
+    controller.on_state = lambda state: controller.events.put(('state', state))
+    controller.on_chunk = lambda index, count: controller.events.put(('chunk', index))
+    yield controller
+    controller.shutdown()
+
+
+def wait_for(controller, event, timeout=5):
+    deadline = time.monotonic() + timeout
+    while True:
+        got = controller.events.get(timeout=max(0, deadline - time.monotonic()))
+        if got == event:
+            return
+
+
+def test_play_and_pause(controller, text):
+    controller.load(text)
+    controller.play()
+    wait_for(controller, ('state', 'playing'))
+    wait_for(controller, ('chunk', 0))
+    controller.pause()
+    wait_for(controller, ('state', 'paused'))
+    assert controller.state == 'paused'
+
+
+def test_commands_apply_in_the_middle_of_a_chunk(controller, text):
+    controller.load(text)
+    controller.play()
+    wait_for(controller, ('chunk', 0))
+    start = time.perf_counter()
+    controller.pause()
+    assert controller.sync()
+    # A chunk lasts seconds; the pause lands within a few polls
+    assert time.perf_counter() - start < 0.5
+    _, worst = controller.control_latency()
+    assert worst < 0.5
+
+
+def test_seek_while_playing_plays_from_the_target(controller, text):
+    controller.load(text)
+    controller.play()
+    wait_for(controller, ('chunk', 0))
+    target = text.chunk_count // 2
+    controller.seek(text.position_of(target))
+    wait_for(controller, ('chunk', target))
+    assert controller.chunk == target
+    assert controller.state == 'playing'
+
+
+def test_load_starts_at_the_position(controller, text):
+    target = text.chunk_count // 3
+    controller.load(text, text.position_of(target), 'b1')
+    controller.play()
+    wait_for(controller, ('chunk', target))
+    assert controller.book_id == 'b1'
+
+
+def test_stop_keeps_the_position(controller, text):
+    target = text.chunk_count // 3
+    controller.load(text, text.position_of(target))
+    controller.play()
+    wait_for(controller, ('chunk', target))
+    controller.stop()
+    wait_for(controller, ('state', 'stopped'))
+    assert controller.chunk == target
+    controller.play()
+    wait_for(controller, ('chunk', target))
+
+
+def test_pause_holds_the_position_inside_the_chunk(controller, text):
+    controller.load(text)
+    controller.play()
+    wait_for(controller, ('chunk', 0))
+    time.sleep(0.3)
+    controller.pause()
+    wait_for(controller, ('state', 'paused'))
+    assert text.position_of(0) < controller.position < text.position_of(1)
+
+
+def test_load_from_a_held_position_starts_inside_the_chunk(controller, text):
+    target = text.chunk_count // 2
+    middle = (text.position_of(target) + text.position_of(target + 1)) / 2
+    controller.load(text, middle)
+    controller.play()
+    wait_for(controller, ('chunk', target))
+    assert controller.current_position() >= middle
@@ -0,0 +1,85 @@
+import json
+import urllib.error
+import urllib.request
+
+import pytest
+
+from daemon import ApiError, DaemonServer, PlaybackDaemon
+from store import Store
+
+
+@pytest.fixture
+def daemon(tmp_path, monkeypatch):
+    # No old JSON library to migrate
+    monkeypatch.chdir(tmp_path)
+    store = Store(str(tmp_path / 'library.db'))
+    for book_id in ('b1', 'b2'):
+        path = tmp_path / f'{book_id}.txt'
+        path.write_text(f"A sentence of {book_id} to read aloud. " * 2000)
+        store.save_book({'id': book_id, 'title': book_id.upper(), 'path': str(path)})
+    daemon = PlaybackDaemon(store, engine='local', max_sessions=2, workers=2)
+    yield daemon
+    daemon.close()
+
+
+def test_session_plays_and_pauses_a_book(daemon):
+    status, session = daemon.handle('POST', ['sessions'], {'book_id': 'b1'})
+    assert status == 201
+    assert session['book_id'] == 'b1'
+    sid = session['id']
+    assert daemon.handle('POST', ['sessions', sid, 'play'], {})[1]['state'] == 'playing'
+    assert daemon.handle('POST', ['sessions', sid, 'seek'], {'position': 0.5})[1]['position'] >= 0.5
+    assert daemon.handle('POST', ['sessions', sid, 'pause'], {})[1]['state'] == 'paused'
+    daemon.handle('DELETE', ['sessions', sid], {})
+    assert daemon.store.position('b1')[0] >= 0.5
+
+
+def test_loading_another_book_closes_the_old_text(daemon):
+    _, session = daemon.handle('POST', ['sessions'], {'book_id': 'b1'})
+    playback = daemon.session(session['id']).playback
+    old = playback.text
+    daemon.handle('POST', ['sessions', session['id'], 'load'], {'book_id': 'b2'})
+    assert playback.text is not old
+    assert old._file.closed
+    assert not playback.text._file.closed
+
+
+def test_bad_requests(daemon):
+    with pytest.raises(ApiError) as error:
+        daemon.handle('POST', ['sessions'], {'book_id': 'missing'})
+    assert error.value.status == 404
+    # The session made for it is closed again
+    assert daemon.sessions == {}
+
+    _, session = daemon.handle('POST', ['sessions'], {})
+    for method, action, body, status in [('POST', 'speed', {'speed': 5}, 400),
+                                         ('POST', 'seek', {'position': 'x'}, 409),
+                                         ('POST', 'play', {}, 409),
+                                         ('POST', 'rewind', {}, 404)]:
+        with pytest.raises(ApiError) as error:
+            daemon.handle(method, ['sessions', session['id'], action], body)
+        assert error.value.status == status
+
+    daemon.handle('POST', ['sessions'], {})
+    with pytest.raises(ApiError) as error:
+        daemon.handle('POST', ['sessions'], {})
+    assert error.value.status == 503
+
+
+def test_http_api(daemon):
+    server = DaemonServer(daemon, port=0)
+    server.start()
+    try:
+        url = f'http://127.0.0.1:{server.port}'
+        with urllib.request.urlopen(f'{url}/library') as response:
+            assert sorted(book['id'] for book in json.load(response)) == ['b1', 'b2']
+        request = urllib.request.Request(f'{url}/sessions', method='POST',
+                                         data=json.dumps({'book_id': 'b2'}).encode())
+        with urllib.request.urlopen(request) as response:
+            assert response.status == 201
+            assert json.load(response)['book_id'] == 'b2'
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(f'{url}/sessions/99')
+        assert error.value.code == 404
+    finally:
+        server.close()
@@ -0,0 +1,91 @@
+import json
+import os
+import random
+import re
+
+import audio_pack
+import export
+from text_source import MappedText
+
+
+WORDS = "the quick brown fox jumps over a lazy dog while reading long books aloud to everyone".split()
+
+
+def make_book(path, sentences=400):
+    rng = random.Random(0)
+    parts = []
+    for _ in range(sentences):
+        sentence = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(5, 20)))
+        parts.append(sentence.capitalize() + '.' + ('\n\n' if rng.random() < 0.1 else ' '))
+    path.write_text(''.join(parts))
+    return str(path)
+
+
+def run_export(capsys, path, out_dir, *options):
+    """Export a book with the local engine; returns its chunk count, how many of
+    them were already rendered, and what the export printed."""
+    export.main([path, '-e', 'local', '-j', '1', '-o', str(out_dir),
+                 '--db', os.path.join(os.path.dirname(path), 'library.db'), *options])
+    output = capsys.readouterr().out
+    total, skipped = map(int, re.search(r"(\d+) chunks, (\d+) already rendered", output).groups())
+    return total, skipped, output
+
+
+def test_export_resumes_and_rerenders_only_what_changed(tmp_path, capsys):
+    path = make_book(tmp_path / 'book.txt')
+    out_dir = tmp_path / 'exports'
+    total, skipped, _ = run_export(capsys, path, out_dir)
+    assert total > 1 and skipped == 0
+
+    manifest = json.loads((out_dir / 'book' / 'manifest.json').read_text())
+    assert len(manifest['chunks']) == total
+    assert manifest['engine'] == 'local' and manifest['rate'] == 1
+    assert all((out_dir / 'book' / chunk['file']).exists() for chunk in manifest['chunks'])
+
+    assert run_export(capsys, path, out_dir)[:2] == (total, total)
+
+    text = open(path, encoding='utf-8').read()
+    middle = len(text) // 2
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text[:middle] + "A new passage in the middle. " * 40 + text[middle:])
+    before = total
+    total, skipped, output = run_export(capsys, path, out_dir)
+    assert "source changed" in output
+    # Chunks after the new ones are renumbered, not rendered again
+    assert total > before
+    assert 0 < total - skipped <= 3
+    files = [name for name in os.listdir(out_dir / 'book') if name.endswith('.wav')]
+    assert len(files) == total
+
+
+def test_other_render_settings_are_rendered_again(tmp_path, capsys):
+    path = make_book(tmp_path / 'book.txt', sentences=150)
+    out_dir = tmp_path / 'exports'
+    total, _, _ = run_export(capsys, path, out_dir)
+    total, skipped, output = run_export(capsys, path, out_dir, '--rate', '5')
+    assert skipped == 0
+    assert "other engine, voice, rate or volume" in output
+    manifest = json.loads((out_dir / 'book' / 'manifest.json').read_text())
+    assert manifest['rate'] == 5
+    # Segments of the old rate are removed
+    assert len([name for name in os.listdir(out_dir / 'book') if name.endswith('.wav')]) == total
+
+
+def test_pack_export_resumes_from_the_pack(tmp_path, capsys):
+    path = make_book(tmp_path / 'book.txt', sentences=150)
+    out_dir = tmp_path / 'rendered'
+    total, skipped, _ = run_export(capsys, path, out_dir, '-f', 'pack', '--codec', 'pcm')
+    assert skipped == 0
+    # Frame files are joined into the pack and removed
+    assert sorted(os.listdir(out_dir / 'book')) == sorted([audio_pack.PACK_FILE, 'manifest.json'])
+
+    assert run_export(capsys, path, out_dir, '-f', 'pack', '--codec', 'pcm')[:2] == (total, total)
+    text = MappedText(path)
+    settings = audio_pack.render_settings(export.export_engine('local', 1, 100))
+    pack = audio_pack.open_pack('book', text, str(out_dir), settings)
+    try:
+        assert pack is not None and pack.matches(text)
+        assert pack.read(0, 0, text.chunk(0)).duration > 0
+    finally:
+        pack.close()
+        text.close()
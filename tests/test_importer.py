@@ -0,0 +1,68 @@
+import pytest
+
+from chunker import ChunkIndex
+from importer import LibraryImporter, detect_encoding, iter_book_files, prescan
+from store import Store
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = Store(str(tmp_path / 'library.db'))
+    yield store
+    store.close()
+
+
+def run_import(store, paths, known_books=()):
+    batches, done = [], []
+    importer = LibraryImporter(store, known_books, batches.append, done.extend, workers=2,
+                               batch_size=2)
+    importer.run([str(path) for path in paths])
+    return batches, done
+
+
+def test_folders_are_walked_for_books(tmp_path):
+    (tmp_path / 'shelf' / 'inner').mkdir(parents=True)
+    for name in ('shelf/b.txt', 'shelf/a.TXT', 'shelf/notes.md', 'shelf/inner/c.epub'):
+        (tmp_path / name).write_text('x')
+    found = [path[len(str(tmp_path)) + 1:] for path in iter_book_files([str(tmp_path / 'shelf')])]
+    assert found == ['shelf/a.TXT', 'shelf/b.txt', 'shelf/inner/c.epub']
+
+
+def test_encoding_is_detected():
+    assert detect_encoding('Café naïve'.encode('utf-8')) == 'utf-8'
+    assert detect_encoding('Café naïve'.encode('cp1252')) == 'cp1252'
+
+
+def test_prescan_indexes_a_text(tmp_path):
+    path = tmp_path / 'My Book.txt'
+    path.write_text("Some words to read. " * 500, encoding='cp1252')
+    book = prescan(str(path))
+    assert book['title'] == 'My Book'
+    assert book['id'] == book['hash'][:16]
+    assert book['words'] > 0 and book['chars'] == 20 * 500
+    assert len(ChunkIndex.load(book['index'])) > 1
+    (tmp_path / 'empty.txt').write_bytes(b'')
+    assert prescan(str(tmp_path / 'empty.txt')) is None
+
+
+def test_import_adds_books_in_batches_and_skips_duplicates(tmp_path, store):
+    for i in range(5):
+        (tmp_path / f'book{i}.txt').write_text(f"Book number {i}. " * 100)
+    (tmp_path / 'copy.txt').write_text("Book number 0. " * 100)
+    batches, done = run_import(store, [tmp_path])
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+    assert sorted(done) == sorted(store.books())
+    assert len(done) == 5
+
+    batches, done = run_import(store, [tmp_path], store.books().values())
+    assert batches == [] and done == []
+
+
+def test_books_without_a_hash_are_hashed_before_deduping(tmp_path, store):
+    path = tmp_path / 'old.txt'
+    path.write_text("A book from the old JSON library. " * 100)
+    # As migrated from library.json: no content hash
+    store.save_book({'id': 'old', 'title': 'old', 'path': str(path)})
+    batches, done = run_import(store, [path], store.books().values())
+    assert done == []
+    assert store.books()['old']['hash']
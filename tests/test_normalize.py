@@ -0,0 +1,76 @@
+import pytest
+
+from normalize import normalize
+
+
+def test_plain_text_maps_one_to_one():
+    spoken = normalize("Plain text, nothing to change.")
+    assert spoken.text == "Plain text, nothing to change."
+    assert [spoken.to_original(i) for i in range(len(spoken.text))] == list(range(len(spoken.text)))
+
+
+def test_removed_text_is_skipped():
+    original = "An exam-\nple of text."
+    spoken = normalize(original)
+    assert spoken.text == "An example of text."
+    # "ple" follows the removed hyphen and line break
+    p = spoken.text.index('ple')
+    assert spoken.to_original(p) == original.index('ple')
+    assert spoken.to_original(len(spoken.text) - 1) == len(original) - 1
+
+
+def test_replacement_maps_to_what_it_replaced():
+    original = "Ask Dr. Smith now."
+    spoken = normalize(original)
+    assert spoken.text == "Ask Doctor Smith now."
+    for i in range(spoken.text.index('Doctor'), spoken.text.index('Doctor') + len('Doctor')):
+        assert spoken.to_original(i) == original.index('Dr.')
+    assert spoken.to_original(spoken.text.index('Smith')) == original.index('Smith')
+
+
+@pytest.mark.parametrize('original', [
+    "It costs 12,345 coins.",
+    "Read pages 10-20 first.",
+    "Line one\nline two.",
+    "Ask Dr. Smith, e.g. at 5-6 pm, about 1,000 things.",
+])
+def test_offsets_map_back_in_order(original):
+    spoken = normalize(original)
+    mapped = [spoken.to_original(i) for i in range(len(spoken.text))]
+    assert mapped == sorted(mapped)
+    assert all(0 <= offset <= len(original) for offset in mapped)
+    assert spoken.text.endswith(' ' + original.split()[-1])
+    assert mapped[-1] == len(original) - 1
+
+
+def test_to_spoken_inverts_to_original():
+    original = "Ask Dr. Smith, e.g. at 5-6 pm, about 1,000 things."
+    spoken = normalize(original)
+    for offset in range(len(original)):
+        i = spoken.to_spoken(offset)
+        assert i == len(spoken.text) or spoken.to_original(i) >= offset
+        assert i == 0 or spoken.to_original(i - 1) < offset
+    assert spoken.to_spoken(original.index('things')) == spoken.text.index('things')
+
+
+@pytest.mark.parametrize('original, expected', [
+    ("Read pages 10-20 first.", "Read pages 10 to 20 first."),
+    ("See pages 5-12.", "See pages 5 to 12."),
+    ("From 1990-95 it rained.", "From 1990 to 95 it rained."),
+    ("It lasted 1990–1995.", "It lasted 1990 to 1995."),
+    ("Open 5-6 pm.", "Open 5 to 6 pm."),
+])
+def test_ranges_are_read_as_ranges(original, expected):
+    assert normalize(original).text == expected
+
+
+@pytest.mark.parametrize('original', [
+    "Call 555-1234 now.",
+    "The score was 3-2.",
+    "Dated 2024-01-05.",
+    "Ratio 12-120.",
+])
+def test_other_hyphenated_numbers_are_kept(original):
+    spoken = normalize(original)
+    assert spoken.text == original
+    assert [spoken.to_original(i) for i in range(len(original))] == list(range(len(original)))
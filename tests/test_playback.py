@@ -0,0 +1,39 @@
+import pytest
+
+from playback import PlaybackEngine
+from speech import LocalEngine
+from store import PositionWriter, Store
+
+
+@pytest.fixture
+def engine(tmp_path):
+    store = Store(str(tmp_path / 'library.db'))
+    positions = PositionWriter(store, interval=60)
+    path = tmp_path / 'book.txt'
+    path.write_text("A sentence to read aloud, slowly. " * 2000)
+    book = {'id': 'b1', 'title': 'Book', 'path': str(path)}
+    store.save_book(book)
+    engine = PlaybackEngine(store, positions, speaker=LocalEngine())
+    assert engine.load(book)
+    yield engine
+    engine.close()
+    positions.close()
+    store.close()
+
+
+def test_pause_saves_the_position_and_the_book_in_one_write(engine):
+    engine.play()
+    engine.controller.sync()
+    engine.controller.seek(0.5)
+    engine.controller.sync()
+
+    started = []
+    engine.store.db.set_trace_callback(lambda sql: started.append(sql) if sql.startswith('BEGIN') else None)
+    engine.pause()
+    engine.controller.sync()
+    engine.store.db.set_trace_callback(None)
+
+    assert len(started) == 1
+    position, chunk = engine.store.position('b1')
+    assert position == pytest.approx(0.5, abs=0.01)
+    assert engine.store.books()['b1']['last_played'] == engine.book['last_played']
@@ -0,0 +1,102 @@
+import threading
+import time
+
+import pytest
+
+from normalize import normalize
+from prerender import PrerenderPipeline
+from speech import LocalEngine
+from text_source import MappedText
+
+
+class GatedEngine(LocalEngine):
+    """LocalEngine whose synthesis waits until the test lets it through."""
+
+    def __init__(self):
+        super().__init__(realtime=False)
+        self.gate = threading.Event()
+        self.spoken = []
+
+    def synthesize(self, text):
+        self.gate.wait(5)
+        self.spoken.append(text)
+        return super().synthesize(text)
+
+
+@pytest.fixture
+def text(tmp_path):
+    path = tmp_path / 'book.txt'
+    path.write_text(''.join(f"Sentence number {i} of the book. " for i in range(400)))
+    text = MappedText(str(path), chunk_size=200)
+    yield text
+    text.close()
+
+
+def test_chunks_come_in_order_then_end(text):
+    pipeline = PrerenderPipeline(LocalEngine(realtime=False), text)
+    try:
+        pipeline.start(0)
+        indexes = []
+        while (buffer := pipeline.next(timeout=5)) is not None:
+            assert buffer.text == text.chunk(buffer.index)
+            indexes.append(buffer.index)
+        assert indexes == list(range(text.chunk_count))
+    finally:
+        pipeline.close()
+
+
+def test_renders_at_most_lookahead_ahead(text):
+    engine = LocalEngine(realtime=False)
+    pipeline = PrerenderPipeline(engine, text, lookahead=2)
+    try:
+        pipeline.start(0)
+        assert pipeline.next(timeout=5).index == 0
+        # Two queued, one more held by the blocked feeder at most
+        time.sleep(0.2)
+        assert engine.chunks_rendered <= 4
+    finally:
+        pipeline.close()
+
+
+def test_seek_drops_audio_for_the_old_position(text):
+    engine = GatedEngine()
+    pipeline = PrerenderPipeline(engine, text, workers=1)
+    try:
+        pipeline.start(0)
+        target = text.chunk_count // 2
+        pipeline.start(target)
+        engine.gate.set()
+        assert pipeline.next(timeout=5).index == target
+        assert pipeline.next(timeout=5).index == target + 1
+        # Only the chunk already being synthesized was rendered for the old start
+        chunks = {normalize(text.chunk(i)).text: i for i in range(text.chunk_count)}
+        rendered = [chunks[spoken] for spoken in engine.spoken]
+        assert all(i >= target for i in rendered[1:])
+    finally:
+        pipeline.close()
+
+
+def test_cancel_stops_playback_until_restarted(text):
+    pipeline = PrerenderPipeline(LocalEngine(realtime=False), text)
+    try:
+        pipeline.start(0)
+        assert pipeline.next(timeout=5).index == 0
+        pipeline.cancel()
+        assert pipeline.next(timeout=5) is None
+        pipeline.start(3)
+        assert pipeline.next(timeout=5).index == 3
+    finally:
+        pipeline.close()
+
+
+def test_next_times_out_while_rendering(text):
+    engine = GatedEngine()
+    pipeline = PrerenderPipeline(engine, text)
+    try:
+        pipeline.start(0)
+        with pytest.raises(TimeoutError):
+            pipeline.next(timeout=0.05)
+        engine.gate.set()
+        assert pipeline.next(timeout=5).index == 0
+    finally:
+        pipeline.close()
@@ -0,0 +1,90 @@
+import threading
+import time
+
+import pytest
+
+from scheduler import SynthesisScheduler
+
+
+class Session:
+    def __init__(self, deadline):
+        self._deadline = deadline
+
+    def deadline(self):
+        return self._deadline
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = SynthesisScheduler(workers=1)
+    yield scheduler
+    scheduler.shutdown()
+
+
+def blocked(scheduler):
+    """Occupy the single worker until the returned event is set."""
+    release, running = threading.Event(), threading.Event()
+
+    def block():
+        running.set()
+        release.wait(5)
+
+    scheduler.submit(Session(0), block)
+    assert running.wait(5)
+    return release
+
+
+def test_most_urgent_session_runs_first(scheduler):
+    release = blocked(scheduler)
+    order = []
+    now = time.monotonic()
+    late, soon = Session(now + 60), Session(now + 1)
+    futures = [scheduler.submit(late, order.append, 'late 1'),
+               scheduler.submit(late, order.append, 'late 2'),
+               scheduler.submit(soon, order.append, 'soon 1'),
+               scheduler.submit(soon, order.append, 'soon 2')]
+    release.set()
+    for future in futures:
+        future.result(timeout=5)
+    assert order == ['soon 1', 'soon 2', 'late 1', 'late 2']
+
+
+def test_equal_deadlines_take_turns(scheduler):
+    release = blocked(scheduler)
+    order = []
+    deadline = time.monotonic() + 10
+    a, b = Session(deadline), Session(deadline)
+    futures = [scheduler.submit(a, order.append, 'a') for _ in range(3)]
+    futures += [scheduler.submit(b, order.append, 'b') for _ in range(3)]
+    release.set()
+    for future in futures:
+        future.result(timeout=5)
+    assert order[:4] in (['a', 'b', 'a', 'b'], ['b', 'a', 'b', 'a'])
+
+
+def test_forget_cancels_a_sessions_tasks(scheduler):
+    release = blocked(scheduler)
+    session, other = Session(0), Session(0)
+    forgotten = [scheduler.submit(session, time.sleep, 0) for _ in range(3)]
+    kept = scheduler.submit(other, lambda: 'done')
+    scheduler.forget(session)
+    release.set()
+    assert kept.result(timeout=5) == 'done'
+    assert all(future.cancelled() for future in forgotten)
+
+
+def test_errors_reach_the_future(scheduler):
+    future = scheduler.submit(Session(0), lambda: 1 / 0)
+    with pytest.raises(ZeroDivisionError):
+        future.result(timeout=5)
+    assert scheduler.submit(Session(0), lambda: 'still working').result(timeout=5) == 'still working'
+
+
+def test_shutdown_cancels_queued_tasks_and_refuses_more(scheduler):
+    release = blocked(scheduler)
+    queued = scheduler.submit(Session(0), time.sleep, 0)
+    scheduler.shutdown()
+    release.set()
+    assert queued.cancelled()
+    with pytest.raises(RuntimeError):
+        scheduler.submit(Session(0), time.sleep, 0)
@@ -0,0 +1,105 @@
+import os
+import random
+
+import pytest
+
+from search import SearchIndex, fts_query, make_snippet
+from text_source import MappedText
+
+WORDS = "the quick brown fox jumps over a lazy dog while reading long books aloud to everyone".split()
+
+
+def make_book(tmp_path, book_id, sentences=300, seed=0):
+    rng = random.Random(seed)
+    parts = []
+    for _ in range(sentences):
+        sentence = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(5, 20)))
+        parts.append(sentence.capitalize() + '.' + ('\n\n' if rng.random() < 0.1 else ' '))
+    path = tmp_path / f'{book_id}.txt'
+    path.write_text(''.join(parts))
+    return {'id': book_id, 'title': book_id, 'path': str(path),
+            'index': str(tmp_path / f'{book_id}.idx')}
+
+
+def insert(book, at, words):
+    """Insert words at the first word start from at."""
+    with open(book['path'], encoding='utf-8') as f:
+        text = f.read()
+    at = text.index(' ', at) + 1
+    with open(book['path'], 'w', encoding='utf-8') as f:
+        f.write(text[:at] + words + text[at:])
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = SearchIndex(str(tmp_path / 'search.db'))
+    yield index
+    index.close()
+
+
+def passages(index, book_id):
+    return dict(index.db.execute(
+        "SELECT passage, chunk FROM passage_chunks WHERE book_id = ?", (book_id,)).fetchall())
+
+
+def test_query_and_snippet_helpers():
+    assert fts_query('lazy do') == '"lazy" "do"*'
+    assert fts_query(' ?! ') is None
+    passage = ' '.join(f'w{i}' for i in range(40))
+    assert make_snippet(passage, passage.index('w20'), words=4) == '…w18 w19 w20 w21…'
+    assert make_snippet('only a few words', 0) == 'only a few words'
+
+
+def test_search_finds_the_passage(tmp_path, index):
+    books = [make_book(tmp_path, 'b1'), make_book(tmp_path, 'b2', seed=1)]
+    insert(books[1], 5000, 'Zanzibar marmalade is mentioned once. ')
+    for book in books:
+        assert index.index_book(book)
+
+    results = index.search('zanzibar marm')
+    assert len(results) == 1
+    result = results[0]
+    assert result['book_id'] == 'b2'
+    with MappedText(books[1]['path']) as text:
+        assert text.chunk_at(result['position']) == result['chunk']
+        assert abs(result['char_offset'] - 5000) < 50
+    assert 'Zanzibar' in result['snippet']
+    assert index.search('') == []
+    assert index.search('nonexistentword') == []
+
+
+def test_only_changed_chunks_are_indexed_again(tmp_path, index):
+    book = make_book(tmp_path, 'b1')
+    assert index.index_book(book)
+    assert not index.index_book(book)
+    before = passages(index, 'b1')
+
+    insert(book, os.path.getsize(book['path']) // 2, 'A brand new sentence about zebras. ' * 40)
+    assert index.index_book(book)
+    after = passages(index, 'b1')
+    with MappedText(book['path'], index_path=book['index']) as text:
+        assert len(after) == text.chunk_count
+    assert 0 < len(set(after) - set(before)) <= 3
+    # Chunks after the insert keep their passages under new numbers
+    assert any(after[passage] != chunk for passage, chunk in before.items() if passage in after)
+    assert index.search('zebras')[0]['book_id'] == 'b1'
+
+
+def test_remove(tmp_path, index):
+    book = make_book(tmp_path, 'b1')
+    index.index_book(book)
+    index.remove('b1')
+    assert passages(index, 'b1') == {}
+    assert index.search('fox') == []
+    assert index.index_book(book)
+
+
+def test_background_indexing(tmp_path):
+    index = SearchIndex(str(tmp_path / 'search.db'))
+    index.enqueue([make_book(tmp_path, 'b1'), {'id': 'gone', 'title': 'gone', 'path': 'missing'}])
+    index.close()
+    index = SearchIndex(str(tmp_path / 'search.db'))
+    try:
+        assert index.search('lazy dog')
+    finally:
+        index.close()
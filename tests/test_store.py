@@ -0,0 +1,87 @@
+import json
+import time
+
+import pytest
+
+from store import PositionWriter, Store
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = Store(str(tmp_path / 'library.db'))
+    yield store
+    store.close()
+
+
+def count_transactions(store):
+    """List that collects every transaction store's connection starts."""
+    started = []
+    store.db.set_trace_callback(lambda sql: started.append(sql) if sql.startswith('BEGIN') else None)
+    return started
+
+
+def test_books_round_trip(store):
+    book = {'id': 'b1', 'title': 'Book', 'path': '/books/b1.txt', 'hash': 'abc', 'size': 10}
+    store.save_book(book)
+    assert store.books() == {'b1': dict(book, last_played=None)}
+    store.delete_book('b1')
+    assert store.books() == {}
+
+
+def test_positions_are_written_behind(store):
+    writer = PositionWriter(store, interval=60)
+    try:
+        for i in range(100):
+            writer.record('b1', i / 100, i, 'now')
+        assert store.position('b1') is None
+        writer.flush()
+        assert store.position('b1') == (0.99, 99)
+    finally:
+        writer.close()
+
+
+def test_positions_are_written_periodically(store):
+    writer = PositionWriter(store, interval=0.02)
+    try:
+        writer.record('b1', 0.5, 7, 'now')
+        deadline = time.monotonic() + 2
+        while store.position('b1') is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert store.position('b1') == (0.5, 7)
+    finally:
+        writer.close()
+
+
+def test_close_writes_what_is_pending(store):
+    writer = PositionWriter(store, interval=60)
+    writer.record('b1', 0.25, 3, 'now')
+    writer.record('b2', 0.75, 9, 'now')
+    writer.close()
+    assert store.position('b1') == (0.25, 3)
+    assert store.position('b2') == (0.75, 9)
+
+
+def test_flush_saves_a_book_with_the_positions_in_one_transaction(store):
+    writer = PositionWriter(store, interval=60)
+    try:
+        writer.record('b1', 0.5, 7, 'now')
+        started = count_transactions(store)
+        writer.flush({'id': 'b1', 'title': 'Book', 'path': 'b1.txt', 'last_played': 'now'})
+        assert len(started) == 1
+        assert store.position('b1') == (0.5, 7)
+        assert store.books()['b1']['last_played'] == 'now'
+        writer.flush()
+        assert len(started) == 1
+    finally:
+        writer.close()
+
+
+def test_json_library_is_migrated_once(store, tmp_path):
+    library_path = tmp_path / 'library.json'
+    bookmarks_path = tmp_path / 'bookmarks.json'
+    library_path.write_text(json.dumps({'b1': {'id': 'b1', 'title': 'Book', 'path': 'b1.txt'}}))
+    bookmarks_path.write_text(json.dumps({'b1': [{'position': 0.5, 'timestamp': 'then'}]}))
+    assert store.migrate_json(str(library_path), str(bookmarks_path))
+    assert list(store.books()) == ['b1']
+    assert [b['position'] for b in store.bookmarks()['b1']] == [0.5]
+    assert not store.migrate_json(str(library_path), str(bookmarks_path))
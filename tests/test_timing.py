@@ -0,0 +1,59 @@
+from array import array
+
+import pytest
+
+from chunker import ChunkIndex
+from speech import WORDS_PER_SECOND
+from timing import DurationModel, Timeline
+
+VOICE, RATE = 'voice', 0
+
+
+def make_timeline(estimates=None):
+    # Three chunks: 100 chars in 10 s, 200 chars in 20 s, 100 chars in 10 s
+    index = ChunkIndex(array('Q', [0, 100, 300, 400]), array('Q', [0, 100, 300, 400]),
+                       array('f', [10.0, 20.0, 10.0]))
+    return Timeline(index, DurationModel(estimates))
+
+
+def test_seconds_and_fractions_convert_both_ways():
+    timeline = make_timeline()
+    assert timeline.total_seconds(VOICE, RATE) == pytest.approx(40.0)
+    assert timeline.seconds_at(0.5, VOICE, RATE) == pytest.approx(20.0)
+    assert timeline.fraction_at(20.0, VOICE, RATE) == pytest.approx(0.5)
+
+
+def test_skip_moves_by_speech_time():
+    timeline = make_timeline()
+    assert timeline.skip(0.0, 10, VOICE, RATE) == pytest.approx(0.25)
+    # Into the slower-reading middle chunk: 10 s is only a quarter of it
+    assert timeline.skip(0.25, 10, VOICE, RATE) == pytest.approx(0.5)
+    assert timeline.skip(0.5, -15, VOICE, RATE) == pytest.approx(0.125)
+
+
+def test_skip_stops_at_the_ends():
+    timeline = make_timeline()
+    assert timeline.skip(0.1, -30, VOICE, RATE) == 0.0
+    assert timeline.skip(0.9, 30, VOICE, RATE) == 1.0
+
+
+def test_skip_back_and_forth_returns_to_start():
+    timeline = make_timeline()
+    for fraction in (0.05, 0.3, 0.6, 0.8):
+        there = timeline.skip(fraction, 7.5, VOICE, RATE)
+        assert timeline.skip(there, -7.5, VOICE, RATE) == pytest.approx(fraction)
+
+
+def test_skip_uses_calibrated_speed():
+    # The voice reads twice as fast as the estimates assume
+    timeline = make_timeline({f"{VOICE}|{RATE}": WORDS_PER_SECOND * 2})
+    assert timeline.total_seconds(VOICE, RATE) == pytest.approx(20.0)
+    assert timeline.skip(0.0, 5, VOICE, RATE) == pytest.approx(0.25)
+
+
+def test_refined_durations_are_picked_up():
+    timeline = make_timeline()
+    assert timeline.skip(0.0, 10, VOICE, RATE) == pytest.approx(0.25)
+    timeline.index.durations[0] = 20.0
+    timeline.index.version += 1
+    assert timeline.skip(0.0, 10, VOICE, RATE) == pytest.approx(0.125)
@@ -0,0 +1,103 @@
+import os
+import mmap
+import time
+
+import metrics
+from chunker import CHUNK_SIZE, ChunkIndex, build_index, index_path
+from store import data_path
+
+PAGE_CACHE_DIR = data_path('pages')
+
+BOOK_OPEN = metrics.histogram('audiobook_book_open_seconds', "Time to open a book for playback")
+
+
+class MappedText:
+    """Memory-mapped book text, decoded one chunk at a time.
+
+    Chunk boundaries come from a ChunkIndex; when index_path is given the
+    index is loaded from disk and only rebuilt if the file has changed,
+    reusing every chunk the change did not touch.
+    The encoding must be UTF-8 or a single-byte encoding.
+    """
+
+    chapters = ()
+
+    def __init__(self, path, chunk_size=CHUNK_SIZE, index_path=None, encoding='utf-8'):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.encoding = encoding
+        self._file = open(path, 'rb')
+        stat = os.fstat(self._file.fileno())
+        self.size = stat.st_size
+        if self.size:
+            self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            # mmap refuses empty files
+            self._data = b''
+
+        saved = ChunkIndex.load(index_path) if index_path else None
+        if saved and saved.source == (self.size, stat.st_mtime):
+            self.index = saved
+        else:
+            # An edited file is only re-chunked around its changes
+            self.index = build_index(self._data, chunk_size, encoding, saved)
+            if index_path:
+                try:
+                    self.index.save(index_path, self.size, stat.st_mtime)
+                except OSError as e:
+                    print(f"Error saving chunk index: {str(e)}")
+        self.offsets = self.index.byte_offsets
+
+    @property
+    def chunk_count(self):
+        return len(self.index)
+
+    def chunk(self, index):
+        """Decode and return the text of a single chunk."""
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return self._data[start:end].decode(self.encoding, errors='ignore')
+
+    def chunk_at(self, fraction):
+        """Return the chunk index for a position fraction (0-1)."""
+        return self.index.chunk_at(fraction)
+
+    def position_of(self, chunk):
+        """Return the position fraction (0-1) where a chunk starts."""
+        return self.index.fraction(chunk)
+
+    def close(self):
+        """Release the mapping and the underlying file."""
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._file.close()
+
+    def __len__(self):
+        return self.size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_source(book, prefetch=True):
+    """Open a library entry as a text source with the MappedText interface.
+
+    prefetch lets a PDF extract pages ahead of the ones asked for.
+    """
+    start = time.perf_counter()
+    if book['path'].lower().endswith('.epub'):
+        from epub_source import EpubText
+        text = EpubText(book['path'], index_path=index_path(book))
+    elif book['path'].lower().endswith('.pdf'):
+        # Imported lazily so pypdf is only needed for PDF books
+        from pdf_source import PdfText
+        text = PdfText(book['path'], os.path.join(PAGE_CACHE_DIR, book['id']), prefetch)
+    else:
+        text = MappedText(book['path'], index_path=index_path(book),
+                          encoding=book.get('encoding', 'utf-8'))
+    elapsed = time.perf_counter() - start
+    BOOK_OPEN.observe(elapsed)
+    metrics.trace('book_open', book=book['id'], seconds=elapsed, chunks=text.chunk_count)
+    return text
@@ -0,0 +1,110 @@
+"""Pitch-preserving time-stretch of rendered speech (WSOLA).
+
+Speed is applied to PCM after synthesis, so audio rendered (and cached)
+once can be played at any speed. Needs numpy; without it available()
+is False and callers fall back to changing the engine's speaking rate.
+"""
+import math
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from speech import AudioBuffer
+
+FRAME_SECONDS = 0.03  # analysis frame; two frames overlap in the output
+SEARCH = 0.5  # how far a frame may move to line up, as a fraction of the hop
+BATCH_FRAMES = 512  # frames matched per vectorized step (bounds memory)
+DECIMATE = 2  # frames are lined up on every second sample; plenty for speech
+
+
+def available():
+    return np is not None
+
+
+def rate_for_speed(speed):
+    """SAPI-style rate (-10 to 10) closest to a speed multiplier."""
+    # Inverse of speech.rate_factor
+    return max(-10, min(10, round(10 * math.log(speed, 3))))
+
+
+def stretch_pcm(pcm, sample_rate, speed):
+    """Time-stretch 16-bit mono PCM bytes; speed 2.0 plays twice as fast.
+
+    Output frames are laid down every `hop` samples with a Hann window,
+    and each is read from the input near `hop * speed` further on, moved
+    by up to SEARCH * hop to the offset where it best continues the frame
+    before it. The cross-correlations for every frame are computed in
+    batched FFTs over a decimated copy of the signal; only picking each
+    offset, which depends on the one before, is a loop.
+    """
+    if speed == 1.0 or not pcm:
+        return pcm
+    x = np.frombuffer(pcm, dtype='<i2').astype(np.float32)
+    frame = max(2, int(FRAME_SECONDS * sample_rate) // 2 * 2)
+    hop = frame // 2
+    search = max(1, int(hop * SEARCH))
+    window = (0.5 - 0.5 * np.cos(2 * np.pi * np.arange(frame) / frame)).astype(np.float32)
+
+    frames = max(1, int(math.ceil(len(x) / (hop * speed))))
+    # Padding keeps every template and search window inside the signal
+    pad = 2 * search + hop
+    x = np.concatenate([np.zeros(pad, np.float32), x,
+                        np.zeros(pad + frame + int(hop * speed) + 1, np.float32)])
+    nominal = pad + np.round(np.arange(frames) * hop * speed).astype(np.int64)
+
+    # correlation[k, s]: how well the input continuing frame k-1 (read at
+    # its nominal position) lines up with the input around frame k shifted
+    # by s - 2 * search. A frame k-1 moved by e is continued best at the
+    # shift d maximising correlation[k, d - e + 2 * search]. All in
+    # decimated samples.
+    xd = x[::DECIMATE]
+    d_frame, d_hop, d_search = frame // DECIMATE, hop // DECIMATE, max(1, search // DECIMATE)
+    d_nominal = nominal // DECIMATE
+    shifts = 4 * d_search + 1
+    span = d_frame + shifts - 1
+    size = 1 << (span + d_frame - 1).bit_length()
+    template_index = np.arange(d_frame)
+    window_index = np.arange(span) - 2 * d_search
+    offsets = [0] * frames
+    for start in range(1, frames, BATCH_FRAMES):
+        k = np.arange(start, min(frames, start + BATCH_FRAMES))
+        templates = xd[(d_nominal[k - 1] + d_hop)[:, None] + template_index]
+        windows = xd[d_nominal[k][:, None] + window_index]
+        spectrum = np.fft.rfft(windows, size) * np.conj(np.fft.rfft(templates, size))
+        correlation = np.fft.irfft(spectrum, size)[:, :shifts]
+        for row, i in enumerate(k.tolist()):
+            lo = d_search - offsets[i - 1]
+            offsets[i] = int(np.argmax(correlation[row, lo:lo + 2 * d_search + 1])) - d_search
+
+    # Overlap-add; with 50% overlap even and odd frames each tile the output
+    offsets = np.array(offsets) * DECIMATE
+    chosen = x[(nominal + offsets)[:, None] + np.arange(frame)] * window
+    y = np.zeros((frames + 1) * hop + frame, np.float32)
+    even = chosen[0::2].reshape(-1)
+    odd = chosen[1::2].reshape(-1)
+    y[:len(even)] += even
+    y[hop:hop + len(odd)] += odd
+    # Trim the half frame of padding and fade-in at the start
+    y = y[hop:hop + int(round(len(pcm) / 2 / speed))]
+    return np.clip(np.round(y), -32768, 32767).astype('<i2').tobytes()
+
+
+def stretch(buffer, speed, offset=0.0):
+    """Copy of an AudioBuffer starting `offset` seconds in, played at `speed`."""
+    buffer = buffer.source or buffer
+    pcm = buffer.pcm
+    text = buffer.text
+    if offset > 0:
+        skip = min(len(pcm) // 2, int(offset * buffer.sample_rate))
+        fraction = skip * 2 / len(pcm) if pcm else 0.0
+        pcm = pcm[skip * 2:]
+        # Roughly the words still to come, for word events and timing
+        text = text[int(len(text) * fraction):] if text else text
+    if speed != 1.0:
+        pcm = stretch_pcm(pcm, buffer.sample_rate, speed)
+    stretched = AudioBuffer(pcm, buffer.sample_rate, text, buffer.index)
+    stretched.speed = speed
+    stretched.source = buffer
+    return stretched
@@ -0,0 +1,112 @@
+from array import array
+from bisect import bisect_right
+
+from speech import WORD_RE, WORDS_PER_SECOND, rate_factor
+
+SMOOTHING = 0.2  # weight of each new measurement
+MIN_WORDS = 5  # ignore chunks too short to time reliably
+
+
+class DurationModel:
+    """Speaking speed in words per second for each voice and rate.
+
+    Starts from the nominal SAPI speed curve and is calibrated online from
+    the measured length of every chunk the engine plays.
+    """
+
+    def __init__(self, estimates=None):
+        self.estimates = dict(estimates or {})  # "voice|rate" -> words per second
+
+    @staticmethod
+    def _key(voice, rate):
+        return f"{voice}|{rate}"
+
+    def words_per_second(self, voice, rate):
+        wps = self.estimates.get(self._key(voice, rate))
+        if wps is None:
+            wps = WORDS_PER_SECOND * rate_factor(rate)
+        return wps
+
+    def observe(self, text, seconds, voice, rate):
+        """Fold the measured duration of a spoken chunk into the estimate."""
+        words = len(WORD_RE.findall(text))
+        if words < MIN_WORDS or seconds <= 0:
+            return
+        measured = words / seconds
+        key = self._key(voice, rate)
+        current = self.estimates.get(key)
+        if current is None:
+            self.estimates[key] = measured
+        else:
+            self.estimates[key] = current + SMOOTHING * (measured - current)
+
+    def to_dict(self):
+        return {key: round(wps, 4) for key, wps in self.estimates.items()}
+
+
+class Timeline:
+    """Converts between playback time and text position for one book.
+
+    Holds the cumulative sum of the chunk index's duration estimates, so
+    both directions are a binary search plus interpolation within a chunk.
+    The estimates are made at the nominal speed and scaled by the model's
+    calibrated speed for the current voice and rate. If the index's
+    durations are refined later (index.version), the sum is rebuilt on
+    next use.
+    """
+
+    def __init__(self, index, model):
+        self.index = index
+        self.model = model
+        self._prefix = None
+        self._version = None
+
+    @property
+    def prefix(self):
+        if self._version != self.index.version:
+            self._version = self.index.version
+            prefix = array('d', [0.0])
+            total = 0.0
+            for seconds in self.index.durations:
+                total += seconds
+                prefix.append(total)
+            self._prefix = prefix
+        return self._prefix
+
+    def _scale(self, voice, rate):
+        return WORDS_PER_SECOND / self.model.words_per_second(voice, rate)
+
+    def total_seconds(self, voice, rate):
+        return self.prefix[-1] * self._scale(voice, rate)
+
+    def seconds_at(self, fraction, voice, rate):
+        """Playback time at a position fraction (0-1)."""
+        index = self.index
+        if not len(index):
+            return 0.0
+        char = fraction * index.total_chars
+        i = index.chunk_at_char(char)
+        start, end = index.char_offsets[i], index.char_offsets[i + 1]
+        within = (char - start) / (end - start) if end > start else 0.0
+        within = max(0.0, min(1.0, within))
+        return (self.prefix[i] + within * index.durations[i]) * self._scale(voice, rate)
+
+    def fraction_at(self, seconds, voice, rate):
+        """Position fraction (0-1) reached after playing for the given time."""
+        index = self.index
+        if not len(index) or not index.total_chars:
+            return 0.0
+        prefix = self.prefix
+        t = max(0.0, seconds / self._scale(voice, rate))
+        if t >= prefix[-1]:
+            return 1.0
+        i = max(0, min(bisect_right(prefix, t) - 1, len(index) - 1))
+        duration = index.durations[i]
+        within = (t - prefix[i]) / duration if duration else 0.0
+        start, end = index.char_offsets[i], index.char_offsets[i + 1]
+        return (start + within * (end - start)) / index.total_chars
+
+    def skip(self, fraction, seconds, voice, rate):
+        """Position fraction after moving the given number of seconds from fraction."""
+        target = self.seconds_at(fraction, voice, rate) + seconds
+        return max(0.0, min(1.0, self.fraction_at(target, voice, rate)))
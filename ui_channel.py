@@ -0,0 +1,99 @@
+import time
+import threading
+from collections import deque
+
+import metrics
+
+FRAME_MS = 50  # redraw budget; updates are applied at most this often
+
+UI_LAG = metrics.histogram('audiobook_ui_lag_seconds', "How late the Tk main loop ran a UI frame")
+
+
+class UiChannel:
+    """Carries updates from worker threads to the Tk main loop.
+
+    Workers post (key, value) pairs from any thread. Only the latest value
+    per key is kept, and the main loop applies them every FRAME_MS through
+    app.after, so Tk widgets are only ever touched from the main thread and
+    bursts of progress events cost a single redraw. Updates that must not
+    be merged (e.g. batches of imported books) go through call() instead.
+    """
+
+    def __init__(self, app, frame_ms=FRAME_MS):
+        self.app = app
+        self.frame_ms = frame_ms
+        self._handlers = {}
+        self._pending = {}
+        self._calls = deque()
+        self._lock = threading.Lock()
+        self._running = False
+        self._due = None
+
+    def subscribe(self, key, handler):
+        """Call handler(value) on the main thread for updates posted under key."""
+        self._handlers[key] = handler
+
+    def post(self, key, value=None):
+        """Queue an update; replaces any not yet applied update for key."""
+        with self._lock:
+            self._pending.pop(key, None)
+            self._pending[key] = value
+
+    def call(self, fn, *args):
+        """Run fn(*args) on the main thread; every call is kept, in order."""
+        self._calls.append((fn, args))
+
+    def start(self):
+        if not self._running:
+            self._running = True
+            self._schedule()
+
+    def stop(self):
+        self._running = False
+
+    def _schedule(self):
+        self._due = time.perf_counter() + self.frame_ms / 1000
+        self.app.after(self.frame_ms, self._drain)
+
+    def _drain(self):
+        if self._due is not None:
+            # A busy main loop shows up as frames running late
+            UI_LAG.observe(max(0.0, time.perf_counter() - self._due))
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        # Apply in the order the keys were last posted
+        for key, value in pending.items():
+            handler = self._handlers.get(key)
+            if handler:
+                try:
+                    handler(value)
+                except Exception as e:
+                    print(f"Error applying {key} update: {str(e)}")
+        while self._calls:
+            fn, args = self._calls.popleft()
+            try:
+                fn(*args)
+            except Exception as e:
+                print(f"Error applying update: {str(e)}")
+        if self._running:
+            self._schedule()
+
+
+class LabelCache:
+    """Skips widget reconfiguration when the displayed value is unchanged."""
+
+    def __init__(self):
+        self._shown = {}
+
+    def configure(self, widget, **options):
+        key = id(widget)
+        if self._shown.get(key) != options:
+            self._shown[key] = options
+            widget.configure(**options)
+
+    def set(self, widget, value):
+        """Like configure() but for widgets updated through set() (progress bars)."""
+        key = id(widget)
+        if self._shown.get(key) != value:
+            self._shown[key] = value
+            widget.set(value)